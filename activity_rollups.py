@@ -0,0 +1,271 @@
+import os
+import time
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from firestore_client import LazyFirestoreClient
+from hyperloglog import HyperLogLog
+
+# Source documents written by the bot (one per flush, tagged with a dateKey)
+ACTIVITY_COLLECTION = "server_activity"
+# One pre-aggregated document per dateKey
+ROLLUP_COLLECTION = "server_activity_daily"
+# Cursor of the incremental refresh
+ROLLUP_STATE_DOC = ("rollup_state", "server_activity_daily")
+# Reads refresh the rollups inline at most this often
+ROLLUP_REFRESH_SECONDS = int(os.getenv("ACTIVITY_ROLLUP_REFRESH_SECONDS", "300"))
+# Bumped when the rollup layout changes; the next refresh then rebuilds every day
+ROLLUP_VERSION = 2
+# Windows up to this many days count unique users/channels exactly by default
+ACTIVITY_EXACT_MAX_DAYS = int(os.getenv("ACTIVITY_EXACT_MAX_DAYS", "7"))
+# Fields needed for totals and approximate unique counts (no per-user/channel maps)
+SKETCH_FIELDS = ("dateKey", "docCount", "totals", "userSketch", "channelSketch")
+
+_TOTAL_FIELDS = (
+    # (rollup field, rawData field)
+    ("messages", "messageCount"),
+    ("reactions", "reactionCount"),
+    ("voice_activity", "voiceActivityCount"),
+    ("interactions", "interactionCount"),
+)
+_USER_FIELDS = ("messages", "reactions", "voiceActivity", "interactions")
+_CHANNEL_FIELDS = ("messages", "reactions")
+
+
+def _num(value: Any) -> int:
+    return value if isinstance(value, (int, float)) else 0
+
+
+def empty_rollup(date_key: str) -> Dict[str, Any]:
+    return {
+        "dateKey": date_key,
+        "docCount": 0,
+        "totals": {"activities": 0, **{field: 0 for field, _ in _TOTAL_FIELDS}},
+        "users": {},
+        "channels": {},
+    }
+
+
+def add_activity(rollup: Dict[str, Any], activity: Dict[str, Any]) -> None:
+    """Fold one server_activity document into a daily rollup."""
+    rollup["docCount"] += 1
+    totals = rollup["totals"]
+    totals["activities"] += _num(activity.get("totalActivities", 0))
+    raw_data = activity.get("rawData") or {}
+    for field, raw_field in _TOTAL_FIELDS:
+        totals[field] += _num(raw_data.get(raw_field, 0))
+
+    summary = activity.get("summary") or {}
+    for user_id, user_data in (summary.get("userActivity") or {}).items():
+        user_data = user_data or {}
+        entry = rollup["users"].get(user_id)
+        if entry is None:
+            entry = rollup["users"][user_id] = {"username": None, **{f: 0 for f in _USER_FIELDS}}
+        if user_data.get("username"):
+            entry["username"] = user_data["username"]
+        for f in _USER_FIELDS:
+            entry[f] += _num(user_data.get(f, 0))
+
+    for channel_id, channel_data in (summary.get("channelActivity") or {}).items():
+        channel_data = channel_data or {}
+        entry = rollup["channels"].get(channel_id)
+        if entry is None:
+            entry = rollup["channels"][channel_id] = {"channelName": None, **{f: 0 for f in _CHANNEL_FIELDS}}
+        if channel_data.get("channelName"):
+            entry["channelName"] = channel_data["channelName"]
+        for f in _CHANNEL_FIELDS:
+            entry[f] += _num(channel_data.get(f, 0))
+
+
+def merge_rollups(rollups: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine daily rollups into one window:
+        {"days", "daysWithData", "docCount", "totals", "users", "channels"}
+    Per-user and per-channel counters are summed; names come from the latest day.
+    """
+    merged = empty_rollup("")
+    merged.pop("dateKey")
+    merged["days"] = 0
+    merged["daysWithData"] = 0
+    for rollup in sorted(rollups, key=lambda r: r.get("dateKey") or ""):
+        merged["days"] += 1
+        if rollup.get("docCount"):
+            merged["daysWithData"] += 1
+        merged["docCount"] += rollup.get("docCount", 0)
+        for field, value in (rollup.get("totals") or {}).items():
+            merged["totals"][field] = merged["totals"].get(field, 0) + _num(value)
+        for key, name_field, fields in (
+            ("users", "username", _USER_FIELDS),
+            ("channels", "channelName", _CHANNEL_FIELDS),
+        ):
+            target = merged[key]
+            for item_id, counters in (rollup.get(key) or {}).items():
+                entry = target.get(item_id)
+                if entry is None:
+                    entry = target[item_id] = {name_field: None, **{f: 0 for f in fields}}
+                if counters.get(name_field):
+                    entry[name_field] = counters[name_field]
+                for f in fields:
+                    entry[f] += _num(counters.get(f, 0))
+    return merged
+
+
+def unique_counts(rollups: Sequence[Dict[str, Any]], exact: bool = False) -> Dict[str, int]:
+    """
+    Distinct users and channels across rollups. Exact mode unions the
+    per-user/per-channel maps; otherwise the per-day HyperLogLog sketches are
+    merged, which works on rollups loaded with SKETCH_FIELDS only.
+    """
+    if exact:
+        users, channels = set(), set()
+        for rollup in rollups:
+            users.update(rollup.get("users") or ())
+            channels.update(rollup.get("channels") or ())
+        return {"users": len(users), "channels": len(channels)}
+    return {
+        "users": HyperLogLog.merged(HyperLogLog.from_bytes(r["userSketch"]) for r in rollups if r.get("userSketch")).count(),
+        "channels": HyperLogLog.merged(HyperLogLog.from_bytes(r["channelSketch"]) for r in rollups if r.get("channelSketch")).count(),
+    }
+
+
+def date_keys(start: date, end: date) -> List[str]:
+    """Inclusive list of YYYY-MM-DD keys from start to end."""
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+class ActivityRollups(LazyFirestoreClient):
+    """
+    Materialized daily rollups of `server_activity`.
+
+    Each `server_activity_daily/{dateKey}` document holds the day's totals and
+    per-user / per-channel counters, so a stats window is answered from one
+    document per day instead of every raw activity document. HyperLogLog
+    sketches of the day's user and channel ids let unique counts over long
+    windows be computed without loading the counter maps.
+
+    `refresh()` brings the rollups up to date: it finds the days that received
+    activity documents since the last run (a cheap dateKey/timestamp projection
+    of the new documents only) and rebuilds those days from their raw
+    documents. Rebuilding whole days keeps it idempotent. The first run
+    builds every day.
+    """
+
+    def __init__(self, db=None, refresh_seconds: int = ROLLUP_REFRESH_SECONDS):
+        self._db = db
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._last_refresh = 0.0
+
+    def _state_ref(self):
+        collection, doc_id = ROLLUP_STATE_DOC
+        return self.db.collection(collection).document(doc_id)
+
+    def build_day(self, date_key: str) -> Dict[str, Any]:
+        """Aggregate one day from its raw server_activity documents."""
+        rollup = empty_rollup(date_key)
+        query = self.db.collection(ACTIVITY_COLLECTION).where("dateKey", "==", date_key)
+        for doc in query.stream():
+            add_activity(rollup, doc.to_dict() or {})
+        rollup["version"] = ROLLUP_VERSION
+        rollup["userSketch"] = HyperLogLog().update(rollup["users"]).to_bytes()
+        rollup["channelSketch"] = HyperLogLog().update(rollup["channels"]).to_bytes()
+        return rollup
+
+    def rebuild(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Recompute and store the rollups of the given date keys."""
+        from bulk_writer import BulkWriter, set_op
+
+        col = self.db.collection(ROLLUP_COLLECTION)
+        updated_at = datetime.now(timezone.utc).isoformat()
+        rollups = [dict(self.build_day(k), updatedAt=updated_at) for k in sorted(set(keys))]
+        stats = BulkWriter(self.db, name="activity rollups", verbose=False).write(
+            set_op(col.document(r["dateKey"]), r) for r in rollups
+        )
+        return {"days": [r["dateKey"] for r in rollups], "writes": stats["ops"]}
+
+    def refresh(self) -> Dict[str, Any]:
+        """Rebuild the days that got new activity documents since the last refresh."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> Dict[str, Any]:
+        """refresh() without taking the lock; the caller holds it."""
+        started = time.perf_counter()
+        snap = self._state_ref().get()
+        state = (snap.to_dict() or {}) if snap.exists else {}
+        current = state.get("version") == ROLLUP_VERSION
+        cursor = state.get("lastTimestamp") if current else None
+        # Documents at the cursor's timestamp that were already rolled up
+        cursor_ids = set(state.get("cursorIds") or []) if current else set()
+
+        query = self.db.collection(ACTIVITY_COLLECTION)
+        if cursor:
+            # >= so documents sharing the cursor's timestamp are never missed; rebuilds are idempotent
+            query = query.where("timestamp", ">=", cursor)
+        touched = set()
+        last_timestamp = cursor
+        last_ids = set(cursor_ids)
+        for doc in query.select(["dateKey", "timestamp"]).stream():
+            data = doc.to_dict() or {}
+            ts = data.get("timestamp")
+            if ts == cursor and doc.id in cursor_ids:
+                continue
+            if data.get("dateKey"):
+                touched.add(data["dateKey"])
+            if isinstance(ts, str):
+                if last_timestamp is None or ts > last_timestamp:
+                    last_timestamp, last_ids = ts, {doc.id}
+                elif ts == last_timestamp:
+                    last_ids.add(doc.id)
+
+        result = self.rebuild(touched) if touched else {"days": [], "writes": 0}
+        if last_timestamp and (last_timestamp != cursor or last_ids != cursor_ids):
+            self._state_ref().set({
+                "lastTimestamp": last_timestamp,
+                "cursorIds": sorted(last_ids),
+                "version": ROLLUP_VERSION,
+                "refreshedAt": datetime.now(timezone.utc).isoformat(),
+            })
+        self._last_refresh = time.monotonic()
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        if touched:
+            print(f"[INFO] activity rollups: rebuilt {len(touched)} day(s) in {result['seconds']}s")
+        return result
+
+    def maybe_refresh(self) -> None:
+        """Refresh inline when the last refresh in this process is older than refresh_seconds."""
+        if time.monotonic() - self._last_refresh < self.refresh_seconds:
+            return
+        with self._lock:
+            # Concurrent requests wait here; only the first one refreshes
+            if time.monotonic() - self._last_refresh < self.refresh_seconds:
+                return
+            try:
+                self._refresh()
+            except Exception as e:
+                # Serve the stored rollups rather than failing the dashboard
+                print(f"[WARN] activity rollup refresh failed: {e}")
+                self._last_refresh = time.monotonic()
+
+    def window(self, start: date, end: date, fields: Optional[Sequence[str]] = None,
+               refresh: bool = True) -> List[Dict[str, Any]]:
+        """
+        Stored rollups for the dateKeys start..end (inclusive), oldest first;
+        days without data are omitted. `fields` limits the download to those
+        fields (e.g. SKETCH_FIELDS).
+        """
+        if refresh:
+            self.maybe_refresh()
+        query = self.db.collection(ROLLUP_COLLECTION)\
+            .where("dateKey", ">=", start.isoformat())\
+            .where("dateKey", "<=", end.isoformat())
+        if fields:
+            query = query.select(list(fields))
+        rollups = [doc.to_dict() or {} for doc in query.stream()]
+        rollups.sort(key=lambda r: r.get("dateKey") or "")
+        return rollups
+
+
+# Process-wide rollup store used by the stats endpoints
+activity_rollups = ActivityRollups()
@@ -0,0 +1,114 @@
+"""
+Throughput benchmark for ZwiftAPI against a local stand-in server.
+
+Starts a keep-alive HTTP server that imitates the Zwift token and profile
+endpoints, then fetches profiles from many threads sharing one ZwiftAPI:
+  - "pooled": the client's own keep-alive session (current behaviour)
+  - "bare":   one throwaway connection per request (previous behaviour)
+It also expires the token and checks that concurrent callers trigger a
+single refresh.
+
+Usage:
+    python bench_zwift_api.py [--requests 2000] [--threads 16] [--latency-ms 2]
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from zwift import ZwiftAPI
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    latency = 0.0
+    counts = {"token": 0, "profile": 0, "connections": 0}
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            self.counts["connections"] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.lock:
+            self.counts["token"] += 1
+        time.sleep(self.latency * 5)
+        self._send_json({"access_token": "bench", "refresh_token": "bench", "expires_in": 3600})
+
+    def do_GET(self):
+        with self.lock:
+            self.counts["profile"] += 1
+        time.sleep(self.latency)
+        profile_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+        self._send_json({"id": profile_id, "firstName": "Bench", "lastName": "Rider"})
+
+
+def _run(api, n_requests, n_threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        results = list(pool.map(api.get_profile, range(n_requests)))
+    elapsed = time.perf_counter() - start
+    assert all(r and r.get("id") for r in results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    _StandIn.latency = args.latency_ms / 1000.0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    def make_api():
+        api = ZwiftAPI("bench", "bench", pool_size=args.threads)
+        api.token_url = f"{base}/token"
+        api.api_host = base
+        api.authenticate()
+        return api
+
+    for mode in ("bare", "pooled"):
+        api = make_api()
+        if mode == "bare":
+            api.session.get = lambda url, **kwargs: requests.get(url, **kwargs)
+        _StandIn.counts.update(connections=0)
+        elapsed = _run(api, args.requests, args.threads)
+        print(
+            f"{mode:>6}: {args.requests} profiles in {elapsed:.2f}s "
+            f"({args.requests / elapsed:.0f} req/s, {_StandIn.counts['connections']} connections)"
+        )
+
+    # Single-flight refresh: expire the token and hit it from every thread at once
+    api = make_api()
+    api.token_expiry_time = 0
+    _StandIn.counts.update(token=0)
+    _run(api, args.threads * 4, args.threads)
+    print(f"refresh: {_StandIn.counts['token']} token request(s) for {args.threads} threads finding it expired")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
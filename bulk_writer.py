@@ -0,0 +1,176 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import backoff
+
+try:
+    from google.api_core import exceptions as gexc
+
+    # Transient Firestore commit failures worth retrying
+    RETRYABLE_ERRORS: Tuple[type, ...] = (
+        gexc.Aborted,
+        gexc.DeadlineExceeded,
+        gexc.InternalServerError,
+        gexc.ServiceUnavailable,
+        gexc.TooManyRequests,
+        gexc.ResourceExhausted,
+    )
+except ImportError:  # pragma: no cover - google-api-core ships with firebase-admin
+    RETRYABLE_ERRORS = (ConnectionError, TimeoutError)
+
+# A write op is a callable that adds one write to a Firestore batch
+WriteOp = Callable[[Any], None]
+
+# Firestore allows 500 writes per batch; stay below it
+DEFAULT_BATCH_SIZE = 450
+
+
+def set_op(doc_ref, data: Dict[str, Any], merge: bool = False) -> WriteOp:
+    def _op(batch):
+        batch.set(doc_ref, data, merge=merge)
+    return _op
+
+
+def delete_op(doc_ref) -> WriteOp:
+    def _op(batch):
+        batch.delete(doc_ref)
+    return _op
+
+
+class BulkWriter:
+    """
+    Commit a stream of Firestore writes in batches, several batches at a time.
+
+    `write(ops)` consumes `ops` lazily (a generator is fine): batches are
+    filled as ops arrive and committed on a thread pool with at most
+    `max_in_flight` commits outstanding, so producing ops (e.g. reading a
+    download) overlaps with committing earlier batches. A batch whose commit
+    fails with a transient error is rebuilt from its ops and retried with
+    exponential backoff.
+
+    Usage:
+        stats = BulkWriter(firebase.db, name="roster").write(ops)
+    """
+
+    def __init__(
+        self,
+        db,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_in_flight: int = 4,
+        max_tries: int = 5,
+        raise_on_error: bool = True,
+        name: str = "bulk-write",
+        verbose: bool = True,
+    ):
+        self.db = db
+        self.batch_size = max(1, min(int(batch_size), 500))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_tries = max(1, int(max_tries))
+        self.raise_on_error = raise_on_error
+        self.name = name
+        self.verbose = verbose
+        self.stats: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _chunks(self, ops: Iterable[WriteOp]) -> Iterator[List[WriteOp]]:
+        chunk: List[WriteOp] = []
+        for op in ops or []:
+            chunk.append(op)
+            if len(chunk) >= self.batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _commit_chunk(self, chunk: List[WriteOp]) -> float:
+        def _on_backoff(details):
+            with self._lock:
+                self.stats["retries"] += 1
+            print(f"[WARN] {self.name}: batch commit failed, retrying ({details['tries']}): {details.get('exception')}")
+
+        @backoff.on_exception(
+            backoff.expo, RETRYABLE_ERRORS, max_tries=self.max_tries, on_backoff=_on_backoff
+        )
+        def _commit():
+            # Rebuild the batch on every attempt; a failed batch is not reused.
+            batch = self.db.batch()
+            for op in chunk:
+                op(batch)
+            started = time.perf_counter()
+            batch.commit()
+            return time.perf_counter() - started
+
+        return _commit()
+
+    def _record(self, size: int, latency: Optional[float], error: Optional[BaseException]) -> None:
+        with self._lock:
+            self.stats["batches"] += 1
+            if error is None:
+                self.stats["ops"] += size
+                self._latencies.append(latency)
+            else:
+                self.stats["failedOps"] += size
+                self.stats["failedBatches"] += 1
+                if len(self.stats["errors"]) < 20:
+                    self.stats["errors"].append(str(error))
+
+    def write(self, ops: Iterable[WriteOp]) -> Dict[str, Any]:
+        """
+        Commit all ops and return stats:
+            {"ops", "batches", "retries", "failedOps", "failedBatches", "errors",
+             "seconds", "opsPerSecond", "batchLatencyMs": {"avg", "p95", "max"}}
+
+        With raise_on_error (default) the first failed batch is re-raised once
+        the batches already in flight have finished; otherwise failures are
+        only counted in the stats.
+        """
+        self.stats = {
+            "ops": 0, "batches": 0, "retries": 0,
+            "failedOps": 0, "failedBatches": 0, "errors": [],
+        }
+        self._latencies: List[float] = []
+        first_error: Optional[BaseException] = None
+        started = time.perf_counter()
+
+        def _drain(entry):
+            nonlocal first_error
+            future, size = entry
+            try:
+                self._record(size, future.result(), None)
+            except Exception as e:
+                self._record(size, None, e)
+                if first_error is None:
+                    first_error = e
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="bulk-writer") as pool:
+            in_flight = []
+            for chunk in self._chunks(ops):
+                if first_error is not None and self.raise_on_error:
+                    break
+                in_flight.append((pool.submit(self._commit_chunk, chunk), len(chunk)))
+                if len(in_flight) >= self.max_in_flight:
+                    _drain(in_flight.pop(0))
+            for entry in in_flight:
+                _drain(entry)
+
+        elapsed = time.perf_counter() - started
+        latencies = sorted(self._latencies)
+        self.stats["seconds"] = round(elapsed, 3)
+        self.stats["opsPerSecond"] = round(self.stats["ops"] / elapsed, 1) if elapsed > 0 else None
+        self.stats["batchLatencyMs"] = {
+            "avg": round(1000 * sum(latencies) / len(latencies), 1) if latencies else None,
+            "p95": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1) if latencies else None,
+            "max": round(1000 * latencies[-1], 1) if latencies else None,
+        }
+        if self.verbose and self.stats["batches"]:
+            print(
+                f"[INFO] {self.name}: {self.stats['ops']} ops in {self.stats['batches']} batches, "
+                f"{self.stats['seconds']}s ({self.stats['opsPerSecond']} ops/s, "
+                f"avg batch {self.stats['batchLatencyMs']['avg']} ms, retries {self.stats['retries']})"
+            )
+
+        if first_error is not None and self.raise_on_error:
+            raise first_error
+        return self.stats
@@ -0,0 +1,237 @@
+import os
+import time
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from club_stats_store import CLUB_STATS_COLLECTION, HEADER_FIELDS, club_stats_store
+from identity_index import watch_is_alive
+from rider_history import get_zrs_category
+
+# How often the newest day's header is checked when no snapshot listener is running
+CLUB_STATS_CACHE_CHECK_SECONDS = int(os.getenv("CLUB_STATS_CACHE_CHECK_SECONDS", "30"))
+# Set to 0 to disable the Firestore snapshot listener and always poll
+CLUB_STATS_CACHE_LISTEN = os.getenv("CLUB_STATS_CACHE_LISTEN", "1").strip().lower() not in ("0", "false", "no")
+
+
+def _fingerprint(date_id: str, header: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Identifies one stored version of a day; changes whenever it is rewritten or patched."""
+    return (date_id, *(str(header.get(f)) for f in HEADER_FIELDS))
+
+
+def rider_stats_entry(rider: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Discord member enrichment for one club_stats rider: riderName, zpCategory,
+    racingScore/zrsCategory and vELO veloScore/veloCategoryName/veloCategory.
+    """
+    entry: Dict[str, Any] = {}
+    # Real rider name from club_stats
+    if 'name' in rider and isinstance(rider.get('name'), str):
+        entry['riderName'] = rider.get('name')
+    # Pace group from ZP
+    if 'zpCategory' in rider:
+        entry['zpCategory'] = rider.get('zpCategory')
+    # Racing score (ZRS) and derived category
+    score = rider.get('racingScore')
+    if isinstance(score, (int, float)):
+        entry['racingScore'] = score
+        try:
+            entry['zrsCategory'] = get_zrs_category(score)
+        except Exception:
+            pass
+    # vELO (Zwift Racing mixed category and rating)
+    current = rider.get('race', {}).get('current') if isinstance(rider.get('race'), dict) else None
+    mixed = None
+    if isinstance(current, dict):
+        mixed = current.get('mixed')
+    if isinstance(mixed, dict):
+        # Score fallbacks: mixed.rating -> current.rating -> mixed.number
+        score = mixed.get('rating')
+        if not isinstance(score, (int, float)) and isinstance(current, dict):
+            score = current.get('rating')
+        if not isinstance(score, (int, float)):
+            score = mixed.get('number')
+        if isinstance(score, (int, float)):
+            entry['veloScore'] = score
+        # Category name fallbacks: mixed.category -> mixed.name
+        category_name = mixed.get('category') or mixed.get('name')
+        if isinstance(category_name, str) and category_name:
+            entry['veloCategoryName'] = category_name
+        # Letter (if available)
+        letter = mixed.get('letter')
+        if isinstance(letter, str):
+            entry['veloCategory'] = letter
+    return entry
+
+
+class ClubStatsSnapshot:
+    """
+    The newest club_stats day, parsed once and shared by every request.
+
+    Treat it as read-only: the same objects are handed to all callers until
+    the next version of the day is loaded.
+    """
+
+    def __init__(self, date_id: Optional[str], header: Dict[str, Any], riders: List[Dict[str, Any]]):
+        self.date_id = date_id
+        self.header = header
+        self.riders = riders
+        self.loaded_at = time.time()
+
+        stats: Dict[str, Dict[str, Any]] = {}
+        dropdown = []
+        for rider in riders:
+            rider_id = rider.get('riderId')
+            if rider_id is None:
+                continue
+            try:
+                entry = rider_stats_entry(rider)
+            except Exception:
+                # Skip problematic rider entries
+                entry = None
+            if entry:
+                stats[str(rider_id)] = entry
+            if 'name' in rider:
+                dropdown.append({"name": rider.get('name', ''), "riderId": str(rider_id)})
+        dropdown.sort(key=lambda x: x["name"])
+        # riderId -> member enrichment entry (see rider_stats_entry)
+        self.rider_stats: Mapping[str, Dict[str, Any]] = MappingProxyType(stats)
+        # [{"name", "riderId"}] sorted by name, for rider pickers
+        self.dropdown: List[Dict[str, str]] = dropdown
+
+
+_EMPTY = ClubStatsSnapshot(None, {}, [])
+
+
+class LatestClubStats:
+    """
+    In-process cache of the newest club_stats day and its derived views.
+
+    While the newest day is sharded, a Firestore snapshot listener on it
+    records when a new day arrives or the current one is rewritten/patched;
+    the riders are reloaded on the next access. Listeners cannot project, so
+    a single-document day (riders inline, as the ingester writes them) is
+    never listened to: every callback would download the whole roster.
+    Without a healthy listener (single-document day, none, stopped, or
+    silent for longer than CLUB_STATS_CACHE_CHECK_SECONDS when the watch
+    does not report liveness) the header (a small projection, no riders) is
+    checked at most every CLUB_STATS_CACHE_CHECK_SECONDS, and a stopped
+    listener is restarted. Snapshots are swapped, never mutated.
+    """
+
+    def __init__(self, store=club_stats_store, check_seconds: int = CLUB_STATS_CACHE_CHECK_SECONDS,
+                 listen: bool = CLUB_STATS_CACHE_LISTEN):
+        self.store = store
+        self.check_seconds = check_seconds
+        self.listen = listen
+
+        self._snapshot = _EMPTY
+        self._fingerprint: Optional[Tuple[Any, ...]] = None   # of the loaded snapshot
+        self._loaded = False
+        self._dirty = False         # set by the listener when the newest day changed
+        self._generation = 0        # bumped by every load
+        self._checked_at = 0.0
+        self._last_event = 0.0      # time of the last listener callback
+        self._watch = None
+        self._listening = False
+        self._load_lock = threading.Lock()  # single-flight loads
+
+    def _load(self) -> None:
+        self._dirty = False
+        latest = self.store.latest_header()
+        date_id, header = latest if latest else (None, {})
+        riders = (self.store.riders(date_id) or []) if date_id else []
+        self._snapshot = ClubStatsSnapshot(date_id, header, riders)
+        self._fingerprint = _fingerprint(date_id, header) if date_id else None
+        self._loaded = True
+        self._generation += 1
+        self._checked_at = time.time()
+        print(f"[INFO] club_stats cache loaded {date_id}: {len(riders)} riders")
+
+    def _on_snapshot(self, docs, changes, read_time) -> None:
+        self._last_event = time.time()
+        try:
+            latest = next((_fingerprint(doc.id, doc.to_dict() or {}) for doc in docs), None)
+            if latest != self._fingerprint:
+                self._dirty = True
+            self._listening = True
+        except Exception as e:
+            print(f"[WARN] club_stats cache listener update failed; falling back to polling: {e}")
+            self._listening = False
+
+    def _start_listener(self) -> None:
+        if not self.listen or self._watch is not None or not self._snapshot.header.get("sharded"):
+            return
+        try:
+            from firebase_admin import firestore
+
+            query = self.store.db.collection(CLUB_STATS_COLLECTION)\
+                .order_by("timestamp", direction=firestore.Query.DESCENDING)\
+                .limit(1)
+            # The first callback delivers the current newest day; it only marks the cache dirty if it differs
+            self._watch = query.on_snapshot(self._on_snapshot)
+            self._listening = True
+        except Exception as e:
+            print(f"[WARN] club_stats cache listener unavailable; polling every {self.check_seconds}s: {e}")
+            self._watch = None
+            self._listening = False
+
+    def _stale(self) -> bool:
+        if not self._loaded:
+            return True
+        if self._listening:
+            alive = watch_is_alive(self._watch)
+            if alive or (alive is None and time.time() - max(self._checked_at, self._last_event) < self.check_seconds):
+                return self._dirty
+            if alive is False:
+                print("[WARN] club_stats cache listener stopped; restarting it")
+                self.close()
+                self._start_listener()
+        if self._dirty:
+            return True
+        if time.time() - self._checked_at < self.check_seconds:
+            return False
+        latest = self.store.latest_header()
+        self._checked_at = time.time()
+        return (_fingerprint(*latest) if latest else None) != self._fingerprint
+
+    def get(self) -> ClubStatsSnapshot:
+        """The cached snapshot, reloaded first when the stored day changed."""
+        generation = self._generation
+        if not self._stale():
+            return self._snapshot
+        with self._load_lock:
+            # Another request may have loaded it while this one waited
+            if self._generation == generation:
+                self._load()
+                if not self._snapshot.header.get("sharded") and self._watch is not None:
+                    # The newest day is a whole-roster document: poll its header instead
+                    self.close()
+                self._start_listener()
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        """Reload on next access (after a write by this process)."""
+        self._loaded = False
+
+    def close(self) -> None:
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+        self._watch = None
+        self._listening = False
+
+    def status(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "date": snapshot.date_id,
+            "riders": len(snapshot.riders),
+            "mode": "listener" if self._listening else "polling",
+            "ageSeconds": round(time.time() - snapshot.loaded_at, 1) if snapshot.date_id else None,
+        }
+
+
+# Process-wide cache shared by all routes and helpers
+latest_club_stats = LatestClubStats()
@@ -0,0 +1,233 @@
+import os
+import zlib
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from firestore_client import LazyFirestoreClient
+
+CLUB_STATS_COLLECTION = "club_stats"
+# Subcollection of a day's header document holding its riders
+SHARD_COLLECTION = "riderShards"
+# Riders per shard; keeps each shard well below Firestore's 1 MiB document limit
+CLUB_STATS_SHARD_SIZE = int(os.getenv("CLUB_STATS_SHARD_SIZE", "250"))
+
+# Header fields that are cheap to read and tell how (and when) a day was stored;
+# updatedAt changes on every write through this store
+HEADER_FIELDS = ["timestamp", "updatedAt", "sharded", "shardCount", "riderCount"]
+
+
+def rider_key(v: Any) -> Optional[str]:
+    """Normalized rider id (club_stats mixes int and str ids); None when empty."""
+    if v is None:
+        return None
+    if isinstance(v, (int, float)):
+        return str(int(v))
+    return str(v).strip() or None
+
+
+def shard_for(rider_id: Any, shard_count: int) -> int:
+    """Stable shard number of a rider id (same for int and str ids)."""
+    return zlib.crc32((rider_key(rider_id) or "").encode("utf-8")) % max(1, shard_count)
+
+
+def _project(rider: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    if not fields:
+        return rider
+    return {k: rider[k] for k in fields if k in rider}
+
+
+class ClubStatsStore(LazyFirestoreClient):
+    """
+    Daily `club_stats` snapshots with riders sharded out of the day document.
+
+    Layout of a sharded day:
+        club_stats/{date}                     header: timestamp, data (minus riders),
+                                              sharded=True, shardCount, riderCount
+        club_stats/{date}/riderShards/{n}     {"index": n, "riders": [...]}
+    A rider lives in shard crc32(riderId) % shardCount, so a subset of riders
+    is read from (and patched in) only the shards that hold them. Shards are
+    downloaded whole; `fields` only trims what is returned.
+
+    Days written as a single document (`data.riders`) are read and patched in
+    place. A day document that carries `data.riders` is always treated as
+    single-document, even when it is flagged sharded (the ingester rewrote
+    it). Reads never change the layout: days are sharded only by the
+    explicit migration (shard(), POST /api/club_stats/shard) or by
+    write_snapshot().
+    """
+
+    def __init__(self, db=None, shard_size: int = CLUB_STATS_SHARD_SIZE):
+        self._db = db
+        self.shard_size = max(1, int(shard_size))
+        self._lock = threading.Lock()
+
+    def _day(self, date_id: str):
+        return self.db.collection(CLUB_STATS_COLLECTION).document(date_id)
+
+    def latest_header(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(date id, header fields) of the newest day, without downloading its riders."""
+        from firebase_admin import firestore
+
+        query = self.db.collection(CLUB_STATS_COLLECTION)\
+            .order_by("timestamp", direction=firestore.Query.DESCENDING)\
+            .limit(1)\
+            .select(HEADER_FIELDS)
+        for doc in query.stream():
+            return doc.id, doc.to_dict() or {}
+        return None
+
+    def header(self, date_id: str) -> Optional[Dict[str, Any]]:
+        snap = self._day(date_id).get(field_paths=HEADER_FIELDS)
+        return (snap.to_dict() or {}) if snap.exists else None
+
+    def day_ids(self) -> List[str]:
+        """Ids of all stored days, oldest first (no document reads)."""
+        return sorted(ref.id for ref in self.db.collection(CLUB_STATS_COLLECTION).list_documents())
+
+    def _shard_refs(self, date_id: str, shard_count: int, shards: Optional[Iterable[int]] = None):
+        col = self._day(date_id).collection(SHARD_COLLECTION)
+        return [col.document(str(n)) for n in sorted(set(shards) if shards is not None else range(shard_count))]
+
+    def _read_day(self, date_id: str) -> Optional[Dict[str, Any]]:
+        """The day document; small for sharded days, the whole roster otherwise."""
+        snap = self._day(date_id).get()
+        return (snap.to_dict() or {}) if snap.exists else None
+
+    @staticmethod
+    def _inline_riders(doc: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Riders stored in the day document itself, or None when they live in shards."""
+        data = doc.get("data") or {}
+        if "riders" in data or not doc.get("sharded"):
+            return data.get("riders") or []
+        return None
+
+    def riders(self, date_id: str, fields: Optional[Sequence[str]] = None,
+               rider_ids: Optional[Iterable[Any]] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Riders of one day, or None when the day does not exist.
+
+        `fields` keeps only those rider keys; `rider_ids` limits the result
+        (and, for sharded days, the shards downloaded) to those riders.
+        """
+        doc = self._read_day(date_id)
+        if doc is None:
+            return None
+        wanted = {rider_key(r) for r in rider_ids} if rider_ids is not None else None
+
+        riders = self._inline_riders(doc)
+        if riders is None:
+            shard_count = int(doc.get("shardCount") or 1)
+            shards = {shard_for(r, shard_count) for r in wanted} if wanted is not None else None
+            riders = []
+            for ref in self._shard_refs(date_id, shard_count, shards):
+                snap = ref.get()
+                if snap.exists:
+                    riders.extend((snap.to_dict() or {}).get("riders") or [])
+
+        if wanted is not None:
+            riders = [r for r in riders if isinstance(r, dict) and rider_key(r.get("riderId")) in wanted]
+        return [_project(r, fields) for r in riders if isinstance(r, dict)]
+
+    def latest_riders(self, fields: Optional[Sequence[str]] = None,
+                      rider_ids: Optional[Iterable[Any]] = None) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """(date id, riders) of the newest day; (None, []) when there is none."""
+        latest = self.latest_header()
+        if latest is None:
+            return None, []
+        date_id = latest[0]
+        return date_id, self.riders(date_id, fields=fields, rider_ids=rider_ids) or []
+
+    def write_snapshot(self, date_id: str, doc: Dict[str, Any], riders: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Store one day in the sharded layout. `doc` holds the header fields
+        (timestamp, data, ...); any data.riders in it is ignored.
+        """
+        from bulk_writer import BulkWriter, delete_op, set_op
+
+        riders = [r for r in riders if isinstance(r, dict)]
+        shard_count = max(1, -(-len(riders) // self.shard_size))
+        shards: List[List[Dict[str, Any]]] = [[] for _ in range(shard_count)]
+        for rider in riders:
+            shards[shard_for(rider.get("riderId"), shard_count)].append(rider)
+
+        with self._lock:
+            day = self._day(date_id)
+            shard_col = day.collection(SHARD_COLLECTION)
+            stale = [ref for ref in shard_col.list_documents() if not ref.id.isdigit() or int(ref.id) >= shard_count]
+            # Shards first, then the header that points at them, then leftovers of a larger layout
+            BulkWriter(self.db, name=f"club_stats {date_id} shards", verbose=False).write(
+                set_op(shard_col.document(str(n)), {"index": n, "riders": shard}) for n, shard in enumerate(shards)
+            )
+            header = dict(doc)
+            header["data"] = {k: v for k, v in (doc.get("data") or {}).items() if k != "riders"}
+            header.update(sharded=True, shardCount=shard_count, riderCount=len(riders),
+                          updatedAt=datetime.now(timezone.utc).isoformat())
+            day.set(header)
+            if stale:
+                BulkWriter(self.db, name=f"club_stats {date_id} cleanup", verbose=False).write(delete_op(ref) for ref in stale)
+        print(f"[INFO] club_stats {date_id}: {len(riders)} riders in {shard_count} shard(s)")
+        return {"date": date_id, "riders": len(riders), "shards": shard_count}
+
+    def shard(self, date_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Migrate a single-document day to the sharded layout (removes
+        data.riders from the day document); None if it is missing or has no
+        inline riders.
+        """
+        doc = self._read_day(date_id)
+        if doc is None or "riders" not in (doc.get("data") or {}):
+            return None
+        return self.write_snapshot(date_id, doc, doc["data"]["riders"] or [])
+
+    def patch_riders(self, date_id: str, updates: Dict[Any, Dict[str, Any]]) -> int:
+        """
+        Merge `updates` ({riderId: {field: value}}) into the riders of one day.
+        Sharded days rewrite only the shards that hold them; single-document
+        days are updated in place. Returns the number of riders updated.
+        """
+        from bulk_writer import BulkWriter, set_op
+
+        doc = self._read_day(date_id)
+        if doc is None:
+            raise ValueError(f"club_stats {date_id} not found")
+        updates = {rider_key(k): v for k, v in updates.items() if rider_key(k)}
+
+        def _apply(riders) -> int:
+            count = 0
+            for rider in riders or []:
+                patch = updates.get(rider_key(rider.get("riderId"))) if isinstance(rider, dict) else None
+                if patch:
+                    rider.update(patch)
+                    count += 1
+            return count
+
+        now = datetime.now(timezone.utc).isoformat()
+        inline = self._inline_riders(doc)
+        if inline is not None:
+            updated = _apply(inline)
+            if updated:
+                self._day(date_id).update({"data": doc.get("data") or {}, "updatedAt": now})
+            return updated
+
+        shard_count = int(doc.get("shardCount") or 1)
+        touched = {shard_for(rid, shard_count) for rid in updates}
+        updated = 0
+        ops = []
+        for ref in self._shard_refs(date_id, shard_count, touched):
+            snap = ref.get()
+            if not snap.exists:
+                continue
+            shard = snap.to_dict() or {}
+            changed = _apply(shard.get("riders"))
+            if changed:
+                updated += changed
+                ops.append(set_op(ref, shard))
+        BulkWriter(self.db, name=f"club_stats {date_id} patch", verbose=False).write(ops)
+        if ops:
+            self._day(date_id).update({"updatedAt": now})
+        return updated
+
+
+# Process-wide store used by the readers of club_stats
+club_stats_store = ClubStatsStore()
@@ -1,7 +1,12 @@
 import os
+import time
 import requests
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Mapping, Optional
 import firebase
+from identity_index import identity_index
+from discord_members import MemberSnapshot, RoleTable, member_snapshots
+from discord_dm import dm_channels
+from club_stats_cache import latest_club_stats
 
 class DiscordAPI:
     """
@@ -34,6 +39,7 @@ class DiscordAPI:
         
         # Cache for role data
         self._roles_cache = None
+        self._role_table = None
     
     def get_guild_roles(self) -> Dict[str, Dict[str, Any]]:
         """
@@ -75,6 +81,16 @@ class DiscordAPI:
             print(f"Error fetching guild roles: {e}")
             return {}
 
+    def get_role_table(self) -> RoleTable:
+        """
+        Guild roles as a position-sorted RoleTable. Member listings reference it
+        lazily (see discord_members.LazyRoles); responses can also ship
+        `role_table.roles` once and let clients resolve `role_ids`.
+        """
+        if self._role_table is None:
+            self._role_table = RoleTable(self.get_guild_roles())
+        return self._role_table
+
     def get_guild_member_counts(self) -> Dict[str, Any]:
         """
         Fetch guild-level counts (member count, presence count when available).
@@ -101,83 +117,79 @@ class DiscordAPI:
             print(f"Error fetching guild counts: {e}")
             return {}
     
-    def get_all_members(self, limit: int = 1000, include_role_names: bool = True) -> List[Dict[str, Any]]:
+    def _get_rate_limited(self, url: str, max_retries: int = 5) -> requests.Response:
+        """
+        GET a Discord API URL honouring its rate limits.
+
+        On 429 waits `retry_after` (body) or Retry-After (header) and retries;
+        when a response reports the bucket exhausted (X-RateLimit-Remaining: 0)
+        waits X-RateLimit-Reset-After before returning, so the next call in a
+        paging loop does not hit a 429.
+        """
+        for attempt in range(max_retries + 1):
+            response = requests.get(url, headers=self.headers, timeout=30)
+            if response.status_code == 429 and attempt < max_retries:
+                try:
+                    retry_after = float((response.json() or {}).get("retry_after"))
+                except (ValueError, TypeError, AttributeError):
+                    retry_after = float(response.headers.get("Retry-After") or 1)
+                print(f"[WARN] Discord rate limited on {url}; retrying in {retry_after:.2f}s")
+                time.sleep(retry_after)
+                continue
+            response.raise_for_status()
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                try:
+                    time.sleep(float(response.headers.get("X-RateLimit-Reset-After") or 0))
+                except ValueError:
+                    pass
+            return response
+        return response
+
+    def fetch_raw_members(self) -> List[Dict[str, Any]]:
+        """
+        Page through /guilds/{id}/members (1000 per request) and return the raw
+        member objects. Raises on failure instead of returning a partial list.
+        """
+        members: List[Dict[str, Any]] = []
+        after = None  # Used for pagination
+        while True:
+            url = f"{self.api_base_url}/guilds/{self.guild_id}/members?limit=1000"
+            if after:
+                url += f"&after={after}"
+            batch = self._get_rate_limited(url).json()
+            if not batch:
+                break  # No more members
+            members.extend(batch)
+            if len(batch) < 1000:
+                break
+            # Set after to the ID of the last member for the next request
+            after = batch[-1]["user"]["id"]
+        return members
+
+    def get_member_snapshot(self, force_refresh: bool = False) -> MemberSnapshot:
+        """
+        Return the shared guild member snapshot (see discord_members.MemberSnapshotService):
+        cached for DISCORD_MEMBERS_TTL_SECONDS, refreshed by one caller at a time,
+        with `fetched_at` telling callers how current it is.
+        """
+        return member_snapshots.get(self, force_refresh=force_refresh)
+
+    def get_all_members(self, limit: int = 1000, include_role_names: bool = True,
+                        force_refresh: bool = False) -> List[Dict[str, Any]]:
         """
         Get all members from the Discord guild.
         
         Args:
             limit (int, optional): Maximum number of members to retrieve. Defaults to 1000.
             include_role_names (bool, optional): Whether to include role names along with IDs. Defaults to True.
+            force_refresh (bool, optional): Refetch instead of using the shared member snapshot.
             
         Returns:
             List[Dict[str, Any]]: List of member data including display names, usernames, and IDs
         """
-        members = []
-        after = None  # Used for pagination
-        
-        # Get role data if we need to include role names
-        role_lookup = self.get_guild_roles() if include_role_names else {}
-        
-        # Discord returns up to 1000 members per request, so we may need multiple requests
-        while True:
-            try:
-                url = f"{self.api_base_url}/guilds/{self.guild_id}/members?limit=1000"
-                if after:
-                    url += f"&after={after}"
-                
-                response = requests.get(url, headers=self.headers)
-                response.raise_for_status()  # Raise exception for non-200 status codes
-                
-                batch = response.json()
-                if not batch:
-                    break  # No more members
-                
-                for member in batch:
-                    # Extract relevant member info
-                    user = member.get("user", {})
-                    role_ids = member.get("roles", [])
-                    
-                    member_data = {
-                        "discordID": user.get("id"),
-                        "username": user.get("username"),
-                        "global_name": user.get("global_name"),
-                        "display_name": member.get("nick") or user.get("global_name") or user.get("username"),
-                        "avatar": user.get("avatar"),
-                        "joined_at": member.get("joined_at"),
-                        "role_ids": role_ids
-                    }
-                    
-                    # Include role names if requested
-                    if include_role_names and role_lookup:
-                        # Get role info for each role ID
-                        roles_info = []
-                        for role_id in role_ids:
-                            if role_id in role_lookup:
-                                roles_info.append({
-                                    "id": role_id,
-                                    "name": role_lookup[role_id]["name"],
-                                    "color": role_lookup[role_id]["color"],
-                                    "position": role_lookup[role_id]["position"]
-                                })
-                        
-                        # Sort roles by position (higher position roles first)
-                        roles_info.sort(key=lambda r: r["position"], reverse=True)
-                        member_data["roles"] = roles_info
-                    
-                    members.append(member_data)
-                
-                # If we've reached the requested limit or fewer than 1000 members were returned, we're done
-                if len(members) >= limit or len(batch) < 1000:
-                    break
-                
-                # Set after to the ID of the last member for the next request
-                after = batch[-1]["user"]["id"]
-                
-            except requests.RequestException as e:
-                print(f"Error fetching Discord members: {e}")
-                break
-        
-        return members[:limit]  # Ensure we don't return more than the limit
+        snapshot = self.get_member_snapshot(force_refresh=force_refresh)
+        role_table = self.get_role_table() if include_role_names else None
+        return snapshot.as_dicts(role_table, limit=limit)
     
     def merge_with_zwift_ids(self, include_role_names: bool = True) -> List[Dict[str, Any]]:
         """
@@ -192,72 +204,13 @@ class DiscordAPI:
         # Get all Discord members
         discord_members = self.get_all_members(include_role_names=include_role_names)
         
-        # Get all users from Firebase that have ZwiftIDs
-        # Use a high limit to ensure we get all users (default is only 100)
-        firebase_users = firebase.get_collection("users", limit=10000)
-        
-        # Create a lookup dictionary of discordId to zwiftId
-        zwift_lookup = {}
-        for user in firebase_users:
-            if "discordId" in user and "zwiftId" in user:
-                zwift_lookup[user["discordId"]] = user["zwiftId"]
+        # discordId -> zwiftId lookup from the shared users index
+        zwift_lookup = identity_index.discord_to_zwift()
         
-        # NEW: Build a rider stats lookup from the latest club_stats
-        rider_stats_lookup: Dict[str, Dict[str, Any]] = {}
+        # riderId -> stats entry, built once per club_stats version by the shared cache
+        rider_stats_lookup: Mapping[str, Dict[str, Any]] = {}
         try:
-            club_stats_docs = firebase.get_latest_document('club_stats')
-            if club_stats_docs and len(club_stats_docs) > 0:
-                stats_doc = club_stats_docs[0]
-                riders = stats_doc.get('data', {}).get('riders', []) if isinstance(stats_doc, dict) else []
-                for rider in riders:
-                    try:
-                        rider_id = rider.get('riderId')
-                        if rider_id is None:
-                            continue
-                        rider_key = str(rider_id)
-                        entry: Dict[str, Any] = {}
-                        # Real rider name from club_stats
-                        if 'name' in rider and isinstance(rider.get('name'), str):
-                            entry['riderName'] = rider.get('name')
-                        # Pace group from ZP
-                        if 'zpCategory' in rider:
-                            entry['zpCategory'] = rider.get('zpCategory')
-                        # Racing score (ZRS) and derived category
-                        score = rider.get('racingScore')
-                        if isinstance(score, (int, float)):
-                            entry['racingScore'] = score
-                            # Compute ZRS category using helper
-                            try:
-                                entry['zrsCategory'] = firebase.get_zrs_category(score)
-                            except Exception:
-                                pass
-                        # vELO (Zwift Racing mixed category and rating)
-                        current = rider.get('race', {}).get('current') if isinstance(rider.get('race'), dict) else None
-                        mixed = None
-                        if isinstance(current, dict):
-                            mixed = current.get('mixed')
-                        if isinstance(mixed, dict):
-                            # Score fallbacks: mixed.rating -> current.rating -> mixed.number
-                            score = mixed.get('rating')
-                            if not isinstance(score, (int, float)) and isinstance(current, dict):
-                                score = current.get('rating')
-                            if not isinstance(score, (int, float)):
-                                score = mixed.get('number')
-                            if isinstance(score, (int, float)):
-                                entry['veloScore'] = score
-                            # Category name fallbacks: mixed.category -> mixed.name
-                            category_name = mixed.get('category') or mixed.get('name')
-                            if isinstance(category_name, str) and category_name:
-                                entry['veloCategoryName'] = category_name
-                            # Letter (if available)
-                            letter = mixed.get('letter')
-                            if isinstance(letter, str):
-                                entry['veloCategory'] = letter
-                        if entry:
-                            rider_stats_lookup[rider_key] = entry
-                    except Exception:
-                        # Skip problematic rider entries
-                        continue
+            rider_stats_lookup = latest_club_stats.get().rider_stats
         except Exception as rider_stats_err:
             # Fail gracefully; stats are optional enrichments
             print(f"Error building rider stats lookup: {rider_stats_err}")
@@ -322,7 +275,7 @@ class DiscordAPI:
         """
         try:
             # Get role data if we need to include role names
-            role_lookup = self.get_guild_roles() if include_role_names else {}
+            role_table = self.get_role_table() if include_role_names else None
             
             # Get the member from Discord API
             response = requests.get(
@@ -346,21 +299,8 @@ class DiscordAPI:
             }
             
             # Include role names if requested
-            if include_role_names and role_lookup:
-                # Get role info for each role ID
-                roles_info = []
-                for role_id in role_ids:
-                    if role_id in role_lookup:
-                        roles_info.append({
-                            "id": role_id,
-                            "name": role_lookup[role_id]["name"],
-                            "color": role_lookup[role_id]["color"],
-                            "position": role_lookup[role_id]["position"]
-                        })
-                
-                # Sort roles by position (higher position roles first)
-                roles_info.sort(key=lambda r: r["position"], reverse=True)
-                member_data["roles"] = roles_info
+            if include_role_names and role_table:
+                member_data["roles"] = list(role_table.for_ids(role_ids))
             
             # Check if there's a ZwiftID in Firebase
             user_doc = firebase.get_document("users", discord_id)
@@ -379,7 +319,8 @@ class DiscordAPI:
 
     def _create_dm_channel(self, user_id: str) -> Optional[str]:
         """
-        Create (or fetch) a DM channel with a user.
+        Create (or fetch) a DM channel with a user. Channel ids are stable,
+        so they are taken from / stored in the shared DM channel cache.
 
         Args:
             user_id (str): Discord user ID
@@ -387,6 +328,9 @@ class DiscordAPI:
         Returns:
             Optional[str]: DM channel ID or None on failure
         """
+        cached = dm_channels.get(user_id)
+        if cached:
+            return cached
         try:
             response = requests.post(
                 f"{self.api_base_url}/users/@me/channels",
@@ -395,7 +339,10 @@ class DiscordAPI:
             )
             response.raise_for_status()
             data = response.json()
-            return data.get("id")
+            channel_id = data.get("id")
+            if channel_id:
+                dm_channels.remember(user_id, channel_id)
+            return channel_id
         except requests.RequestException as e:
             print(f"Error creating DM channel for {user_id}: {e}")
             return None
@@ -421,6 +368,9 @@ class DiscordAPI:
                 headers=self.headers,
                 json={"content": content},
             )
+            if response.status_code == 404:
+                # Cached channel no longer exists; the next call opens a new one
+                dm_channels.forget(user_id)
             response.raise_for_status()
             return True
         except requests.RequestException as e:
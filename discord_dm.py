@@ -0,0 +1,217 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from discord_rest import AsyncDiscordClient, RequestsTransport, acquire_token
+from firestore_client import LazyFirestoreClient
+from ratelimit import limiter_for
+
+# DMs sent concurrently; Discord's bucket limits still apply on top
+DISCORD_DM_CONCURRENCY = int(os.getenv("DISCORD_DM_CONCURRENCY", "8"))
+# New DM channels opened per second; Discord does not publish this limit and
+# flags bots that open many DMs at once
+DISCORD_DM_RPS = float(os.getenv("DISCORD_DM_RPS", "10"))
+
+# Discord error code for a channel that no longer exists
+_UNKNOWN_CHANNEL = 10003
+
+
+class DMChannelCache(LazyFirestoreClient):
+    """
+    Discord user id -> DM channel id, persisted in Firestore
+    (`discord_dm_channels/{userId}`). DM channel ids never change for a
+    user, so each is created once and then reused by every outreach run.
+    The collection is loaded once per process on first use.
+    """
+
+    def __init__(self, collection: str = "discord_dm_channels", db=None):
+        self.collection = collection
+        self._db = db
+        self._channels: Dict[str, str] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                for doc in self.db.collection(self.collection).stream():
+                    channel_id = (doc.to_dict() or {}).get("channelId")
+                    if channel_id:
+                        self._channels[doc.id] = str(channel_id)
+            except Exception as e:
+                print(f"[WARN] Could not load DM channel cache: {e}")
+            self._loaded = True
+
+    def get(self, user_id: str) -> Optional[str]:
+        self._ensure_loaded()
+        return self._channels.get(str(user_id))
+
+    def remember(self, user_id: str, channel_id: str, persist: bool = True) -> None:
+        self._ensure_loaded()
+        self._channels[str(user_id)] = str(channel_id)
+        if persist:
+            try:
+                self.db.collection(self.collection).document(str(user_id)).set({"channelId": str(channel_id)})
+            except Exception as e:
+                print(f"[WARN] Could not persist DM channel for {user_id}: {e}")
+
+    def remember_many(self, pairs: Iterable[Tuple[str, str]]) -> int:
+        """Cache and persist several (user_id, channel_id) pairs with batched writes."""
+        from bulk_writer import BulkWriter, set_op
+
+        pairs = [(str(u), str(c)) for u, c in pairs]
+        if not pairs:
+            return 0
+        self._ensure_loaded()
+        self._channels.update(pairs)
+        col = self.db.collection(self.collection)
+        stats = BulkWriter(self.db, name="dm channels", raise_on_error=False, verbose=False).write(
+            set_op(col.document(u), {"channelId": c}) for u, c in pairs
+        )
+        return stats["ops"]
+
+    def forget(self, user_id: str) -> None:
+        self._channels.pop(str(user_id), None)
+
+
+# Process-wide DM channel cache
+dm_channels = DMChannelCache()
+
+
+class BulkDMSender:
+    """
+    Send one message to each of many Discord users concurrently.
+
+    DM channels come from the DMChannelCache (one POST /users/@me/channels
+    only for users never messaged before). New channel ids are persisted in
+    one batch at the end. Sends go through AsyncDiscordClient, so per-channel
+    buckets, the global limit and 429s are honoured; opening new channels is
+    further capped at DISCORD_DM_RPS.
+
+    `on_result(outcome)` is called as each recipient finishes with
+    {"discordId", "status": "sent" | "failed", "error"?}. When `should_stop()`
+    returns true, recipients not yet started are reported as "cancelled".
+
+    Usage:
+        outcomes = BulkDMSender(bot_token).send([(user_id, content), ...])
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        max_concurrency: int = DISCORD_DM_CONCURRENCY,
+        channels: Optional[DMChannelCache] = None,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        transport_factory: Callable[[int], Any] = lambda size: RequestsTransport(pool_size=size),
+    ):
+        self.bot_token = bot_token
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.channels = channels if channels is not None else dm_channels
+        self.on_result = on_result
+        self.should_stop = should_stop
+        self.transport_factory = transport_factory
+        self.limiter = limiter_for("discord.com/dm", DISCORD_DM_RPS, max(1, int(DISCORD_DM_RPS)))
+        self.stats: Dict[str, Any] = {}
+
+    async def _open_channel(self, client: AsyncDiscordClient, user_id: str) -> Tuple[Optional[str], Optional[str]]:
+        await acquire_token(self.limiter)
+        response = await client.request("POST", "/users/@me/channels", json={"recipient_id": user_id})
+        if 200 <= response.status < 300 and isinstance(response.body, dict) and response.body.get("id"):
+            return str(response.body["id"]), None
+        return None, f"create DM channel: HTTP {response.status}"
+
+    async def _send_one(self, client: AsyncDiscordClient, user_id: str, content: str,
+                        new_channels: Dict[str, str]) -> Dict[str, Any]:
+        channel_id = self.channels.get(user_id)
+        cached = channel_id is not None
+        for _ in range(2):
+            if channel_id is None:
+                channel_id, error = await self._open_channel(client, user_id)
+                if channel_id is None:
+                    return {"discordId": user_id, "status": "failed", "error": error}
+                new_channels[user_id] = channel_id
+            response = await client.request("POST", f"/channels/{channel_id}/messages", json={"content": content})
+            if 200 <= response.status < 300:
+                return {"discordId": user_id, "status": "sent"}
+            body = response.body if isinstance(response.body, dict) else {}
+            if cached and response.status == 404 and body.get("code") == _UNKNOWN_CHANNEL:
+                # Stale cache entry: open a fresh channel once
+                self.channels.forget(user_id)
+                channel_id, cached = None, False
+                continue
+            # 403 (code 50007) is the usual answer when the user does not accept DMs
+            return {
+                "discordId": user_id,
+                "status": "failed",
+                "error": f"HTTP {response.status}" + (f" ({body.get('message')})" if body.get("message") else ""),
+            }
+        return {"discordId": user_id, "status": "failed", "error": "DM channel unavailable"}
+
+    def _report(self, outcome: Dict[str, Any]) -> None:
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(outcome)
+        except Exception as e:
+            print(f"[WARN] bulk DM result callback failed: {e}")
+
+    async def send_async(self, messages: Iterable[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        messages = [(str(user_id), content) for user_id, content in messages]
+        outcomes: List[Optional[Dict[str, Any]]] = [None] * len(messages)
+        new_channels: Dict[str, str] = {}
+        started = time.perf_counter()
+        client = AsyncDiscordClient(self.bot_token, transport=self.transport_factory(self.max_concurrency))
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(messages)):
+            queue.put_nowait(index)
+
+        async def _worker():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                user_id, content = messages[index]
+                if self.should_stop is not None and self.should_stop():
+                    outcome = {"discordId": user_id, "status": "cancelled"}
+                else:
+                    try:
+                        outcome = await self._send_one(client, user_id, content, new_channels)
+                    except Exception as e:
+                        outcome = {"discordId": user_id, "status": "failed", "error": str(e)}
+                outcomes[index] = outcome
+                self._report(outcome)
+
+        try:
+            await asyncio.gather(*(_worker() for _ in range(min(self.max_concurrency, len(messages)))))
+        finally:
+            client.close()
+            self.channels.remember_many(new_channels.items())
+
+        results = [o for o in outcomes if o is not None]
+        self.stats = {
+            "recipients": len(messages),
+            "sent": sum(1 for o in results if o["status"] == "sent"),
+            "failed": sum(1 for o in results if o["status"] == "failed"),
+            "cancelled": sum(1 for o in results if o["status"] == "cancelled"),
+            "channelsCreated": len(new_channels),
+            "requests": client.stats["requests"],
+            "rateLimited": client.stats["rateLimited"],
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        print(
+            f"[INFO] bulk DM: {self.stats['sent']}/{len(messages)} sent in {self.stats['seconds']}s "
+            f"({self.stats['channelsCreated']} new channels, {self.stats['rateLimited']} rate limited)"
+        )
+        return results
+
+    def send(self, messages: Iterable[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Send (user_id, content) pairs; returns one outcome per pair, in order. Blocks the calling thread."""
+        return asyncio.run(self.send_async(messages))
@@ -0,0 +1,256 @@
+import os
+import sys
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# How long a guild member snapshot is served before it is refetched
+DISCORD_MEMBERS_TTL_SECONDS = int(os.getenv("DISCORD_MEMBERS_TTL_SECONDS", "120"))
+
+
+class RoleTable:
+    """
+    Guild roles sorted by position (highest first), shared by all members.
+
+    Each role is one dict ({id, name, color, position}) and the sorted role
+    list of each distinct role-id set is built once, so decorating thousands
+    of members creates no per-member role dicts.
+    """
+
+    def __init__(self, role_lookup: Dict[str, Dict[str, Any]]):
+        self.roles: List[Dict[str, Any]] = sorted(
+            (
+                {"id": role_id, "name": r["name"], "color": r["color"], "position": r["position"]}
+                for role_id, r in (role_lookup or {}).items()
+            ),
+            key=lambda r: r["position"],
+            reverse=True,
+        )
+        self._by_id = {r["id"]: r for r in self.roles}
+        self._sets: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.roles)
+
+    def for_ids(self, role_ids) -> List[Dict[str, Any]]:
+        """Roles for a set of role ids, highest position first (shared list; do not mutate)."""
+        key = tuple(role_ids)
+        roles = self._sets.get(key)
+        if roles is None:
+            by_id = self._by_id
+            roles = sorted((by_id[r] for r in key if r in by_id), key=lambda r: r["position"], reverse=True)
+            with self._lock:
+                self._sets[key] = roles
+        return roles
+
+    def lazy(self, role_ids) -> "LazyRoles":
+        return LazyRoles(self, role_ids)
+
+
+class LazyRoles:
+    """
+    Read-only view of a member's roles, resolved from the RoleTable only when
+    iterated (templates) or serialized (the app's JSON provider calls to_json).
+    """
+
+    __slots__ = ("_table", "_role_ids")
+
+    def __init__(self, table: RoleTable, role_ids):
+        self._table = table
+        self._role_ids = role_ids
+
+    def _roles(self) -> List[Dict[str, Any]]:
+        return self._table.for_ids(self._role_ids)
+
+    def __iter__(self):
+        return iter(self._roles())
+
+    def __len__(self) -> int:
+        return len(self._roles())
+
+    def __bool__(self) -> bool:
+        return bool(self._roles())
+
+    def __getitem__(self, index):
+        return self._roles()[index]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"LazyRoles({self._roles()!r})"
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return self._roles()
+
+
+class DiscordMember:
+    """
+    Compact guild member record.
+
+    Role ids are interned tuples shared by every member holding the same set of
+    roles; role names/colors are only attached when a caller asks for them.
+    """
+
+    __slots__ = ("discord_id", "username", "global_name", "display_name", "avatar", "joined_at", "role_ids")
+
+    def __init__(self, discord_id, username, global_name, display_name, avatar, joined_at, role_ids):
+        self.discord_id = discord_id
+        self.username = username
+        self.global_name = global_name
+        self.display_name = display_name
+        self.avatar = avatar
+        self.joined_at = joined_at
+        self.role_ids = role_ids
+
+    def to_dict(self, role_table: Optional[RoleTable] = None) -> Dict[str, Any]:
+        """The member dict returned by DiscordAPI.get_all_members (with lazy `roles` when role_table is given)."""
+        member_data = {
+            "discordID": self.discord_id,
+            "username": self.username,
+            "global_name": self.global_name,
+            "display_name": self.display_name,
+            "avatar": self.avatar,
+            "joined_at": self.joined_at,
+            "role_ids": list(self.role_ids),
+        }
+        if role_table:
+            member_data["roles"] = role_table.lazy(self.role_ids)
+        return member_data
+
+
+class MemberSnapshot:
+    """An immutable, consistent list of guild members and when it was fetched."""
+
+    __slots__ = ("guild_id", "members", "fetched_at", "stale", "error")
+
+    def __init__(self, guild_id: str, members: Tuple[DiscordMember, ...], fetched_at: float,
+                 stale: bool = False, error: Optional[str] = None):
+        self.guild_id = guild_id
+        self.members = members
+        self.fetched_at = fetched_at
+        self.stale = stale
+        self.error = error
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __iter__(self) -> Iterator[DiscordMember]:
+        return iter(self.members)
+
+    @property
+    def age_seconds(self) -> float:
+        return max(0.0, time.time() - self.fetched_at)
+
+    @property
+    def fetched_at_iso(self) -> str:
+        return datetime.fromtimestamp(self.fetched_at, tz=timezone.utc).isoformat()
+
+    def as_dicts(self, role_table: Optional[RoleTable] = None,
+                 limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        members = self.members if limit is None else self.members[:limit]
+        return [m.to_dict(role_table) for m in members]
+
+    def info(self) -> Dict[str, Any]:
+        info = {
+            "memberCount": len(self.members),
+            "fetchedAt": self.fetched_at_iso,
+            "ageSeconds": round(self.age_seconds, 1),
+            "stale": self.stale,
+        }
+        if self.error:
+            info["error"] = self.error
+        return info
+
+
+def build_snapshot(guild_id: str, raw_members: List[Dict[str, Any]]) -> MemberSnapshot:
+    """Convert raw /guilds/{id}/members objects into a compact MemberSnapshot."""
+    role_sets: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+    members = []
+    seen = set()
+    for member in raw_members:
+        user = member.get("user", {}) or {}
+        discord_id = user.get("id")
+        if discord_id in seen:
+            continue
+        seen.add(discord_id)
+        role_ids = tuple(sys.intern(str(r)) for r in (member.get("roles") or ()))
+        role_ids = role_sets.setdefault(role_ids, role_ids)
+        members.append(DiscordMember(
+            discord_id,
+            user.get("username"),
+            user.get("global_name"),
+            member.get("nick") or user.get("global_name") or user.get("username"),
+            user.get("avatar"),
+            member.get("joined_at"),
+            role_ids,
+        ))
+    return MemberSnapshot(str(guild_id), tuple(members), time.time())
+
+
+class MemberSnapshotService:
+    """
+    Process-wide cache of guild member snapshots.
+
+    Every caller within the TTL gets the same snapshot; when it expires one
+    caller refetches (single-flight) while concurrent callers wait for that
+    result instead of paging the guild themselves. When a refresh fails and
+    an older snapshot exists, the old one is served marked `stale`, except
+    for forced refreshes: callers that need current roles get the error.
+    """
+
+    def __init__(self, ttl_seconds: int = DISCORD_MEMBERS_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._snapshots: Dict[str, MemberSnapshot] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _guild_lock(self, guild_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(guild_id, threading.Lock())
+
+    def _fresh(self, snapshot: Optional[MemberSnapshot]) -> bool:
+        return snapshot is not None and not snapshot.stale and snapshot.age_seconds < self.ttl_seconds
+
+    def get(self, discord_api, force_refresh: bool = False) -> MemberSnapshot:
+        """
+        Return the member snapshot for discord_api's guild, fetching it when
+        missing or expired. With force_refresh a failed fetch raises instead
+        of falling back to the cached snapshot.
+        """
+        guild_id = str(discord_api.guild_id)
+        snapshot = self._snapshots.get(guild_id)
+        if not force_refresh and self._fresh(snapshot):
+            return snapshot
+
+        requested_at = time.time()
+        with self._guild_lock(guild_id):
+            snapshot = self._snapshots.get(guild_id)
+            # Someone else refreshed while we waited: their snapshot is newer than our request.
+            if snapshot is not None and not snapshot.stale and (
+                snapshot.fetched_at >= requested_at or (not force_refresh and self._fresh(snapshot))
+            ):
+                return snapshot
+            try:
+                snapshot = build_snapshot(guild_id, discord_api.fetch_raw_members())
+            except Exception as e:
+                previous = self._snapshots.get(guild_id)
+                if previous is None or force_refresh:
+                    raise
+                print(f"[WARN] Discord member refresh failed; serving snapshot from {previous.fetched_at_iso}: {e}")
+                return MemberSnapshot(guild_id, previous.members, previous.fetched_at, stale=True, error=str(e))
+            self._snapshots[guild_id] = snapshot
+            return snapshot
+
+    def invalidate(self, guild_id: Optional[str] = None) -> None:
+        """Drop cached snapshots, e.g. after changing member roles."""
+        with self._lock:
+            if guild_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(str(guild_id), None)
+
+
+member_snapshots = MemberSnapshotService()
@@ -0,0 +1,200 @@
+import os
+import re
+import time
+import asyncio
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ratelimit import limiter_for
+
+DISCORD_API_BASE = "https://discord.com/api/v10"
+# Discord's global limit is 50 requests/second per bot token
+DISCORD_GLOBAL_RPS = float(os.getenv("DISCORD_GLOBAL_RPS", "50"))
+
+# Snowflakes that are not major parameters share a bucket across values
+_MINOR_ID = re.compile(r"(?<!/guilds)(?<!/channels)(?<!/webhooks)/\d{5,}")
+_MAJOR_ID = re.compile(r"^/(guilds|channels|webhooks)/(\d+)")
+
+
+def route_key(method: str, path: str) -> str:
+    """
+    Rate-limit route for a request, e.g.
+    PUT /guilds/1/members/2/roles/3 -> "PUT /guilds/1/members/:id/roles/:id".
+    Major parameters (guild, channel, webhook) stay in the key.
+    """
+    return f"{method.upper()} {_MINOR_ID.sub('/:id', path.split('?', 1)[0])}"
+
+
+async def acquire_token(limiter) -> None:
+    """Wait for a ratelimit.TokenBucket token without blocking the event loop."""
+    while True:
+        wait = limiter.try_acquire()
+        if wait <= 0:
+            return
+        await asyncio.sleep(wait)
+
+
+class DiscordResponse(NamedTuple):
+    status: int
+    headers: Mapping[str, str]  # lower-cased header names
+    body: Any                   # parsed JSON, or None
+
+
+class RequestsTransport:
+    """
+    Default transport: a pooled requests.Session driven from asyncio via
+    worker threads. Any object with the same async `send` (e.g. one built on
+    aiohttp or httpx) can be passed to AsyncDiscordClient instead.
+    """
+
+    def __init__(self, pool_size: int = 16, timeout: float = 30):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(1, int(pool_size)))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _send(self, method: str, url: str, headers: Dict[str, str], json: Any) -> DiscordResponse:
+        r = self.session.request(method, url, headers=headers, json=json, timeout=self.timeout)
+        try:
+            body = r.json() if r.content else None
+        except ValueError:
+            body = None
+        return DiscordResponse(r.status_code, {k.lower(): v for k, v in r.headers.items()}, body)
+
+    async def send(self, method: str, url: str, headers: Dict[str, str], json: Any = None) -> DiscordResponse:
+        return await asyncio.to_thread(self._send, method, url, headers, json)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class _Bucket:
+    """
+    One Discord rate-limit bucket. Until the first response reports the
+    bucket's limit only a single request is let through; afterwards up to
+    `remaining` requests run concurrently and the rest wait for the reset.
+    """
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining = 1
+        self.reset_at = 0.0
+        self.in_flight = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.remaining <= 0 and self.reset_at and now >= self.reset_at:
+                    self.remaining = self.limit or 1
+                    self.reset_at = 0.0
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    self.in_flight += 1
+                    return
+                await asyncio.sleep(self.reset_at - now if self.reset_at > now else 0.05)
+
+    def release(self, headers: Optional[Mapping[str, str]]) -> None:
+        self.in_flight -= 1
+        headers = headers or {}
+        try:
+            if "x-ratelimit-limit" in headers:
+                self.limit = int(headers["x-ratelimit-limit"])
+            if "x-ratelimit-remaining" in headers:
+                # Requests still in flight will consume part of what Discord reports
+                self.remaining = max(0, int(headers["x-ratelimit-remaining"]) - self.in_flight)
+                if "x-ratelimit-reset-after" in headers:
+                    self.reset_at = time.monotonic() + float(headers["x-ratelimit-reset-after"])
+                return
+        except ValueError:
+            pass
+        # No rate-limit headers: the route is not limited per bucket; give the slot back
+        self.remaining += 1
+
+    def block(self, seconds: float) -> None:
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + seconds)
+
+
+class AsyncDiscordClient:
+    """
+    Minimal asyncio Discord REST client.
+
+    Requests are routed through per-route buckets (learned from the
+    X-RateLimit-* headers, including shared X-RateLimit-Bucket hashes) and the
+    process-wide global limit; a 429 pauses the bucket, or every request for a
+    global limit, and the request is retried after `retry_after`.
+
+    Create one client per event loop (e.g. per asyncio.run()).
+    """
+
+    def __init__(self, bot_token: str, transport=None, max_retries: int = 5, api_base: str = DISCORD_API_BASE):
+        self.transport = transport or RequestsTransport()
+        self.max_retries = max_retries
+        self.api_base = api_base.rstrip("/")
+        self.headers = {"Authorization": f"Bot {bot_token}"}
+        self.global_limiter = limiter_for("discord.com", DISCORD_GLOBAL_RPS, int(DISCORD_GLOBAL_RPS))
+        self.stats = {"requests": 0, "rateLimited": 0}
+        self._buckets: Dict[str, _Bucket] = {}
+        self._route_buckets: Dict[str, str] = {}
+
+    def _bucket_for(self, route: str) -> _Bucket:
+        key = self._route_buckets.get(route, route)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        return bucket
+
+    def _learn_bucket(self, route: str, path: str, bucket: _Bucket, headers: Mapping[str, str]) -> None:
+        bucket_hash = headers.get("x-ratelimit-bucket")
+        if not bucket_hash or route in self._route_buckets:
+            return
+        major = _MAJOR_ID.match(path)
+        key = f"{bucket_hash}:{major.group(2) if major else ''}"
+        self._route_buckets[route] = key
+        # Routes sharing a hash share one bucket; keep whichever was seen first
+        self._buckets.setdefault(key, bucket)
+
+    async def request(self, method: str, path: str, json: Any = None, reason: Optional[str] = None) -> DiscordResponse:
+        """Send one request, waiting out rate limits; returns the final response (also on 4xx/5xx)."""
+        route = route_key(method, path)
+        headers = dict(self.headers)
+        if reason:
+            headers["X-Audit-Log-Reason"] = quote(reason)
+
+        for attempt in range(self.max_retries + 1):
+            bucket = self._bucket_for(route)
+            await bucket.acquire()
+            await acquire_token(self.global_limiter)
+            try:
+                response = await self.transport.send(method, self.api_base + path, headers, json)
+            except Exception:
+                bucket.release(None)
+                raise
+            self.stats["requests"] += 1
+            bucket.release(response.headers)
+            self._learn_bucket(route, path, bucket, response.headers)
+
+            if response.status != 429 or attempt >= self.max_retries:
+                return response
+
+            self.stats["rateLimited"] += 1
+            body = response.body if isinstance(response.body, dict) else {}
+            try:
+                retry_after = float(body.get("retry_after") or response.headers.get("retry-after") or 1)
+            except (TypeError, ValueError):
+                retry_after = 1.0
+            if body.get("global") or response.headers.get("x-ratelimit-global"):
+                self.global_limiter.pause(retry_after)
+            else:
+                bucket.block(retry_after)
+            print(f"[WARN] Discord rate limited on {route}; retrying in {retry_after:.2f}s")
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
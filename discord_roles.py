@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
+from discord_rest import AsyncDiscordClient, RequestsTransport
+
+# Role changes sent concurrently; Discord's bucket limits still apply on top
+DISCORD_ROLE_CONCURRENCY = int(os.getenv("DISCORD_ROLE_CONCURRENCY", "8"))
+
+
+class RoleChange(NamedTuple):
+    member_id: str
+    role_id: str
+    action: str  # "add" or "remove"
+
+
+def _log_progress(stats: Dict[str, Any]) -> None:
+    print(
+        f"[INFO] role-pipeline: {stats['done']}/{stats['planned']} done "
+        f"(added {stats['added']}, removed {stats['removed']}, skipped {stats['skipped']}, failed {stats['failed']})"
+    )
+
+
+class RoleMutationPipeline:
+    """
+    Apply a planned list of RoleChange concurrently through AsyncDiscordClient.
+
+    Outcomes follow the previous per-request handling: an add answered with
+    403/404 (member left, missing permission) is skipped rather than failed;
+    a remove answered with 404 counts as removed.
+
+    `on_progress(stats)` is called every `progress_every` completed changes
+    and once at the end. When `should_stop()` returns true, changes not yet
+    started are left out and counted as `cancelled`.
+
+    Usage:
+        stats = RoleMutationPipeline(bot_token, guild_id).run(changes)
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        guild_id: str,
+        max_concurrency: int = DISCORD_ROLE_CONCURRENCY,
+        reason: Optional[str] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = _log_progress,
+        progress_every: int = 50,
+        should_stop: Optional[Callable[[], bool]] = None,
+        transport_factory: Callable[[int], Any] = lambda size: RequestsTransport(pool_size=size),
+    ):
+        self.bot_token = bot_token
+        self.guild_id = str(guild_id)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.reason = reason
+        self.on_progress = on_progress
+        self.progress_every = max(1, int(progress_every))
+        self.should_stop = should_stop
+        self.transport_factory = transport_factory
+
+    def _path(self, change: RoleChange) -> str:
+        return f"/guilds/{self.guild_id}/members/{change.member_id}/roles/{change.role_id}"
+
+    def _report(self, stats: Dict[str, Any]) -> None:
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress(dict(stats))
+        except Exception as e:
+            print(f"[WARN] role-pipeline progress callback failed: {e}")
+
+    def _record(self, stats: Dict[str, Any], change: RoleChange, status: Optional[int], error: Optional[str]) -> None:
+        if change.action == "add" and status is not None and 200 <= status < 300:
+            stats["added"] += 1
+        elif change.action == "add" and status in (403, 404):
+            stats["skipped"] += 1
+        elif change.action == "remove" and status in (200, 202, 204, 404):
+            stats["removed"] += 1
+        else:
+            stats["failed"] += 1
+            if len(stats["failures"]) < 50:
+                stats["failures"].append({
+                    "memberId": change.member_id,
+                    "roleId": change.role_id,
+                    "action": change.action,
+                    "status": status,
+                    "error": error,
+                })
+        stats["done"] += 1
+        if stats["done"] % self.progress_every == 0 and stats["done"] < stats["planned"]:
+            self._report(stats)
+
+    async def run_async(self, changes: Iterable[RoleChange]) -> Dict[str, Any]:
+        changes = list(changes)
+        stats: Dict[str, Any] = {
+            "planned": len(changes), "done": 0,
+            "added": 0, "removed": 0, "skipped": 0, "failed": 0, "cancelled": 0, "failures": [],
+        }
+        started = time.perf_counter()
+        client = AsyncDiscordClient(self.bot_token, transport=self.transport_factory(self.max_concurrency))
+        queue: asyncio.Queue = asyncio.Queue()
+        for change in changes:
+            queue.put_nowait(change)
+
+        async def _worker():
+            while True:
+                try:
+                    change = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if self.should_stop is not None and self.should_stop():
+                    stats["cancelled"] += 1 + queue.qsize()
+                    while not queue.empty():
+                        queue.get_nowait()
+                    return
+                method = "PUT" if change.action == "add" else "DELETE"
+                try:
+                    response = await client.request(method, self._path(change), reason=self.reason)
+                    self._record(stats, change, response.status, None)
+                except Exception as e:
+                    self._record(stats, change, None, str(e))
+
+        try:
+            await asyncio.gather(*(_worker() for _ in range(min(self.max_concurrency, len(changes)))))
+        finally:
+            client.close()
+
+        stats["requests"] = client.stats["requests"]
+        stats["rateLimited"] = client.stats["rateLimited"]
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        if changes:
+            self._report(stats)
+        return stats
+
+    def run(self, changes: Iterable[RoleChange]) -> Dict[str, Any]:
+        """Apply `changes` and return stats; blocks the calling (non-async) thread."""
+        return asyncio.run(self.run_async(changes))
@@ -4,6 +4,9 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime
 import re
 import pytz
+from club_stats_store import rider_key
+# Category rankings and helpers live with the rider history; re-exported here
+from rider_history import zp_category_rank, zrs_category_rank, get_zrs_category, is_zp_category
 
 # No credentials needed - uses Application Default Credentials
 app = firebase_admin.initialize_app()
@@ -185,57 +188,6 @@ def update_discord_zwift_link(discord_id: str, zwift_id: str, username: str = No
         doc_ref.set(data)
         return {"status": "created", "discord_id": discord_id, "zwift_id": zwift_id} 
     
-# ZP category rankings
-zp_category_rank = {
-    'D': 1,
-    'C': 2,
-    'B': 3,
-    'A': 4,
-    'A+': 5,
-}
-
-# Racing score category rankings
-zrs_category_rank = {
-    'E': 1,  # 1-180
-    'D': 2,  # 180-350
-    'C': 3,  # 350-520
-    'B': 4,  # 520-690
-    'A': 5,  # 690-1000
-}
-
-def get_zrs_category(score: float) -> str:
-    """
-    Determine ZRS category based on racing score.
-    
-    Args:
-        score: Racing score value
-        
-    Returns:
-        Category letter (A, B, C, D, E)
-    """
-    if score >= 690:
-        return 'A'
-    elif score >= 520:
-        return 'B'
-    elif score >= 350:
-        return 'C'
-    elif score >= 180:
-        return 'D'
-    else:
-        return 'E'
-
-def is_zp_category(cat: Any) -> bool:
-    """
-    Check if a value is a valid ZP category.
-    
-    Args:
-        cat: The value to check
-        
-    Returns:
-        True if the value is a valid ZP category, False otherwise
-    """
-    return isinstance(cat, str) and cat in zp_category_rank
-
 def format_date(input_str: str) -> str:
     """
     Convert YYMMDD to YYYY-MM-DD format.
@@ -286,16 +238,34 @@ def compare_rider_categories(
         today_id = format_date(today_raw)
         yesterday_id = format_date(yesterday_raw)
 
-        today_doc = db.collection('club_stats').document(today_id).get()
-        yesterday_doc = db.collection('club_stats').document(yesterday_id).get()
+        # Answer from the rider category change log when both days are ingested
+        try:
+            from rider_history import rider_history
+            rider_history.sync()
+            upgrades = rider_history.upgrades_between(yesterday_id, today_id, allowed_rider_ids)
+        except Exception as e:
+            print(f"[WARN] compare_rider_categories: rider history unavailable, comparing snapshots: {e}")
+            upgrades = None
+        if upgrades is not None:
+            paris_tz = pytz.timezone('Europe/Paris')
+            return {
+                'message': 'Comparison complete.',
+                'timeStamp': datetime.now(paris_tz).strftime('%d/%m/%Y, %H:%M:%S'),
+                **upgrades
+            }
+
+        from club_stats_store import club_stats_store
+
+        today_riders = club_stats_store.riders(today_id)
+        yesterday_riders = club_stats_store.riders(yesterday_id)
 
         # If a daily snapshot isn't present yet (e.g. cron runs before ingestion),
         # treat it as "no upgrades" instead of failing the whole endpoint.
-        if not today_doc.exists or not yesterday_doc.exists:
+        if today_riders is None or yesterday_riders is None:
             missing = []
-            if not today_doc.exists:
+            if today_riders is None:
                 missing.append(today_id)
-            if not yesterday_doc.exists:
+            if yesterday_riders is None:
                 missing.append(yesterday_id)
             print(f"[WARN] compare_rider_categories: missing Firestore documents: {missing}")
 
@@ -309,21 +279,6 @@ def compare_rider_categories(
                 'upgradedZRSCategory': []
             }
 
-        today_data = today_doc.to_dict()
-        yesterday_data = yesterday_doc.to_dict()
-        
-        today_riders = (today_data.get('data') or {}).get('riders', []) if today_data else []
-        yesterday_riders = (yesterday_data.get('data') or {}).get('riders', []) if yesterday_data else []
-
-        def _norm_rider_id(v: Any) -> str | None:
-            if v is None:
-                return None
-            if isinstance(v, (int, float)):
-                return str(int(v))
-            if isinstance(v, str):
-                return v.strip() or None
-            return str(v)
-
         allowed: Optional[set[str]] = None
         if allowed_rider_ids:
             allowed = {str(r).strip() for r in allowed_rider_ids if str(r).strip()}
@@ -333,7 +288,7 @@ def compare_rider_categories(
         for r in today_riders:
             if not isinstance(r, dict):
                 continue
-            rid = _norm_rider_id(r.get('riderId'))
+            rid = rider_key(r.get('riderId'))
             if rid and (allowed is None or rid in allowed):
                 today_map[rid] = r
 
@@ -341,7 +296,7 @@ def compare_rider_categories(
         for r in yesterday_riders:
             if not isinstance(r, dict):
                 continue
-            rid = _norm_rider_id(r.get('riderId'))
+            rid = rider_key(r.get('riderId'))
             if rid and (allowed is None or rid in allowed):
                 yesterday_map[rid] = r
 
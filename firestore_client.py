@@ -0,0 +1,15 @@
+class LazyFirestoreClient:
+    """
+    Base for Firestore-backed services: `db` is the client passed to the
+    constructor (stored as `self._db`), otherwise `firebase.db`, imported on
+    first use so importing a service module never initializes Firebase.
+    """
+
+    _db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            import firebase
+            self._db = firebase.db
+        return self._db
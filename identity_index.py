@@ -0,0 +1,258 @@
+import os
+import time
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from firestore_client import LazyFirestoreClient
+
+# Full reload interval when no snapshot listener is running (polling fallback)
+IDENTITY_INDEX_POLL_SECONDS = int(os.getenv("IDENTITY_INDEX_POLL_SECONDS", "300"))
+# Set to 0 to disable the Firestore snapshot listener and always poll
+IDENTITY_INDEX_LISTEN = os.getenv("IDENTITY_INDEX_LISTEN", "1").strip().lower() not in ("0", "false", "no")
+# How long a request waits for the listener's first snapshot before reading the collection itself
+IDENTITY_INDEX_LISTEN_TIMEOUT_SECONDS = float(os.getenv("IDENTITY_INDEX_LISTEN_TIMEOUT_SECONDS", "30"))
+
+# (discordId, zwiftId, email) as indexed for one users document
+_Entry = Tuple[str, str, str]
+
+
+def _entry_from_doc(doc_id: str, data: Optional[Dict[str, Any]]) -> _Entry:
+    """Normalize a users doc; the doc id is the Discord id when discordId is absent."""
+    data = data or {}
+    discord_id = str(data.get("discordId") or "").strip() or str(doc_id or "").strip()
+    zwift_id = str(data.get("zwiftId") or "").strip()
+    email = str(data.get("email") or "").strip()
+    return discord_id, zwift_id, email
+
+
+def watch_is_alive(watch) -> Optional[bool]:
+    """
+    Whether a Firestore snapshot watch is still streaming: False once it was
+    closed or its stream stopped, None when the client does not tell.
+    """
+    if watch is None or getattr(watch, "_closed", False):
+        return False
+    active = getattr(watch, "is_active", None)
+    return bool(active) if active is not None else None
+
+
+class IdentityIndex(LazyFirestoreClient):
+    """
+    In-process index of the Firestore `users` collection.
+
+    Bidirectional lookups (discordId -> zwiftId, zwiftId -> discordId,
+    discordId -> email) are loaded with one full read per process and kept
+    current through a Firestore snapshot listener: the listener's first
+    snapshot (every document) is the load. The collection is streamed
+    directly only in polling mode, when the listener cannot be started, or
+    when its first snapshot does not arrive within
+    IDENTITY_INDEX_LISTEN_TIMEOUT_SECONDS. When the listener stops (a dead
+    watch does not always report an error) it is restarted, and without a
+    listener the index is reloaded at most every IDENTITY_INDEX_POLL_SECONDS
+    on access.
+
+    Maps are replaced (copy-on-write), never mutated in place, so the
+    read-only views returned by the accessors are safe to iterate while
+    updates arrive.
+    """
+
+    def __init__(self, collection: str = "users", db=None, poll_seconds: int = IDENTITY_INDEX_POLL_SECONDS,
+                 listen: bool = IDENTITY_INDEX_LISTEN,
+                 listen_timeout: float = IDENTITY_INDEX_LISTEN_TIMEOUT_SECONDS):
+        self.collection = collection
+        self._db = db
+        self.poll_seconds = poll_seconds
+        self.listen = listen
+        self.listen_timeout = listen_timeout
+
+        self._entries: Dict[str, _Entry] = {}          # doc id -> entry
+        self._discord_to_zwift: Dict[str, str] = {}
+        self._zwift_to_discord: Dict[str, str] = {}
+        self._discord_to_email: Dict[str, str] = {}
+
+        self._loaded_at = 0.0
+        self._last_event = 0.0   # time of the last listener callback
+        self._watch = None
+        self._listening = False
+        self._initial = threading.Event()   # set once the current listener delivered its first snapshot
+        self._lock = threading.Lock()       # guards swaps of the maps
+        self._load_lock = threading.Lock()  # serializes updates of the entries
+        self._start_lock = threading.Lock() # single-flight loads and listener (re)starts
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _swap(self, entries: Dict[str, _Entry]) -> None:
+        discord_to_zwift: Dict[str, str] = {}
+        zwift_to_discord: Dict[str, str] = {}
+        discord_to_email: Dict[str, str] = {}
+        for discord_id, zwift_id, email in entries.values():
+            if not discord_id:
+                continue
+            if zwift_id:
+                discord_to_zwift[discord_id] = zwift_id
+                zwift_to_discord[zwift_id] = discord_id
+            if email:
+                discord_to_email[discord_id] = email
+        with self._lock:
+            self._entries = entries
+            self._discord_to_zwift = discord_to_zwift
+            self._zwift_to_discord = zwift_to_discord
+            self._discord_to_email = discord_to_email
+            self._loaded_at = time.time()
+
+    def _load_all(self) -> None:
+        entries = {
+            doc.id: _entry_from_doc(doc.id, doc.to_dict())
+            for doc in self.db.collection(self.collection).stream()
+        }
+        self._swap(entries)
+        print(f"[INFO] Identity index loaded {len(entries)} {self.collection} docs")
+
+    def _on_snapshot(self, col_snapshot, changes, read_time) -> None:
+        self._last_event = time.time()
+        try:
+            with self._load_lock:
+                if self._initial.is_set():
+                    self._apply_changes(changes)
+                else:
+                    # The first snapshot holds every document: it is the full load
+                    self._swap({doc.id: _entry_from_doc(doc.id, doc.to_dict()) for doc in col_snapshot})
+                    print(f"[INFO] Identity index loaded {len(self._entries)} {self.collection} docs from the listener")
+            self._listening = True
+        except Exception as e:
+            print(f"[WARN] Identity index listener update failed; falling back to polling: {e}")
+            self._listening = False
+        finally:
+            self._initial.set()
+
+    def _apply_changes(self, changes) -> None:
+        entries = dict(self._entries)
+        for change in changes:
+            doc = change.document
+            if change.type.name == "REMOVED":
+                entries.pop(doc.id, None)
+            else:
+                entries[doc.id] = _entry_from_doc(doc.id, doc.to_dict())
+        self._swap(entries)
+
+    def _start_listener(self) -> bool:
+        """Start the listener (its first snapshot loads the index); False in polling mode."""
+        if not self.listen:
+            return False
+        if self._watch is not None:
+            return True
+        self._initial = threading.Event()
+        try:
+            self._watch = self.db.collection(self.collection).on_snapshot(self._on_snapshot)
+            self._listening = True
+            return True
+        except Exception as e:
+            print(f"[WARN] Identity index listener unavailable; polling every {self.poll_seconds}s: {e}")
+            self._watch = None
+            self._listening = False
+            return False
+
+    def _fresh(self) -> bool:
+        if not self._loaded_at:
+            return False
+        if self._listening:
+            alive = watch_is_alive(self._watch)
+            if alive:
+                return True
+            if alive is None and time.time() - max(self._loaded_at, self._last_event) < self.poll_seconds:
+                # Liveness unknown: trust the listener while it has been heard from recently
+                return True
+        return time.time() - self._loaded_at < self.poll_seconds
+
+    def ensure_loaded(self) -> None:
+        """
+        Load on first use; reload when the index is older than poll_seconds and
+        no healthy listener keeps it current (restarting a dead listener).
+        """
+        if self._fresh():
+            return
+        with self._start_lock:
+            if self._fresh():
+                return
+            if self._watch is not None and watch_is_alive(self._watch) is False:
+                print("[WARN] Identity index listener stopped; restarting it")
+                self.close()
+            if self._start_listener():
+                # Not holding _load_lock: the listener callback takes it
+                if self._initial.wait(self.listen_timeout) and self._fresh():
+                    return
+                if not self._initial.is_set():
+                    print(f"[WARN] Identity index listener sent nothing within {self.listen_timeout}s; "
+                          "reading the collection directly")
+            with self._load_lock:
+                self._load_all()
+
+    def refresh(self) -> None:
+        """Force a full reload (e.g. after a bulk import)."""
+        with self._load_lock:
+            self._load_all()
+
+    def note_link(self, discord_id: str, zwift_id: Optional[str]) -> None:
+        """
+        Apply a link written by this process right away, so polling mode does not
+        serve the old value until the next reload. The listener, when running,
+        delivers the same change shortly after.
+        """
+        discord_id = str(discord_id or "").strip()
+        if not discord_id or not self._loaded_at:
+            return
+        with self._load_lock:
+            entries = dict(self._entries)
+            doc_id = next((k for k, e in entries.items() if e[0] == discord_id), discord_id)
+            _, _, email = entries.get(doc_id, ("", "", ""))
+            entries[doc_id] = (discord_id, str(zwift_id or "").strip(), email)
+            self._swap(entries)
+
+    def close(self) -> None:
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+        self._watch = None
+        self._listening = False
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def discord_to_zwift(self) -> Mapping[str, str]:
+        self.ensure_loaded()
+        return MappingProxyType(self._discord_to_zwift)
+
+    def zwift_to_discord(self) -> Mapping[str, str]:
+        self.ensure_loaded()
+        return MappingProxyType(self._zwift_to_discord)
+
+    def discord_to_email(self) -> Mapping[str, str]:
+        self.ensure_loaded()
+        return MappingProxyType(self._discord_to_email)
+
+    def zwift_id_for(self, discord_id: Any) -> Optional[str]:
+        return self.discord_to_zwift().get(str(discord_id or "").strip())
+
+    def discord_id_for(self, zwift_id: Any) -> Optional[str]:
+        return self.zwift_to_discord().get(str(zwift_id or "").strip())
+
+    def email_for(self, discord_id: Any) -> Optional[str]:
+        return self.discord_to_email().get(str(discord_id or "").strip())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._entries),
+            "linked": len(self._discord_to_zwift),
+            "mode": "listener" if self._listening else "polling",
+            "ageSeconds": round(time.time() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+
+# Process-wide index shared by all routes and helpers
+identity_index = IdentityIndex()
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+# Long admin operations run concurrently per process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Progress and cancellation are synced with the job store at most this often
+JOB_SYNC_SECONDS = float(os.getenv("JOB_SYNC_SECONDS", "1"))
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job (via JobContext.check_cancelled) once cancellation was
+    requested; raise it with `result` to keep what the job did before it stopped.
+    """
+
+    def __init__(self, message: str, result: Any = None):
+        super().__init__(message)
+        self.result = result
+
+
+class JobFailed(Exception):
+    """Raise from a job to fail it while still storing a result payload (e.g. the error response)."""
+
+    def __init__(self, message: str, result: Any = None):
+        super().__init__(message)
+        self.result = result
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SQLiteJobStore:
+    """Job records as JSON rows in a local SQLite file (shared by the worker processes of one host)."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = (
+            path
+            or os.getenv("JOBS_DB_PATH")
+            or os.path.join(tempfile.gettempdir(), "jobs.sqlite3")
+        )
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def create(self, record: Dict[str, Any]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, data, updated) VALUES (?, ?, ?)",
+                (record["id"], json.dumps(record, default=str), time.time()),
+            )
+
+    def update(self, job_id: str, fields: Dict[str, Any]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            record = json.loads(row[0]) if row else {"id": job_id}
+            record.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, data, updated) VALUES (?, ?, ?)",
+                (job_id, json.dumps(record, default=str), time.time()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+
+class FirestoreJobStore:
+    """Job records in a Firestore collection, so any instance can report on or cancel a job."""
+
+    def __init__(self, collection: str = "jobs"):
+        # Imported lazily so the SQLite store works without Firestore credentials
+        from firebase import db
+        self._col = db.collection(collection)
+
+    def create(self, record: Dict[str, Any]) -> None:
+        self._col.document(record["id"]).set(record)
+
+    def update(self, job_id: str, fields: Dict[str, Any]) -> None:
+        self._col.document(job_id).set(fields, merge=True)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        snap = self._col.document(job_id).get()
+        return snap.to_dict() if snap.exists else None
+
+
+def store_from_env():
+    """JOBS_BACKEND: "sqlite" (default) or "firestore"."""
+    kind = os.getenv("JOBS_BACKEND", "sqlite").strip().lower()
+    if kind == "firestore":
+        return FirestoreJobStore()
+    return SQLiteJobStore()
+
+
+class JobContext:
+    """
+    Handle passed to a running job for reporting progress and checking
+    for cancellation. Progress is written to the store at most every
+    JOB_SYNC_SECONDS (and always when the job finishes).
+    """
+
+    def __init__(self, runner: "JobRunner", job_id: str):
+        self.runner = runner
+        self.job_id = job_id
+        self._progress: Dict[str, Any] = {}
+        self._cancel = threading.Event()
+        self._last_sync = 0.0
+
+    def progress(self, done: Optional[int] = None, total: Optional[int] = None,
+                 stage: Optional[str] = None, force: bool = False, **counters: Any) -> None:
+        """Record progress; `done`/`total` drive percentages, any extra counters are stored as-is."""
+        if done is not None:
+            self._progress["done"] = done
+        if total is not None:
+            self._progress["total"] = total
+        if stage is not None:
+            self._progress["stage"] = stage
+        self._progress.update(counters)
+        self._sync(force)
+
+    def _sync(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_sync < JOB_SYNC_SECONDS:
+            return
+        self._last_sync = now
+        try:
+            self.runner.store.update(self.job_id, {"progress": dict(self._progress), "heartbeatAt": _now_iso()})
+            if not self._cancel.is_set():
+                record = self.runner.store.get(self.job_id) or {}
+                if record.get("cancelRequested"):
+                    self._cancel.set()
+        except Exception as e:
+            print(f"[WARN] Job {self.job_id}: progress update failed: {e}")
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancel.is_set():
+            self._sync()
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} cancelled")
+
+
+class _NullJob:
+    """Stand-in JobContext for operations that run inline in a request."""
+
+    job_id = None
+    cancelled = False
+
+    def progress(self, *args, **kwargs) -> None:
+        pass
+
+    def check_cancelled(self) -> None:
+        pass
+
+
+# Default `job` argument of operations that can run both inline and as a job
+NULL_JOB = _NullJob()
+
+
+class JobRunner:
+    """
+    Runs long admin operations on a local thread pool and tracks them in a
+    job store.
+
+    `submit(kind, fn, ...)` returns a job id immediately; `fn(job, ...)` runs
+    on a worker thread and receives a JobContext. Its return value becomes the
+    job's `result`. Raising JobCancelled marks the job cancelled, JobFailed or
+    any other exception marks it failed.
+
+    Usage:
+        job_id = jobs.submit("roster-refresh", refresh, club_id)
+        jobs.get(job_id) -> {"id", "kind", "status", "progress", "result", "error", ...}
+    """
+
+    def __init__(self, store=None, max_workers: int = JOB_WORKERS):
+        self._store = store
+        self.max_workers = max(1, int(max_workers))
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._contexts: Dict[str, JobContext] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = store_from_env()
+        return self._store
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+            return self._pool
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args: Any,
+               params: Optional[Dict[str, Any]] = None, **kwargs: Any) -> str:
+        job_id = uuid.uuid4().hex
+        self.store.create({
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "params": params or {},
+            "progress": {},
+            "result": None,
+            "error": None,
+            "cancelRequested": False,
+            "createdAt": _now_iso(),
+            "startedAt": None,
+            "finishedAt": None,
+        })
+        ctx = JobContext(self, job_id)
+        with self._lock:
+            self._contexts[job_id] = ctx
+        self._executor().submit(self._run, ctx, kind, fn, args, kwargs)
+        print(f"[INFO] Job {job_id} ({kind}) queued")
+        return job_id
+
+    def _run(self, ctx: JobContext, kind: str, fn: Callable[..., Any], args, kwargs) -> None:
+        fields: Dict[str, Any]
+        started = time.perf_counter()
+        try:
+            if ctx.cancelled:
+                raise JobCancelled(f"Job {ctx.job_id} cancelled before it started")
+            self.store.update(ctx.job_id, {"status": "running", "startedAt": _now_iso()})
+            result = fn(ctx, *args, **kwargs)
+            fields = {"status": "succeeded", "result": result}
+        except JobCancelled as e:
+            fields = {"status": "cancelled", "error": str(e), "result": e.result}
+        except JobFailed as e:
+            fields = {"status": "failed", "error": str(e), "result": e.result}
+        except Exception as e:
+            print(f"[WARN] Job {ctx.job_id} ({kind}) failed: {e}")
+            fields = {"status": "failed", "error": str(e)}
+        finally:
+            with self._lock:
+                self._contexts.pop(ctx.job_id, None)
+
+        fields.update(progress=dict(ctx._progress), finishedAt=_now_iso())
+        try:
+            self.store.update(ctx.job_id, fields)
+        except Exception as e:
+            print(f"[WARN] Job {ctx.job_id} ({kind}): could not store final state: {e}")
+        print(f"[INFO] Job {ctx.job_id} ({kind}) {fields['status']} in {time.perf_counter() - started:.1f}s")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Request cancellation; the job stops at its next check_cancelled(). Returns the updated record."""
+        record = self.store.get(job_id)
+        if record is None or record.get("status") in FINISHED_STATUSES:
+            return record
+        self.store.update(job_id, {"cancelRequested": True})
+        with self._lock:
+            ctx = self._contexts.get(job_id)
+        if ctx is not None:
+            ctx._cancel.set()
+        return self.store.get(job_id)
+
+
+# Process-wide runner used by the Flask routes
+job_runner = JobRunner()
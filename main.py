@@ -1,8 +1,11 @@
 import os
 import time
 import inspect
+import json
+import hashlib
 import logging
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, flash, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 from functools import wraps
 import requests
@@ -10,17 +13,44 @@ from datetime import datetime, timedelta, date, timezone
 from collections import Counter
 import firebase
 from discord_api import DiscordAPI
+from discord_dm import BulkDMSender
+from discord_members import member_snapshots
+from discord_roles import RoleChange, RoleMutationPipeline
 from zwift import ZwiftAPI
 import pytz
 from bisect import bisect_right
 from typing import Optional
-from zwiftpower import ZwiftPower
+from zwiftpower import ZwiftPower, ANALYSIS_FIELDS, PROFILE_MAX_WORKERS
+from zwiftpower_cache import ZwiftPowerCache
+from zwiftpower_index import MATCH_MODES
+from zwiftpower_session import ZwiftPowerSessionStore
 from zwiftcommentator import ZwiftCommentator
+from bulk_writer import BulkWriter, delete_op, set_op
+from identity_index import identity_index
+from rider_history import RIDER_FIELDS, day_version, rider_history
+from club_stats_store import club_stats_store
+from club_stats_cache import latest_club_stats
+from rider_enrichment import ZWIFT_PROFILE_WORKERS, QueueBusy, RiderEnrichmentWorker, rider_queue
+from activity_rollups import ACTIVITY_EXACT_MAX_DAYS, SKETCH_FIELDS, activity_rollups, date_keys, merge_rollups, unique_counts
+from jobs import FINISHED_STATUSES, JobCancelled, JobFailed, NULL_JOB, job_runner
 
 # Load environment variables from .env file
 load_dotenv()
 
+
+class AppJSONProvider(DefaultJSONProvider):
+    """jsonify() support for lazy views (e.g. discord_members.LazyRoles) exposing to_json()."""
+
+    @staticmethod
+    def default(o):
+        to_json = getattr(o, "to_json", None)
+        if callable(to_json):
+            return to_json()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = AppJSONProvider(app)
 
 # Configure session
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "your-secret-key-change-this-in-production")
@@ -43,15 +73,27 @@ def log_request_path():
     })
 
 # Global variables to cache authenticated sessions
-cached_session = None
-cached_session_timestamp = None 
 cached_zwift_api = None
 cached_zwift_api_timestamp = None
 SESSION_VALIDITY = 3600  # seconds (how long the session is expected to be valid)
 
+# Concurrent Firestore batch commits used by the roster sync
+ROSTER_SYNC_WORKERS = int(os.getenv("ROSTER_SYNC_WORKERS", "4"))
+# A roster smaller than this fraction of the stored one is treated as a bad
+# fetch: nobody is removed and no events are recorded
+ROSTER_SYNC_MIN_FRACTION = float(os.getenv("ROSTER_SYNC_MIN_FRACTION", "0.5"))
+
+# Shared on-disk cache for ZwiftPower team_results/team_riders payloads
+# (configured via ZWIFTPOWER_CACHE_DIR / ZWIFTPOWER_CACHE_TTL_SECONDS)
+zwiftpower_cache = ZwiftPowerCache()
+
 ZWIFT_USERNAME = os.getenv("ZWIFT_USERNAME", "your_username")
 ZWIFT_PASSWORD = os.getenv("ZWIFT_PASSWORD", "your_password")
 
+# Logged-in ZwiftPower cookies shared across workers/instances
+# (ZWIFTPOWER_SESSION_BACKEND=file|firestore, ZWIFTPOWER_SESSION_FILE)
+zwiftpower_sessions = ZwiftPowerSessionStore(ZWIFT_USERNAME, ZWIFT_PASSWORD, max_age=SESSION_VALIDITY)
+
 OPENAI_KEY = os.getenv("OPENAI_KEY", "your_openai_key")
 
 DISCORD_GOSSIP_ID = os.getenv("DISCORD_GOSSIP_ID", "your_discord_gossip_id")
@@ -104,19 +146,9 @@ def _get_verified_member_zwift_ids(force_refresh: bool = False) -> set[str]:
         _verified_zwift_ids_cache_ts = now
         return _verified_zwift_ids_cache
 
-    # Build discordId -> zwiftId lookup from Firestore users
-    discord_to_zwift: dict[str, str] = {}
+    # discordId -> zwiftId lookup from the shared users index
     try:
-        users = firebase.get_collection("users", limit=100000) or []
-        for u in users:
-            if not isinstance(u, dict):
-                continue
-            did = u.get("discordId")
-            zid = u.get("zwiftId")
-            did_s = str(did).strip() if did is not None else ""
-            zid_s = str(zid).strip() if zid is not None else ""
-            if did_s and zid_s:
-                discord_to_zwift[did_s] = zid_s
+        discord_to_zwift = identity_index.discord_to_zwift()
     except Exception as e:
         print(f"[WARN] Failed to load users for verified allowlist: {e}")
         discord_to_zwift = {}
@@ -197,87 +229,154 @@ def verify_api_key():
     return token == CONTENT_API_KEY
 
 
-def _commit_in_batches(write_ops, batch_size: int = 450):
-    """
-    Commit Firestore batch writes in chunks (Firestore limit is 500 ops per batch).
-    write_ops: iterable of callables that accept a firestore batch.
-    """
-    ops = list(write_ops or [])
-    committed = 0
-    for i in range(0, len(ops), batch_size):
-        batch = firebase.db.batch()
-        chunk = ops[i:i + batch_size]
-        for op in chunk:
-            op(batch)
-        batch.commit()
-        committed += len(chunk)
-    return committed
-
-
-def overwrite_companion_club_members_in_firestore(members: list[dict]) -> dict:
-    """
-    Store the current club roster in Firestore as an "official membership list",
-    overwriting any previous data.
+# Fields maintained by the roster sync itself; excluded from the content hash
+_ROSTER_SYNC_FIELDS = ("rosterSyncedAt", "updatedAt", "contentHash")
 
-    Layout:
-      - companion_club_members/{profileId} (per-member docs)
 
-    Each member doc gets:
-      - rosterSyncedAt: datetime
+def _roster_content_hash(data: dict) -> str:
+    payload = {k: v for k, v in (data or {}).items() if k not in _ROSTER_SYNC_FIELDS}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def sync_roster_collection(collection: str, members, key_field: str, extra_fields=None) -> dict:
+    """
+    Make Firestore `collection` mirror `members`, writing only the differences.
+
+    Existing docs are read once and compared by content hash (stored as
+    `contentHash` on each doc) against the incoming members keyed by
+    `key_field`:
+      - added:     new key -> doc written
+      - changed:   hash differs -> doc rewritten
+      - unchanged: no write
+      - removed:   key no longer present -> doc deleted (after the stream ends)
+
+    `members` may be a stream (e.g. roster pages still downloading); adds and
+    changes are committed batch by batch as they arrive, in parallel batches.
+    `extra_fields(key, member)` may return fields stored on the doc but not
+    part of the hash input (e.g. a normalized id).
+
+    Joins and leaves are recorded in `roster_events` (skipped on the first
+    sync of an empty collection, where every member would be a "join").
+
+    An empty roster, or one below ROSTER_SYNC_MIN_FRACTION of the stored
+    one, is not trusted (e.g. an unexpected upstream response): its adds and
+    changes are written, but no doc is deleted and no event is recorded.
     """
     sync_ts = datetime.utcnow()
-
-    members_col_ref = firebase.db.collection("companion_club_members")
-
-    # 1) Delete all existing docs (full overwrite)
-    existing_stream = members_col_ref.stream()
-
-    def make_delete_op(doc_ref):
-        def _op(batch):
-            batch.delete(doc_ref)
-        return _op
-
-    delete_ops = [make_delete_op(doc.reference) for doc in existing_stream]
-    deleted_count = _commit_in_batches(delete_ops)
-
-    # Upsert members
-    def make_set_op(profile_id: str, data: dict):
-        doc_ref = members_col_ref.document(str(profile_id))
-
-        def _op(batch):
-            batch.set(
-                doc_ref,
-                {
-                    **(data or {}),
-                    "profileId": str(profile_id),
-                    "rosterSyncedAt": sync_ts,
-                    "updatedAt": sync_ts,
-                },
-                merge=False,
+    col_ref = firebase.db.collection(collection)
+
+    existing = {}
+    for doc in col_ref.stream():
+        data = doc.to_dict() or {}
+        existing[doc.id] = data.get("contentHash") or _roster_content_hash(data)
+    bootstrap = not existing
+
+    seen = set()
+    added: list[str] = []
+    changed: list[str] = []
+    unchanged = 0
+    member_count = 0
+    names = {}
+
+    def upsert_ops():
+        nonlocal unchanged, member_count
+        for m in members or []:
+            member_count += 1
+            raw_key = (m or {}).get(key_field)
+            if raw_key is None:
+                continue
+            key = str(raw_key)
+            if key in seen:
+                continue
+            seen.add(key)
+            data = {**(m or {}), **(extra_fields(key, m) if extra_fields else {})}
+            content_hash = _roster_content_hash(data)
+            previous = existing.get(key)
+            if previous == content_hash:
+                unchanged += 1
+                continue
+            (added if previous is None else changed).append(key)
+            names[key] = data.get("name") or " ".join(
+                p for p in (data.get("firstName"), data.get("lastName")) if p
+            ) or None
+            yield set_op(
+                col_ref.document(key),
+                {**data, "contentHash": content_hash, "rosterSyncedAt": sync_ts, "updatedAt": sync_ts},
             )
 
-        return _op
-
-    upsert_ops = []
-    for m in members or []:
-        pid = (m or {}).get("profileId")
-        if pid is None:
-            continue
-        upsert_ops.append(make_set_op(str(pid), m))
+    writer = BulkWriter(firebase.db, max_in_flight=ROSTER_SYNC_WORKERS, name=f"{collection} sync")
+    upserted_count = writer.write(upsert_ops())["ops"]
 
-    upserted_count = _commit_in_batches(upsert_ops)
+    removed = [key for key in existing if key not in seen]
+    suspect = bool(existing) and len(seen) < ROSTER_SYNC_MIN_FRACTION * len(existing)
+    if suspect:
+        print(
+            f"[WARN] {collection} sync: incoming roster has {len(seen)} members vs {len(existing)} stored; "
+            f"not removing {len(removed)} members or recording events"
+        )
+        removed = []
+    deleted_count = writer.write(delete_op(col_ref.document(key)) for key in removed)["ops"]
+
+    events_recorded = 0
+    if not bootstrap and not suspect:
+        events_ref = firebase.db.collection("roster_events")
+
+        def event_ops():
+            for event_type, keys in (("join", added), ("leave", removed)):
+                for key in keys:
+                    yield set_op(events_ref.document(), {
+                        "type": event_type,
+                        "collection": collection,
+                        "memberId": key,
+                        "name": names.get(key),
+                        "at": sync_ts,
+                    })
+
+        events_recorded = writer.write(event_ops())["ops"]
 
     return {
-        "memberCount": len(members or []),
+        "memberCount": member_count,
         "syncedAt": sync_ts.isoformat() + "Z",
+        "added": len(added),
+        "changed": len(changed),
+        "unchanged": unchanged,
+        "removed": len(removed),
+        "events": events_recorded,
+        # True when the roster was too small to trust (no removals/events applied)
+        "rosterSuspect": suspect,
+        # Kept for callers of the former full-overwrite sync
         "deleted": deleted_count,
         "upserted": upserted_count,
     }
 
 
+def overwrite_companion_club_members_in_firestore(members) -> dict:
+    """
+    Store the current club roster in Firestore as an "official membership list".
+
+    `members` may be any iterable of simplified members, including a stream
+    that is still downloading (e.g. pages from ZwiftAPI.iter_simplified_club_roster).
+    Only added/changed members are written and departed members deleted
+    (see sync_roster_collection).
+
+    Layout:
+      - companion_club_members/{profileId} (per-member docs)
+
+    Each written member doc gets:
+      - profileId (string), contentHash, rosterSyncedAt, updatedAt
+    """
+    return sync_roster_collection(
+        "companion_club_members",
+        members,
+        key_field="profileId",
+        extra_fields=lambda key, m: {"profileId": key},
+    )
+
+
 def overwrite_zwiftpower_club_members_in_firestore(members: list[dict]) -> dict:
     """
-    Store ZwiftPower team_riders roster in Firestore, overwriting any previous data.
+    Store ZwiftPower team_riders roster in Firestore, writing only the
+    differences to the stored roster (see sync_roster_collection).
 
     Collection:
       - zwiftpower_club_members/{zwid}
@@ -287,72 +386,39 @@ def overwrite_zwiftpower_club_members_in_firestore(members: list[dict]) -> dict:
       - name
       - rank (numeric when possible)
       - rankRaw (original rank value)
-      - rosterSyncedAt, updatedAt
+      - contentHash, rosterSyncedAt, updatedAt
     """
-    sync_ts = datetime.utcnow()
-    col_ref = firebase.db.collection("zwiftpower_club_members")
-
-    # 1) Delete all existing docs (full overwrite)
-    existing_stream = col_ref.stream()
-
-    def make_delete_op(doc_ref):
-        def _op(batch):
-            batch.delete(doc_ref)
-        return _op
-
-    delete_ops = [make_delete_op(doc.reference) for doc in existing_stream]
-    deleted_count = _commit_in_batches(delete_ops)
-
-    # 2) Write fresh docs keyed by zwid
-    def make_set_op(doc_id: str, data: dict):
-        doc_ref = col_ref.document(str(doc_id))
-
-        def _op(batch):
-            batch.set(
-                doc_ref,
-                {
-                    **(data or {}),
-                    "rosterSyncedAt": sync_ts,
-                    "updatedAt": sync_ts,
-                },
-                merge=False,
-            )
-
-        return _op
-
-    upsert_ops = []
-    for m in members or []:
-        zwid = (m or {}).get("zwid")
-        if zwid is None:
-            continue
-        upsert_ops.append(make_set_op(str(zwid), m))
-
-    upserted_count = _commit_in_batches(upsert_ops)
-
-    return {
-        "memberCount": len(members or []),
-        "syncedAt": sync_ts.isoformat() + "Z",
-        "deleted": deleted_count,
-        "upserted": upserted_count,
-    }
+    return sync_roster_collection("zwiftpower_club_members", members, key_field="zwid")
 
 
-def _refresh_companion_club_roster(club_id: str, limit: int = 100, paginate: bool = True) -> dict:
+def _refresh_companion_club_roster(club_id: str, limit: int = 100, paginate: bool = True, job=NULL_JOB) -> dict:
     """Fetch roster from Zwift and overwrite Firestore collection companion_club_members."""
     zwift_api = get_authenticated_zwift_api()
     zwift_api.ensure_valid_token()
 
-    roster = zwift_api.get_club_roster(str(club_id), limit=limit, paginate=paginate)
-    simplified = ZwiftAPI.simplify_club_roster(roster or [])
-
-    result = overwrite_companion_club_members_in_firestore(simplified)
+    def roster_members():
+        fetched = 0
+        for page in pages:
+            job.check_cancelled()
+            fetched += len(page)
+            job.progress(done=fetched, stage="downloading")
+            yield from page
+        job.progress(stage="syncing")
+
+    # Pages are written to Firestore while the rest of the roster is still downloading
+    pages = zwift_api.iter_simplified_club_roster(str(club_id), limit=limit, paginate=paginate)
+    result = overwrite_companion_club_members_in_firestore(roster_members())
     return {
         "status": "success",
         "clubId": str(club_id),
-        "fetched": len(roster or []),
+        "fetched": result["memberCount"],
         "stored": result["memberCount"],
         "deleted": result["deleted"],
         "upserted": result["upserted"],
+        "added": result["added"],
+        "changed": result["changed"],
+        "unchanged": result["unchanged"],
+        "removed": result["removed"],
         "syncedAt": result["syncedAt"],
     }
 
@@ -461,32 +527,14 @@ def build_companion_club_growth_series() -> dict:
 
 
 def get_authenticated_session() -> requests.Session:
-    """Return a cached, authenticated session if available and still valid; otherwise, log in."""
-    global cached_session, cached_session_timestamp
-    now = time.time()
-    # If we have a session and it hasn't expired yet, reuse it.
-    if cached_session and cached_session_timestamp and (now - cached_session_timestamp < SESSION_VALIDITY):
-        print("Using cached authenticated session (container is warm).")
-        return cached_session
-
-    # Otherwise, create a new session and log in.
-    print("No valid session found. Logging in again.")
-    new_session = requests.Session()
-    new_session.headers.update({
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 "
-            "Safari/537.36"
-        )
-    })
+    """
+    Return an authenticated ZwiftPower session.
 
-    zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD)
-    zp.session = new_session  # Use our new session
-    zp.login()
-    # Update the cache
-    cached_session = new_session
-    cached_session_timestamp = now
-    return new_session
+    Sessions are shared through the ZwiftPower session store (see
+    ZWIFTPOWER_SESSION_BACKEND), so a cold worker restores the stored cookies
+    instead of repeating the SSO login.
+    """
+    return zwiftpower_sessions.get_session()
 
 def get_authenticated_zwift_api() -> ZwiftAPI:
     """Return a cached, authenticated ZwiftAPI if available and still valid; otherwise, create a new one."""
@@ -510,15 +558,73 @@ def get_authenticated_zwift_api() -> ZwiftAPI:
     cached_zwift_api_timestamp = now
     return new_zwift_api
 
+def _zwiftpower_client() -> ZwiftPower:
+    """Return a ZwiftPower client bound to the authenticated session and the shared payload cache."""
+    zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD, cache=zwiftpower_cache, sessions=zwiftpower_sessions)
+    zp.session = get_authenticated_session()
+    return zp
+
+def _with_cache_headers(response, cache_info: Optional[dict]):
+    """Expose ZwiftPower cache status (hit/miss/revalidated/stale) and entry age as response headers."""
+    if cache_info:
+        response.headers['X-Cache'] = str(cache_info.get('status', '')).upper()
+        response.headers['X-Cache-Age'] = str(cache_info.get('ageSeconds', 0))
+        if cache_info.get('fetchedAt'):
+            response.headers['X-Cache-Fetched-At'] = cache_info['fetchedAt']
+    return response
+
+
+def _wants_async() -> bool:
+    """?async=1 (or "async": true in a JSON body) asks for a long operation to run as a background job."""
+    raw = request.args.get('async')
+    if raw is None:
+        body = request.get_json(silent=True)
+        raw = body.get('async') if isinstance(body, dict) else None
+    return str(raw).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _start_job(kind: str, operation, *args):
+    """
+    Run operation(*args, job=...) -> (payload, status) on the job runner and
+    answer 202 with the job id. A non-2xx status fails the job, keeping the
+    payload as its result.
+    """
+    def _run(job, *run_args):
+        payload, status = operation(*run_args, job=job)
+        if status >= 400:
+            message = (payload.get('error') or payload.get('message')) if isinstance(payload, dict) else None
+            raise JobFailed(message or f"Operation failed with status {status}", result=payload)
+        return payload
+
+    job_id = job_runner.submit(kind, _run, *args, params={"endpoint": request.path})
+    status_url = url_for('job_status', job_id=job_id)
+    response = jsonify({"jobId": job_id, "kind": kind, "status": "queued", "statusUrl": status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+def _role_progress_reporter(job):
+    """RoleMutationPipeline on_progress callback that logs and feeds the job's progress counters."""
+    def _report(stats):
+        print(
+            f"[INFO] role-pipeline: {stats['done']}/{stats['planned']} done "
+            f"(added {stats['added']}, removed {stats['removed']}, failed {stats['failed']})"
+        )
+        job.progress(
+            done=stats['done'], total=stats['planned'],
+            added=stats['added'], removed=stats['removed'], skipped=stats['skipped'], failed=stats['failed'],
+        )
+    return _report
+
+def _wants_refresh() -> bool:
+    return str(request.args.get('refresh', '')).lower().strip() in ('1', 'true', 'yes')
+
 @app.route('/team_riders/<int:club_id>', methods=['GET'])
 def team_riders(club_id: int):
     """Get ZwiftPower registered team riders for a given club ID"""
     try:
-        session = get_authenticated_session()
-        zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD)
-        zp.session = session
-        data = zp.get_team_riders(club_id)
-        return jsonify(data)
+        zp = _zwiftpower_client()
+        data = zp.get_team_riders(club_id, force_refresh=_wants_refresh())
+        return _with_cache_headers(jsonify(data), zp.last_cache_info)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -526,11 +632,9 @@ def team_riders(club_id: int):
 def team_results(club_id: int):
     """Get ZwiftPower weekly team results for a given club ID"""
     try:
-        session = get_authenticated_session()
-        zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD)
-        zp.session = session
-        data = zp.get_team_results(club_id)
-        return jsonify(data)
+        zp = _zwiftpower_client()
+        data = zp.get_team_results(club_id, force_refresh=_wants_refresh())
+        return _with_cache_headers(jsonify(data), zp.last_cache_info)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -541,9 +645,14 @@ def filter_events(club_id: int):
     
     Query Parameters:
         title (str): The pattern to match in event titles (case-insensitive)
+        match (str): substring (default), all, any or prefix - see
+            ZwiftPower.filter_events_by_title
+        refresh (bool): Bypass the results cache freshness window
         
     Example:
         /filter_events/11939?title=Tour%20de%20Zwift
+        /filter_events/11939?title=Tour%20de%20Zwift&match=prefix
+        /filter_events/11939?title=ZRL%20WTRL&match=any
     """
     try:
         # Get the title pattern from query parameters
@@ -551,25 +660,29 @@ def filter_events(club_id: int):
         if not title_pattern:
             return jsonify({"error": "Missing 'title' query parameter"}), 400
 
+        match_mode = (request.args.get('match') or 'substring').strip().lower()
+        if match_mode not in MATCH_MODES:
+            return jsonify({"error": f"Invalid 'match' query parameter (expected one of: {', '.join(MATCH_MODES)})"}), 400
+
         # Get authenticated session and create ZwiftPower instance
-        session = get_authenticated_session()
-        zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD)
-        zp.session = session
+        zp = _zwiftpower_client()
 
-        # Filter events by title
-        filtered_data = zp.filter_events_by_title(club_id, title_pattern)
+        # Filter events by title (served from the per-snapshot title index)
+        filtered_data = zp.filter_events_by_title(
+            club_id, title_pattern, match=match_mode, force_refresh=_wants_refresh()
+        )
         
         # If no events found, return appropriate message
         if not filtered_data:
-            return jsonify({
+            return _with_cache_headers(jsonify({
                 "message": f"No events found matching pattern '{title_pattern}'",
                 "filtered_events": {}
-            })
+            }), zp.last_cache_info)
 
-        return jsonify({
+        return _with_cache_headers(jsonify({
             "message": f"Found {len(filtered_data)} events matching pattern '{title_pattern}'",
             "filtered_events": filtered_data
-        })
+        }), zp.last_cache_info)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -586,90 +699,228 @@ def rider_data(rider_id: int):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
-@app.route('/generate_and_post_commentary/<int:club_id>', methods=['POST'])
-def generate_and_post_commentary(club_id):
-    """Generate weekly commentary on team results and post to Discord"""
-    try:
-        print(f"[DEBUG] Starting commentary generation for club ID: {club_id}")
+@app.route('/rider_data/bulk', methods=['POST'])
+def rider_data_bulk():
+    """
+    Fetch ZwiftPower profiles for many riders concurrently.
 
-        session = get_authenticated_session()
-        print("[DEBUG] Authenticated session established")
+    Body (JSON):
+        rider_ids (list): ZwiftPower/Zwift rider ids
+        include_zrs (bool): also scrape the Zwift Racing Score (default: false)
+        max_workers (int): concurrent requests (default: ZWIFTPOWER_PROFILE_WORKERS,
+            at most ZWIFTPOWER_PROFILE_MAX_WORKERS)
+
+    Streams newline-delimited JSON, one line per rider as it completes:
+        {"rider_id": ..., "data": {...}, "zrs": ..., "error": ...}
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        rider_ids = body.get('rider_ids')
+        if not isinstance(rider_ids, list) or not rider_ids:
+            return jsonify({"error": "Body must contain a non-empty 'rider_ids' list"}), 400
 
         zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD)
-        zp.session = session
-        allowed_zwids = _get_verified_member_zwift_ids()
-        results = zp.get_team_results(club_id, allowed_zwids=allowed_zwids)
-        results_summary = zp.analyze_team_results(results)
+        zp.session = get_authenticated_session()
+        profiles = zp.fetch_rider_profiles(
+            rider_ids,
+            include_zrs=bool(body.get('include_zrs', False)),
+            max_workers=min(int(body['max_workers']), PROFILE_MAX_WORKERS) if body.get('max_workers') else None,
+        )
 
-        print("[DEBUG] Team results fetched:", results)
+        def generate():
+            for rider_id, result in profiles:
+                yield json.dumps({"rider_id": rider_id, **result}) + "\n"
 
-        if not results:
-            return jsonify({"error": "No results found"}), 404
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        commentator = ZwiftCommentator(api_key=OPENAI_KEY)
-        commentary = commentator.generate_commentary(results_summary)
+def _generate_and_post_commentary(club_id: int, job=NULL_JOB):
+    """Generate the weekly team commentary and post it; returns (payload, status). The payload carries the ZwiftPower cache info."""
+    print(f"[DEBUG] Starting commentary generation for club ID: {club_id}")
 
-        print("[DEBUG] Commentary generated:\n", commentary)
+    zp = _zwiftpower_client()
+    print("[DEBUG] Authenticated session established")
 
-        response = commentator.send_to_discord_api(
-            channel_id=DISCORD_GOSSIP_ID,
-            message=commentary,
-            api_url=DISCORD_BOT_URL
-        )
+    job.progress(stage="results")
+    allowed_zwids = _get_verified_member_zwift_ids()
+    # Stream rows straight into the analysis so only verified riders' rows are ever decoded
+    with zp.stream_team_results(club_id, allowed_zwids=allowed_zwids, fields=ANALYSIS_FIELDS) as results:
+        print("[DEBUG] ZwiftPower cache:", zp.last_cache_info)
+        results_summary = zp.analyze_team_results({"events": results.events, "data": results})
 
-        print("[DEBUG] Discord response:", response)
+    print(f"[DEBUG] Team results analyzed: {results.rows_kept} of {results.rows_seen} rows")
+
+    if not results.rows_seen:
+        return {"error": "No results found"}, 404
+
+    job.check_cancelled()
+    job.progress(stage="generating")
+    commentator = ZwiftCommentator(api_key=OPENAI_KEY)
+    commentary = commentator.generate_commentary(results_summary)
+
+    generation = commentator.last_generation
+    print("[DEBUG] Commentary generated:", generation, "\n", commentary)
+
+    job.check_cancelled()
+    job.progress(stage="posting", generation=generation)
+    response = commentator.send_to_discord_api(
+        channel_id=DISCORD_GOSSIP_ID,
+        message=commentary,
+        api_url=DISCORD_BOT_URL
+    )
+
+    print("[DEBUG] Discord response:", response)
+
+    if response and response.get("success"):
+        return {"success": True, "message": commentary, "generation": generation, "cache": zp.last_cache_info}, 200
+    else:
+        return {"error": "Failed to send to Discord", "details": response, "generation": generation}, 500
 
-        if response and response.get("success"):
-            return jsonify({"success": True, "message": commentary})
-        else:
-            return jsonify({"error": "Failed to send to Discord", "details": response}), 500
+
+@app.route('/generate_and_post_commentary/<int:club_id>', methods=['POST'])
+def generate_and_post_commentary(club_id):
+    """Generate weekly commentary on team results and post to Discord (?async=1: background job)"""
+    try:
+        if _wants_async():
+            return _start_job("commentary", _generate_and_post_commentary, club_id)
+        payload, status = _generate_and_post_commentary(club_id)
+        cache_info = payload.pop("cache", None)
+        return _with_cache_headers(jsonify(payload), cache_info), status
 
     except Exception as e:
         print("[ERROR] Exception occurred:", e)
         return jsonify({"error": str(e)}), 500
-    
+
+
+def _generate_and_post_upgrades(job=NULL_JOB):
+    """Generate the daily upgrade comment and post it; returns (payload, status)."""
+    print("[DEBUG] Starting upgrade comment generation...")
+
+    today = datetime.now().strftime("%y%m%d")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%y%m%d")
+
+    # Use firebase.compare_rider_categories instead of external API
+    print(f"[DEBUG] Comparing rider categories between {today} and {yesterday}")
+    allowed_zwids = _get_verified_member_zwift_ids()
+    upgrade_data = firebase.compare_rider_categories(today, yesterday, allowed_rider_ids=allowed_zwids)
+
+    # Be defensive: comparison should return a dict, but don't fail cron runs if it doesn't.
+    if not isinstance(upgrade_data, dict):
+        print(f"[WARN] compare_rider_categories returned non-dict: {type(upgrade_data)}")
+        return {"message": "No upgrades today."}, 200
+
+    if (not upgrade_data.get("upgradedZPCategory")
+        and not upgrade_data.get("upgradedZwiftRacingCategory")
+        and not upgrade_data.get("upgradedZRSCategory")):
+        return {"message": "No upgrades today."}, 200
+
+    # Generate upgrade comment
+    job.check_cancelled()
+    job.progress(stage="generating")
+    commentator = ZwiftCommentator(api_key=OPENAI_KEY)
+    comment = commentator.generate_upgrade_comment(upgrade_data)
+    generation = commentator.last_generation
+    print("[DEBUG] Upgrade comment generated:", generation)
+
+    # Post comment to Discord
+    job.check_cancelled()
+    job.progress(stage="posting", generation=generation)
+    discord_response = commentator.send_to_discord_api(
+        channel_id=DISCORD_GOSSIP_ID,
+        message=comment,
+        api_url=DISCORD_BOT_URL
+    )
+
+    if discord_response and discord_response.get("success"):
+        return {"success": True, "message": comment, "generation": generation}, 200
+    else:
+        return {"error": "Failed to send to Discord", "details": discord_response, "generation": generation}, 500
+
+
 @app.route('/generate_and_post_upgrades', methods=['POST'])
 def generate_and_post_upgrades():
-    """Generate commentary on upgrades and post to Discord"""
+    """Generate commentary on upgrades and post to Discord (?async=1: background job)"""
     try:
-        print("[DEBUG] Starting upgrade comment generation...")
-
-        today = datetime.now().strftime("%y%m%d")
-        yesterday = (datetime.now() - timedelta(days=1)).strftime("%y%m%d")
-
-        # Use firebase.compare_rider_categories instead of external API
-        print(f"[DEBUG] Comparing rider categories between {today} and {yesterday}")
-        allowed_zwids = _get_verified_member_zwift_ids()
-        upgrade_data = firebase.compare_rider_categories(today, yesterday, allowed_rider_ids=allowed_zwids)
-
-        # Be defensive: comparison should return a dict, but don't fail cron runs if it doesn't.
-        if not isinstance(upgrade_data, dict):
-            print(f"[WARN] compare_rider_categories returned non-dict: {type(upgrade_data)}")
-            return jsonify({"message": "No upgrades today."}), 200
-
-        if (not upgrade_data.get("upgradedZPCategory")
-            and not upgrade_data.get("upgradedZwiftRacingCategory")
-            and not upgrade_data.get("upgradedZRSCategory")):
-            return jsonify({"message": "No upgrades today."}), 200
-
-        # Generate upgrade comment
-        commentator = ZwiftCommentator(api_key=OPENAI_KEY)
-        comment = commentator.generate_upgrade_comment(upgrade_data)
-
-        # Post comment to Discord
-        discord_response = commentator.send_to_discord_api(
-            channel_id=DISCORD_GOSSIP_ID,
-            message=comment,
-            api_url=DISCORD_BOT_URL
+        if _wants_async():
+            return _start_job("upgrade-commentary", _generate_and_post_upgrades)
+        payload, status = _generate_and_post_upgrades()
+        return jsonify(payload), status
+
+    except Exception as e:
+        print("[ERROR] Exception occurred:", e)
+        return jsonify({"error": str(e)}), 500
+
+def _sync_rider_history(body: dict, job=NULL_JOB):
+    """Ingest new club_stats days into the rider category history; returns (payload, status)."""
+    since = body.get("since")
+    if since is not None:
+        try:
+            since = datetime.strptime(str(since), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            return {"error": "since must be YYYY-MM-DD"}, 400
+    job.progress(stage="ingesting")
+    return {"status": "success", **rider_history.sync(since=since)}, 200
+
+
+@app.route('/api/rider_categories/sync', methods=['POST'])
+def sync_rider_categories():
+    """
+    Ingest club_stats days that are not in the rider category history yet (cron).
+
+    {"since": "YYYY-MM-DD"} also backfills older days. With ?async=1 it runs
+    as a background job (202 + job id, see /api/jobs/<id>).
+    """
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        body = request.get_json(silent=True) or {}
+        if _wants_async():
+            return _start_job("rider-history-sync", _sync_rider_history, body)
+        payload, status = _sync_rider_history(body)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/rider_categories/upgrades', methods=['GET'])
+def rider_category_upgrades():
+    """Rider upgrades between two days (?from=YYYY-MM-DD&to=YYYY-MM-DD, or ?days=7 up to today)"""
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        end_id = request.args.get('to') or datetime.now().strftime('%Y-%m-%d')
+        start_id = request.args.get('from')
+        if not start_id:
+            days = request.args.get('days', default=7, type=int)
+            start_id = (datetime.strptime(end_id, '%Y-%m-%d') - timedelta(days=days)).strftime('%Y-%m-%d')
+        rider_history.sync()
+        dates = rider_history.ingested_dates()
+        # Snap to the nearest ingested days inside the window
+        start_ids = [d for d in dates if d >= start_id]
+        end_ids = [d for d in dates if d <= end_id]
+        if not start_ids or not end_ids or start_ids[0] >= end_ids[-1]:
+            return jsonify({"error": "No category history for this window", "from": start_id, "to": end_id}), 404
+        verified_only = request.args.get('verified', '1') != '0'
+        upgrades = rider_history.upgrades_between(
+            start_ids[0], end_ids[-1],
+            _get_verified_member_zwift_ids() if verified_only else None
         )
+        return jsonify({"from": start_ids[0], "to": end_ids[-1], **upgrades})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        if discord_response and discord_response.get("success"):
-            return jsonify({"success": True, "message": comment})
-        else:
-            return jsonify({"error": "Failed to send to Discord", "details": discord_response}), 500
 
+@app.route('/api/rider_categories/<rider_id>/timeline', methods=['GET'])
+def rider_category_timeline(rider_id):
+    """Category changes (ZP, vELO, ZRS) of one rider over time"""
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        return jsonify(rider_history.timeline(rider_id))
     except Exception as e:
-        print("[ERROR] Exception occurred:", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/users', methods=['GET'])
@@ -702,16 +953,22 @@ def get_discord_members():
         # Get parameters
         member_type = request.args.get('type', default='all')
         include_roles = request.args.get('include_roles', default='true').lower() == 'true'
+        # roles=table: members keep only role_ids and the role table is sent once (JSON only)
+        role_format = request.args.get('roles', default='inline').lower()
+        if role_format not in ('inline', 'table'):
+            raise ValueError("roles must be 'inline' or 'table'")
+        ship_role_table = include_roles and role_format == 'table' and not is_html_request
+        inline_roles = include_roles and not ship_role_table
         
         if member_type == 'linked':
             # Only get members with ZwiftIDs
-            members = discord_api.find_linked_members(include_role_names=include_roles)
+            members = discord_api.find_linked_members(include_role_names=inline_roles)
         elif member_type == 'unlinked':
             # Only get members without ZwiftIDs
-            members = discord_api.find_unlinked_members(include_role_names=include_roles)
+            members = discord_api.find_unlinked_members(include_role_names=inline_roles)
         else:
             # Get all members with ZwiftIDs merged
-            members = discord_api.merge_with_zwift_ids(include_role_names=include_roles)
+            members = discord_api.merge_with_zwift_ids(include_role_names=inline_roles)
 
         # Compute "member role" flag using role ID (robust vs role name changes)
         # Requirement: only check the Community Member role id (1195878123795910736 by default).
@@ -751,31 +1008,9 @@ def get_discord_members():
             
         # For HTML requests, render the template with data
         if is_html_request:
-            # Get Zwift riders from club_riders collection
-            club_riders_data = firebase.get_latest_document('club_stats')
-            zwift_riders = []
-            
-            if club_riders_data and len(club_riders_data) > 0:
-                # The data comes back as a list with one item, get the first item
-                riders = club_riders_data[0]['data'].get('riders', [])
-                
-                # Debug the structure
-                print(f"Found {len(riders)} riders in club_riders data")
-                if riders:
-                    print(f"Sample rider data: {riders[0].keys()}")
-                    print(f"Sample rider name: {riders[0].get('name', 'NO_NAME')}")
-                    print(f"Sample rider ID: {riders[0].get('riderId', 'NO_ID')}")
-                
-                zwift_riders = [
-                    {"name": rider.get('name', ''), "riderId": str(rider.get('riderId', ''))}
-                    for rider in riders
-                    if 'name' in rider and 'riderId' in rider
-                ]
-                
-                # Sort riders by name for easier selection
-                zwift_riders.sort(key=lambda x: x["name"])
-                
-                # Debug the processed riders
+            # Rider picker from the cached latest club_stats (sorted by name)
+            zwift_riders = latest_club_stats.get().dropdown
+            if zwift_riders:
                 print(f"Processed {len(zwift_riders)} riders for dropdown")
             else:
                 print("No club_riders data found or data is empty")
@@ -798,12 +1033,16 @@ def get_discord_members():
             )
         
         # For API requests, return JSON
-        return jsonify({
+        payload = {
             "members": members,
             "count": len(members),
             "type": member_type,
-            "include_roles": include_roles
-        })
+            "include_roles": include_roles,
+            "snapshot": discord_api.get_member_snapshot().info()
+        }
+        if ship_role_table:
+            payload["roleTable"] = discord_api.get_role_table().roles
+        return jsonify(payload)
     except ValueError as e:
         if is_html_request:
             return f"<h1>Error</h1><p>{str(e)}</p>", 400
@@ -912,6 +1151,7 @@ def assign_zwift_id():
         
         # Update the Discord user with the ZwiftID
         result = firebase.update_discord_zwift_link(discord_id, zwift_id, username)
+        identity_index.note_link(discord_id, zwift_id)
         
         return jsonify({
             "status": "success", 
@@ -924,6 +1164,119 @@ def assign_zwift_id():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+def _reconcile_verified_member_role(data: dict, job=NULL_JOB):
+    """Plan and apply Verified Member role changes; returns (payload, status). See reconcile_verified_member_role."""
+    require_zwift = bool(data.get("requireZwiftId", True))
+    require_companion = bool(data.get("requireCompanion", False))
+    require_zwiftpower = bool(data.get("requireZwiftPower", False))
+    dry_run = bool(data.get("dryRun", False))
+
+    role_id = str(VERIFIED_MEMBER_ROLE_ID or "").strip()
+    if not role_id:
+        return {"error": "VERIFIED_MEMBER_ROLE_ID not configured"}, 400
+
+    guild_id = os.environ.get("DISCORD_GUILD_ID")
+    bot_token = os.environ.get("DISCORD_BOT_TOKEN")
+    if not guild_id or not bot_token:
+        return {"error": "Discord env not configured (DISCORD_GUILD_ID/DISCORD_BOT_TOKEN)"}, 500
+
+    # discordId -> zwiftId lookup from the shared users index
+    try:
+        discord_to_zwift = identity_index.discord_to_zwift()
+    except Exception as e:
+        return {"error": f"Failed to load users from Firebase: {str(e)}"}, 500
+
+    # Optional roster sets (loaded only if requested)
+    companion_ids = set()
+    zwiftpower_ids = set()
+    if require_companion:
+        try:
+            companion_ids = set([doc.id for doc in firebase.db.collection("companion_club_members").stream()])
+        except Exception as comp_err:
+            return {"error": f"Failed to load companion roster: {str(comp_err)}"}, 500
+    if require_zwiftpower:
+        try:
+            zwiftpower_ids = set([doc.id for doc in firebase.db.collection("zwiftpower_club_members").stream()])
+        except Exception as zp_err:
+            return {"error": f"Failed to load ZwiftPower roster: {str(zp_err)}"}, 500
+
+    # Fetch all Discord members; refetch so decisions use current roles
+    job.progress(stage="members")
+    discord_api = DiscordAPI(DISCORD_BOT_TOKEN, DISCORD_GUILD_ID)
+    members = discord_api.get_all_members(limit=100000, include_role_names=False, force_refresh=True) or []
+
+    result = {
+        "dry_run": dry_run,
+        "role_id": role_id,
+        "require_zwift_id": require_zwift,
+        "require_companion": require_companion,
+        "require_zwiftpower": require_zwiftpower,
+        "total_members": len(members),
+        "eligible": 0,
+        "ineligible": 0,
+        "planned": 0,
+        "added": 0,
+        "removed": 0,
+        "unchanged": 0,
+        "errors": 0,
+    }
+
+    # Plan: only members whose role differs from their eligibility need a Discord call
+    changes = []
+    for m in members:
+        discord_id = str(m.get("discordID") or "").strip()
+        if not discord_id:
+            continue
+        role_ids = [str(r) for r in (m.get("role_ids") or [])]
+        has_verified = role_id in role_ids
+
+        zwift_id = discord_to_zwift.get(discord_id)
+        has_zwift = zwift_id is not None and str(zwift_id).strip() != ""
+        zwift_id_str = str(zwift_id).strip() if has_zwift else ""
+
+        eligible = True
+        if require_zwift and not has_zwift:
+            eligible = False
+        if eligible and require_companion and zwift_id_str not in companion_ids:
+            eligible = False
+        if eligible and require_zwiftpower and zwift_id_str not in zwiftpower_ids:
+            eligible = False
+
+        if eligible:
+            result["eligible"] += 1
+        else:
+            result["ineligible"] += 1
+
+        if eligible and not has_verified:
+            changes.append(RoleChange(discord_id, role_id, "add"))
+        elif (not eligible) and has_verified:
+            changes.append(RoleChange(discord_id, role_id, "remove"))
+        else:
+            result["unchanged"] += 1
+
+    result["planned"] = len(changes)
+    job.progress(done=0, total=len(changes), stage="roles")
+
+    # Execute
+    if dry_run:
+        result["added"] = sum(1 for c in changes if c.action == "add")
+        result["removed"] = len(changes) - result["added"]
+    elif changes:
+        run = RoleMutationPipeline(
+            bot_token, guild_id, reason="Verified member reconcile",
+            on_progress=_role_progress_reporter(job), should_stop=lambda: job.cancelled,
+        ).run(changes)
+        result["added"] = run["added"]
+        result["removed"] = run["removed"]
+        result["errors"] = run["failed"]
+        result["pipeline"] = run
+
+    if not dry_run and (result["added"] or result["removed"]):
+        member_snapshots.invalidate(guild_id)
+
+    return result, 200
+
+
 @app.route('/api/discord/reconcile-verified-role', methods=['POST'])
 @login_required
 def reconcile_verified_member_role():
@@ -942,142 +1295,108 @@ def reconcile_verified_member_role():
         "requireZwiftPower": false,
         "dryRun": false
       }
+
+    With ?async=1 the reconcile runs as a background job (202 + job id, see /api/jobs/<id>).
     """
     try:
         data = request.get_json(silent=True) or {}
-        require_zwift = bool(data.get("requireZwiftId", True))
-        require_companion = bool(data.get("requireCompanion", False))
-        require_zwiftpower = bool(data.get("requireZwiftPower", False))
-        dry_run = bool(data.get("dryRun", False))
+        if _wants_async():
+            return _start_job("reconcile-verified-role", _reconcile_verified_member_role, data)
+        payload, status = _reconcile_verified_member_role(data)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        role_id = str(VERIFIED_MEMBER_ROLE_ID or "").strip()
-        if not role_id:
-            return jsonify({"error": "VERIFIED_MEMBER_ROLE_ID not configured"}), 400
 
-        guild_id = os.environ.get("DISCORD_GUILD_ID")
-        bot_token = os.environ.get("DISCORD_BOT_TOKEN")
-        if not guild_id or not bot_token:
-            return jsonify({"error": "Discord env not configured (DISCORD_GUILD_ID/DISCORD_BOT_TOKEN)"}), 500
+def _send_member_outreach(data: dict, job=NULL_JOB):
+    """DM each member and record the reminder; returns (payload, status). See send_member_outreach."""
+    members = data.get("members") or []
+    message_template = data.get("messageTemplate") or ""
 
-        # Build discordId -> zwiftId lookup from Firebase users
-        discord_to_zwift = {}
-        try:
-            users = firebase.get_collection("users", limit=100000) or []
-            for u in users:
-                try:
-                    did = u.get("discordId")
-                    zid = u.get("zwiftId")
-                    if did is None:
-                        continue
-                    did_s = str(did).strip()
-                    if not did_s:
-                        continue
-                    # Store zid even if None; we'll validate per requirements later
-                    discord_to_zwift[did_s] = zid
-                except Exception:
-                    continue
-        except Exception as e:
-            return jsonify({"error": f"Failed to load users from Firebase: {str(e)}"}), 500
+    if not members:
+        return {"status": "error", "message": "No members provided"}, 400
 
-        # Optional roster sets (loaded only if requested)
-        companion_ids = set()
-        zwiftpower_ids = set()
-        if require_companion:
-            try:
-                companion_ids = set([doc.id for doc in firebase.db.collection("companion_club_members").stream()])
-            except Exception as comp_err:
-                return jsonify({"error": f"Failed to load companion roster: {str(comp_err)}"}), 500
-        if require_zwiftpower:
-            try:
-                zwiftpower_ids = set([doc.id for doc in firebase.db.collection("zwiftpower_club_members").stream()])
-            except Exception as zp_err:
-                return jsonify({"error": f"Failed to load ZwiftPower roster: {str(zp_err)}"}), 500
+    if not message_template.strip():
+        return {"status": "error", "message": "Message template is empty"}, 400
 
-        # Fetch all Discord members (use high limit to avoid truncation)
-        discord_api = DiscordAPI(DISCORD_BOT_TOKEN, DISCORD_GUILD_ID)
-        members = discord_api.get_all_members(limit=100000, include_role_names=False) or []
+    from datetime import datetime
 
-        headers = {"Authorization": f"Bot {bot_token}"}
-
-        result = {
-            "dry_run": dry_run,
-            "role_id": role_id,
-            "require_zwift_id": require_zwift,
-            "require_companion": require_companion,
-            "require_zwiftpower": require_zwiftpower,
-            "total_members": len(members),
-            "eligible": 0,
-            "ineligible": 0,
-            "added": 0,
-            "removed": 0,
-            "unchanged": 0,
-            "errors": 0,
-        }
+    # Preload existing reminder docs to avoid per-user queries
+    existing_docs = firebase.get_collection(
+        "discord_zwift_reminders", limit=10000, include_id=True
+    )
+    existing_lookup = {doc.get("id"): doc for doc in existing_docs}
+
+    results = []
+    messages = []
+    for item in members:
+        discord_id = (item or {}).get("discord_id")
+        username = (item or {}).get("username") or ""
+        if not discord_id:
+            results.append({"discordId": None, "status": "skipped", "error": "missing discord_id"})
+            continue
+        # Personalize message
+        messages.append((str(discord_id), message_template.replace("{{username}}", username)))
+
+    counts = Counter(r["status"] for r in results)
+    job.progress(done=len(results), total=len(members), stage="sending", sent=0, skipped=len(results))
+
+    def _on_result(outcome):
+        results.append(outcome)
+        counts[outcome["status"]] += 1
+        # Counts only: the per-recipient results go into the final payload
+        job.progress(
+            done=len(results),
+            sent=counts["sent"],
+            skipped=len(results) - counts["sent"],
+        )
 
-        for m in members:
-            discord_id = str(m.get("discordID") or "").strip()
-            if not discord_id:
-                continue
-            role_ids = [str(r) for r in (m.get("role_ids") or [])]
-            has_verified = role_id in role_ids
-
-            zwift_id = discord_to_zwift.get(discord_id)
-            has_zwift = zwift_id is not None and str(zwift_id).strip() != ""
-            zwift_id_str = str(zwift_id).strip() if has_zwift else ""
-
-            eligible = True
-            if require_zwift and not has_zwift:
-                eligible = False
-            if eligible and require_companion and zwift_id_str not in companion_ids:
-                eligible = False
-            if eligible and require_zwiftpower and zwift_id_str not in zwiftpower_ids:
-                eligible = False
-
-            if eligible:
-                result["eligible"] += 1
-            else:
-                result["ineligible"] += 1
+    sender = BulkDMSender(
+        DISCORD_BOT_TOKEN,
+        on_result=_on_result,
+        should_stop=lambda: job.cancelled,
+    )
+    outcomes = sender.send(messages) if messages else []
+
+    # One batched write for all reminder docs, also when the run was cancelled part-way
+    contents = dict(messages)
+    reminders = firebase.db.collection("discord_zwift_reminders")
+    ops = []
+    updated_entries = []
+    now = datetime.utcnow()
+    for outcome in outcomes:
+        if outcome["status"] != "sent":
+            continue
+        discord_id = outcome["discordId"]
+        existing = existing_lookup.get(discord_id) or {}
+        new_count = int(existing.get("reminderCount", 0) or 0) + 1
+        doc_data = {
+            "discordID": discord_id,
+            "lastReminderAt": now,
+            "reminderCount": new_count,
+            "lastReminderMessage": contents[discord_id],
+        }
+        existing_lookup[discord_id] = doc_data
+        ops.append(set_op(reminders.document(discord_id), doc_data))
+        updated_entries.append(
+            {"discord_id": discord_id, "reminder_count": new_count}
+        )
+    write_stats = BulkWriter(firebase.db, name="outreach reminders").write(ops) if ops else None
 
-            # Only call Discord when a change is needed
-            if eligible and not has_verified:
-                if dry_run:
-                    result["added"] += 1
-                else:
-                    try:
-                        r = requests.put(
-                            f"https://discord.com/api/v10/guilds/{guild_id}/members/{discord_id}/roles/{role_id}",
-                            headers=headers,
-                        )
-                        if 200 <= r.status_code < 300:
-                            result["added"] += 1
-                        else:
-                            # 403/404 treated as non-fatal (missing perms / user not found)
-                            if r.status_code not in (403, 404):
-                                result["errors"] += 1
-                    except Exception:
-                        result["errors"] += 1
-            elif (not eligible) and has_verified:
-                if dry_run:
-                    result["removed"] += 1
-                else:
-                    try:
-                        r = requests.delete(
-                            f"https://discord.com/api/v10/guilds/{guild_id}/members/{discord_id}/roles/{role_id}",
-                            headers=headers,
-                        )
-                        # 204 expected; 404 ok (already absent)
-                        if r.status_code in (200, 202, 204, 404):
-                            result["removed"] += 1
-                        else:
-                            result["errors"] += 1
-                    except Exception:
-                        result["errors"] += 1
-            else:
-                result["unchanged"] += 1
+    sent = sum(1 for r in results if r["status"] == "sent")
+    job.progress(done=len(results), sent=sent, skipped=len(results) - sent, force=True)
 
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    payload = {
+        "status": "success",
+        "sent": sent,
+        "skipped": len(results) - sent,
+        "updated": updated_entries,
+        "results": results,
+        "stats": {"dm": sender.stats, "reminders": write_stats},
+    }
+    if job.cancelled:
+        raise JobCancelled(f"Job {job.job_id} cancelled", result=payload)
+    return payload, 200
 
 
 @app.route('/api/member_outreach/send', methods=['POST'])
@@ -1091,75 +1410,15 @@ def send_member_outreach():
       "members": [{ "discord_id": "...", "username": "..." }, ...],
       "messageTemplate": "Hej {{username}} ..."
     }
+
+    With ?async=1 the messages are sent by a background job (202 + job id, see /api/jobs/<id>).
     """
     try:
         data = request.get_json(silent=True) or {}
-        members = data.get("members") or []
-        message_template = data.get("messageTemplate") or ""
-
-        if not members:
-            return jsonify({"status": "error", "message": "No members provided"}), 400
-
-        if not message_template.strip():
-            return jsonify({"status": "error", "message": "Message template is empty"}), 400
-
-        discord_api = DiscordAPI(DISCORD_BOT_TOKEN, DISCORD_GUILD_ID)
-
-        sent = 0
-        skipped = 0
-        updated_entries = []
-
-        from datetime import datetime
-
-        # Preload existing reminder docs to avoid per-user queries
-        existing_docs = firebase.get_collection(
-            "discord_zwift_reminders", limit=10000, include_id=True
-        )
-        existing_lookup = {doc.get("id"): doc for doc in existing_docs}
-
-        for item in members:
-            discord_id = (item or {}).get("discord_id")
-            username = (item or {}).get("username") or ""
-            if not discord_id:
-                skipped += 1
-                continue
-
-            # Personalize message
-            msg = message_template.replace("{{username}}", username)
-
-            ok = discord_api.send_direct_message(discord_id, msg)
-            if not ok:
-                skipped += 1
-                continue
-
-            sent += 1
-
-            # Update Firestore reminder doc
-            existing = existing_lookup.get(discord_id) or {}
-            new_count = int(existing.get("reminderCount", 0) or 0) + 1
-            doc_data = {
-                "discordID": discord_id,
-                "lastReminderAt": datetime.utcnow(),
-                "reminderCount": new_count,
-                "lastReminderMessage": msg,
-            }
-            firebase.set_document(
-                "discord_zwift_reminders", discord_id, doc_data, merge=False
-            )
-            existing_lookup[discord_id] = doc_data
-
-            updated_entries.append(
-                {"discord_id": discord_id, "reminder_count": new_count}
-            )
-
-        return jsonify(
-            {
-                "status": "success",
-                "sent": sent,
-                "skipped": skipped,
-                "updated": updated_entries,
-            }
-        )
+        if _wants_async():
+            return _start_job("member-outreach-send", _send_member_outreach, data)
+        payload, status = _send_member_outreach(data)
+        return jsonify(payload), status
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -1169,267 +1428,192 @@ def initialize_rider_queue():
     """Initialize a queue of riders that need racing scores"""
     try:
         # Get the latest club_stats
-        club_stats = firebase.get_latest_document("club_stats")
+        snapshot = latest_club_stats.get()
+        riders = snapshot.riders
         
-        if not club_stats or len(club_stats) == 0:
+        if snapshot.date_id is None:
             return jsonify({"status": "error", "message": "No club_stats data found"}), 404
-            
-        # Get list of riders
-        stats = club_stats[0]
-        riders = stats["data"]["riders"]
-        
-        # Create or update the single queue document
-        queue_doc_ref = firebase.db.collection("rider_queues").document("current")
-        
-        # Create lists for each status
-        pending_riders = []
         
-        # Add riders without racing scores to pending list
-        for rider in riders:
-            if "riderId" not in rider:
-                continue
-                
-            # Only queue riders without racing scores
-            if "racingScore" not in rider:
-                rider_id = rider["riderId"]
-                rider_name = rider.get("name", "Unknown")
-                
-                # Add to pending list
-                pending_riders.append({
-                    "riderId": rider_id,
-                    "name": rider_name,
-                    "addedAt": datetime.now()
-                })
-        
-        # Create the queue document
-        queue_doc_ref.set({
-            "created": datetime.now(),
-            "pendingRiders": pending_riders,
-            "completedRiders": [],
-            "failedRiders": [],
-            "stats": {
-                "total": len(pending_riders),
-                "pending": len(pending_riders),
-                "completed": 0,
-                "failed": 0
-            }
-        })
+        # Only queue riders without racing scores
+        queued = rider_queue.initialize(
+            (rider for rider in riders if "riderId" in rider and "racingScore" not in rider),
+            date_id=snapshot.date_id,
+        )
         
         return jsonify({
             "status": "success",
-            "message": f"Initialized queue with {len(pending_riders)} riders",
+            "message": f"Initialized queue with {queued} riders",
             "total_riders": len(riders),
-            "queued_riders": len(pending_riders)
+            "queued_riders": queued
         })
         
     except Exception as e:
         print(f"Error initializing rider queue: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _process_rider_queue(body: dict, job=NULL_JOB):
+    """
+    Fetch racing scores for the pending riders of the queue; once none are
+    pending, write the scores to club_stats. Returns (payload, status).
+    """
+    if not rider_queue.exists():
+        return {
+            "status": "success",
+            "message": "No queue exists. Call initialize_rider_queue first.",
+            "queue_empty": True,
+            "queue_exists": False
+        }, 200
+
+    counts = rider_queue.counts()
+    run = None
+    if counts["pending"]:
+        # batch_size (old per-call batch) caps the riders handled by this call
+        limit = body.get("limit", body.get("batch_size"))
+        limit = int(limit) if limit else None
+        done = {"n": 0}
+
+        def _on_result(outcome):
+            done["n"] += 1
+            job.progress(done=done["n"], total=limit or counts["pending"], stage="fetching", last=outcome)
+
+        worker = RiderEnrichmentWorker(
+            get_authenticated_zwift_api(),
+            rider_queue,
+            max_workers=int(body.get("workers") or ZWIFT_PROFILE_WORKERS),
+            rps=float(body["rps"]) if body.get("rps") else None,
+            on_result=_on_result,
+            should_stop=lambda: job.cancelled,
+        )
+        job.progress(done=0, total=limit or counts["pending"], stage="fetching")
+        try:
+            run = worker.run(limit=limit)
+        except QueueBusy as e:
+            return {"status": "error", "message": str(e)}, 409
+        counts = rider_queue.counts()
+
+    if not counts["pending"] and counts["completed"] and body.get("apply", True):
+        job.progress(stage="updating club_stats")
+        payload, status = _apply_rider_queue(body.get("clear_queue", True))
+        if run is not None:
+            payload["run"] = run
+        return payload, status
+
+    message = (f"Processed {run['processed']} riders, {run['completed']} successful"
+               if run else "No riders in queue to process")
+    return {
+        "status": "success",
+        "message": message,
+        "stats": {**counts, **({"run": run} if run else {})},
+        "queue_empty": counts["pending"] == 0
+    }, 200
+
+
 @app.route('/api/process_rider_queue', methods=['POST'])
 def process_rider_queue():
-    """Process a batch of riders from the rider queue"""
+    """
+    Fetch racing scores for the queued riders (concurrently, rate limited,
+    checkpointed per rider) and update club_stats when the queue is done.
+
+    Body: {"limit": n, "workers": n, "rps": x, "apply": true, "clear_queue": true}.
+    Without a limit the whole queue is worked in one call; with ?async=1 it
+    runs as a background job (202 + job id, see /api/jobs/<id>).
+    """
     try:
-        # Get parameters
-        batch_size = request.json.get('batch_size', 3) if request.json else 3
-        
-        # Get the queue document
-        queue_doc_ref = firebase.db.collection("rider_queues").document("current")
-        queue_doc = queue_doc_ref.get()
-        
-        if not queue_doc.exists:
-            return jsonify({
-                "status": "success",
-                "message": "No queue exists. Call initialize_rider_queue first.",
-                "queue_empty": True,
-                "queue_exists": False
-            })
-        
-        queue_data = queue_doc.to_dict()
-        pending_riders = queue_data.get("pendingRiders", [])
-        completed_riders = queue_data.get("completedRiders", [])
-        failed_riders = queue_data.get("failedRiders", [])
-        
-        # Check if there are any pending riders
-        if not pending_riders:
-            # No more pending riders, check if we should update club_stats
-            if completed_riders:
-                # Update the main club_stats with all processed scores
-                return update_club_stats_from_queue()
-            else:
-                return jsonify({
-                    "status": "success",
-                    "message": "No riders in queue to process"
-                })
-        
-        # Determine batch to process (up to batch_size riders)
-        batch_to_process = pending_riders[:batch_size]
-        remaining_pending = pending_riders[batch_size:]
-        
-        # Get cached ZwiftAPI instance
-        zwift_api = get_authenticated_zwift_api()
-        
-        processed_count = 0
-        success_count = 0
-        
-        # Process each rider
-        for rider in batch_to_process:
-            rider_id = rider.get("riderId")
-            rider_name = rider.get("name", "Unknown")
-            
-            if not rider_id:
-                continue
-                
-            processed_count += 1
-            print(f"Processing rider {rider_name} (ID: {rider_id})")
-            
-            try:
-                # Get the rider's profile
-                profile = zwift_api.get_profile(rider_id)
-                
-                # Add racing score if available
-                if profile and "competitionMetrics" in profile and "racingScore" in profile["competitionMetrics"]:
-                    racing_score = profile["competitionMetrics"]["racingScore"]
-                    
-                    # Add to completed list
-                    rider["processedAt"] = datetime.now()
-                    rider["racingScore"] = racing_score
-                    completed_riders.append(rider)
-                    
-                    success_count += 1
-                    print(f"Added racing score {racing_score} to rider {rider_name}")
-                else:
-                    # Add to failed list
-                    rider["processedAt"] = datetime.now()
-                    rider["error"] = "Racing score not found in profile"
-                    failed_riders.append(rider)
-                    
-                    print(f"Could not find racing score for rider {rider_name}")
-            except Exception as rider_error:
-                # Add to failed list with error
-                rider["processedAt"] = datetime.now()
-                rider["error"] = str(rider_error)
-                failed_riders.append(rider)
-                
-                print(f"Error processing rider {rider_name}: {str(rider_error)}")
-            
-            # Add delay between riders
-            time.sleep(5)
-        
-        # Update the queue document with new lists
-        queue_doc_ref.update({
-            "pendingRiders": remaining_pending,
-            "completedRiders": completed_riders,
-            "failedRiders": failed_riders,
-            "stats": {
-                "total": len(remaining_pending) + len(completed_riders) + len(failed_riders),
-                "pending": len(remaining_pending),
-                "completed": len(completed_riders),
-                "failed": len(failed_riders)
-            }
-        })
-        
-        return jsonify({
-            "status": "success",
-            "message": f"Processed {processed_count} riders, {success_count} successful",
-            "stats": {
-                "processed_this_batch": processed_count,
-                "successful_this_batch": success_count,
-                "pending": len(remaining_pending),
-                "completed": len(completed_riders),
-                "failed": len(failed_riders)
-            },
-            "queue_empty": len(remaining_pending) == 0
-        })
+        body = request.get_json(silent=True) or {}
+        if _wants_async():
+            return _start_job("rider-queue", _process_rider_queue, body)
+        payload, status = _process_rider_queue(body)
+        return jsonify(payload), status
         
     except Exception as e:
         print(f"Error processing rider queue: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-def update_club_stats_from_queue():
-    """Update club_stats with all processed racing scores from the queue"""
-    try:
-        # Get the latest club_stats
-        club_stats_docs = firebase.get_latest_document("club_stats")
-        
-        if not club_stats_docs or len(club_stats_docs) == 0:
-            return jsonify({"status": "error", "message": "No club_stats data found"}), 404
-        
-        # Get the queue document
-        queue_doc_ref = firebase.db.collection("rider_queues").document("current")
-        queue_doc = queue_doc_ref.get()
-        
-        if not queue_doc.exists:
-            return jsonify({
-                "status": "error",
-                "message": "Queue not found"
-            }), 404
-            
-        queue_data = queue_doc.to_dict()
-        completed_riders = queue_data.get("completedRiders", [])
-        
-        if not completed_riders:
-            return jsonify({
-                "status": "success",
-                "message": "No completed riders in queue to update club_stats with"
-            })
-        
-        # Create a mapping of rider IDs to racing scores
-        completed_dict = {str(rider["riderId"]): rider["racingScore"] for rider in completed_riders}
-        
-        # Get the original document
-        stats = club_stats_docs[0]
-        
-        # Get the document ID of the latest club_stats
-        # This assumes get_latest_document returns documents ordered by timestamp
-        # and includes document IDs in the result
-        latest_doc_ref = None
-        latest_stats = None
-        
-        # Get the actual document reference to update
-        club_stats_query = firebase.db.collection("club_stats").order_by("timestamp", direction=firebase.firestore.Query.DESCENDING).limit(1)
-        latest_docs = list(club_stats_query.stream())
-        if latest_docs:
-            latest_doc_ref = latest_docs[0].reference
-            latest_stats = latest_docs[0].to_dict()
-        else:
-            return jsonify({"status": "error", "message": "Could not find club_stats document to update"}), 500
-        
-        # Update the stats object with racing scores
-        updated_count = 0
-        
-        for rider in stats["data"]["riders"]:
-            if "riderId" not in rider:
-                continue
-                
-            rider_id_str = str(rider["riderId"])
-            if rider_id_str in completed_dict:
-                rider["racingScore"] = completed_dict[rider_id_str]
-                updated_count += 1
-        
-        # Update the existing document with the new data
-        update_data = {
-            "data": stats["data"]
-            # Keep other fields as they are
-        }
-        
-        # Update the document
-        latest_doc_ref.update(update_data)
-        
-        # Clear the queue if requested
-        should_clear_queue = request.json.get('clear_queue', True) if request.json else True
-        if should_clear_queue:
-            queue_doc_ref.delete()
-        
-        return jsonify({
+def _apply_rider_queue(clear_queue: bool = True):
+    """Write the racing scores of the completed queue riders to the club_stats day they were queued from; returns (payload, status)."""
+    if not rider_queue.exists():
+        return {
+            "status": "error",
+            "message": "Queue not found"
+        }, 404
+    
+    # The day the queue was built from; queues from before it was recorded use the latest day
+    date_id = rider_queue.summary().get("clubStatsDate")
+    if not date_id:
+        latest = club_stats_store.latest_header()
+        if latest is None:
+            return {"status": "error", "message": "No club_stats data found"}, 404
+        date_id = latest[0]
+        
+    completed_riders = rider_queue.items("completed")
+    
+    if not completed_riders:
+        return {
             "status": "success",
-            "message": f"Updated club_stats with {updated_count} racing scores from queue",
-            "queue_cleared": should_clear_queue
-        })
-        
+            "message": "No completed riders in queue to update club_stats with"
+        }, 200
+    
+    # Create a mapping of rider IDs to racing scores
+    completed_dict = {str(rider["riderId"]): rider["racingScore"] for rider in completed_riders}
+    
+    # Rewrite only the rider shards holding the scored riders
+    updated_count = club_stats_store.patch_riders(
+        date_id, {rider_id: {"racingScore": score} for rider_id, score in completed_dict.items()}
+    )
+    latest_club_stats.invalidate()
+
+    # Keep the rider category history in step with the patched racing scores
+    try:
+        rider_history.ingest(date_id, club_stats_store.riders(date_id, fields=RIDER_FIELDS) or [],
+                             version=day_version(club_stats_store.header(date_id)))
+    except Exception as e:
+        print(f"[WARN] Could not update rider category history: {e}")
+    
+    if clear_queue:
+        rider_queue.clear()
+    
+    return {
+        "status": "success",
+        "message": f"Updated club_stats with {updated_count} racing scores from queue",
+        "queue_cleared": clear_queue
+    }, 200
+
+def _shard_club_stats(body: dict, job=NULL_JOB):
+    """Move unsharded club_stats days to the sharded layout; returns (payload, status)."""
+    dates = body.get("dates")
+    if dates is not None and not isinstance(dates, list):
+        return {"error": "dates must be a list of YYYY-MM-DD"}, 400
+    dates = [str(d) for d in dates] if dates else club_stats_store.day_ids()
+    sharded = []
+    for i, date_id in enumerate(dates):
+        job.check_cancelled()
+        job.progress(done=i, total=len(dates), stage="sharding")
+        result = club_stats_store.shard(date_id)
+        if result:
+            sharded.append(result)
+    return {"status": "success", "checked": len(dates), "sharded": sharded}, 200
+
+
+@app.route('/api/club_stats/shard', methods=['POST'])
+def shard_club_stats():
+    """
+    Move club_stats days stored as one document into rider shards.
+
+    This removes data.riders from the day documents, so only run it once
+    every reader and writer of club_stats goes through ClubStatsStore.
+    {"dates": ["YYYY-MM-DD", ...]} limits it to those days (default: all).
+    With ?async=1 it runs as a background job (202 + job id, see /api/jobs/<id>).
+    """
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        body = request.get_json(silent=True) or {}
+        if _wants_async():
+            return _start_job("club-stats-shard", _shard_club_stats, body)
+        payload, status = _shard_club_stats(body)
+        return jsonify(payload), status
     except Exception as e:
-        print(f"Error updating club_stats from queue: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return jsonify({"error": str(e)}), 500
     
 @app.route('/content/messages', methods=['GET'])
 @login_required
@@ -2277,22 +2461,11 @@ def membership_payments_list():
         status_filter = request.args.get('status', '').strip().lower()
         docs = firebase.get_collection('payments', limit=limit, include_id=True) or []
 
-        # Build discordId -> zwiftId / email (doc id is Discord id when discordId field absent)
-        discord_to_zwift: dict[str, str] = {}
-        discord_to_email: dict[str, str] = {}
+        # discordId -> zwiftId / email from the shared users index
+        # (doc id is Discord id when discordId field absent)
         try:
-            users = firebase.get_collection('users', limit=100000, include_id=True) or []
-            for u in users:
-                if not isinstance(u, dict):
-                    continue
-                doc_id = str(u.get('id') or '').strip()
-                did = str(u.get('discordId') or '').strip() or doc_id
-                zid = str(u.get('zwiftId') or '').strip()
-                if did and zid:
-                    discord_to_zwift[did] = zid
-                em = str(u.get('email') or '').strip()
-                if did and em:
-                    discord_to_email[did] = em
+            discord_to_zwift = identity_index.discord_to_zwift()
+            discord_to_email = identity_index.discord_to_email()
         except Exception:
             discord_to_zwift = {}
             discord_to_email = {}
@@ -2358,22 +2531,11 @@ def membership_payments_csv():
         # Large limit to include all
         payments = firebase.get_collection('payments', limit=100000, include_id=True) or []
 
-        # Build discordId -> zwiftId / email for CSV export
-        discord_to_zwift: dict[str, str] = {}
-        discord_to_email: dict[str, str] = {}
+        # discordId -> zwiftId / email from the shared users index
+        # (doc id is Discord id when discordId field absent)
         try:
-            users = firebase.get_collection('users', limit=100000, include_id=True) or []
-            for u in users:
-                if not isinstance(u, dict):
-                    continue
-                doc_id = str(u.get('id') or '').strip()
-                did = str(u.get('discordId') or '').strip() or doc_id
-                zid = str(u.get('zwiftId') or '').strip()
-                if did and zid:
-                    discord_to_zwift[did] = zid
-                em = str(u.get('email') or '').strip()
-                if did and em:
-                    discord_to_email[did] = em
+            discord_to_zwift = identity_index.discord_to_zwift()
+            discord_to_email = identity_index.discord_to_email()
         except Exception:
             discord_to_zwift = {}
             discord_to_email = {}
@@ -2497,101 +2659,122 @@ def membership_payments_totals_per_year():
         return jsonify({"totals": out})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-@app.route('/api/membership/reconcile-roles', methods=['POST'])
-@login_required
-def membership_reconcile_roles():
-    """
-    Recalculate membership coverage for all users based on successful payments and
-    add/remove the configured Club Member role on Discord accordingly.
-    Also updates memberships/{userId} with computed status and coverage.
-    """
-    try:
-        # Load settings to get role id
-        settings = firebase.get_document('system_settings', 'global') or {}
-        membership = settings.get('membership', {}) if isinstance(settings, dict) else {}
-        role_id = str(membership.get('clubMemberRoleId') or '').strip()
-        if not role_id:
-            return jsonify({"error": "Club Member Role ID not configured in settings"}), 400
+def _membership_reconcile_roles(job=NULL_JOB):
+    """Plan and apply Club Member role changes; returns (payload, status). See membership_reconcile_roles."""
+    # Load settings to get role id
+    settings = firebase.get_document('system_settings', 'global') or {}
+    membership = settings.get('membership', {}) if isinstance(settings, dict) else {}
+    role_id = str(membership.get('clubMemberRoleId') or '').strip()
+    if not role_id:
+        return {"error": "Club Member Role ID not configured in settings"}, 400
 
-        # Gather payments (large limit for safety)
-        payments = firebase.get_collection('payments', limit=100000, include_id=True) or []
-        current_year = datetime.utcnow().year
+    # Gather payments (large limit for safety)
+    payments = firebase.get_collection('payments', limit=100000, include_id=True) or []
+    current_year = datetime.utcnow().year
 
-        # Compute max coveredThroughYear per user
-        user_to_max_cover = {}
-        for p in payments:
-            try:
-                if str(p.get('status', '')).lower() != 'succeeded':
-                    continue
-                user_id = str(p.get('userId') or '').strip()
-                covered = p.get('coveredThroughYear', None)
-                if not user_id or not isinstance(covered, int):
-                    continue
-                if user_id not in user_to_max_cover or covered > user_to_max_cover[user_id]:
-                    user_to_max_cover[user_id] = covered
-            except Exception:
+    # Compute max coveredThroughYear per user
+    user_to_max_cover = {}
+    for p in payments:
+        try:
+            if str(p.get('status', '')).lower() != 'succeeded':
+                continue
+            user_id = str(p.get('userId') or '').strip()
+            covered = p.get('coveredThroughYear', None)
+            if not user_id or not isinstance(covered, int):
                 continue
+            if user_id not in user_to_max_cover or covered > user_to_max_cover[user_id]:
+                user_to_max_cover[user_id] = covered
+        except Exception:
+            continue
 
-        # Build the reconciliation set from memberships + payments
-        existing_memberships = firebase.get_collection('memberships', limit=100000, include_id=True) or []
-        user_ids = set([str(m.get('userId') or '').strip() for m in existing_memberships if m.get('userId')]) | set(user_to_max_cover.keys())
+    # Build the reconciliation set from memberships + payments
+    existing_memberships = firebase.get_collection('memberships', limit=100000, include_id=True) or []
+    user_ids = set([str(m.get('userId') or '').strip() for m in existing_memberships if m.get('userId')]) | set(user_to_max_cover.keys())
+    user_ids.discard('')
 
-        # Discord env
-        guild_id = os.environ.get('DISCORD_GUILD_ID')
-        bot_token = os.environ.get('DISCORD_BOT_TOKEN')
-        if not guild_id or not bot_token:
-            return jsonify({"error": "Discord env not configured (DISCORD_GUILD_ID/DISCORD_BOT_TOKEN)"}), 500
-        headers = {'Authorization': f'Bot {bot_token}'}
+    # Discord env
+    guild_id = os.environ.get('DISCORD_GUILD_ID')
+    bot_token = os.environ.get('DISCORD_BOT_TOKEN')
+    if not guild_id or not bot_token:
+        return {"error": "Discord env not configured (DISCORD_GUILD_ID/DISCORD_BOT_TOKEN)"}, 500
+
+    # Current roles of everyone in the guild, so only real changes are sent
+    job.progress(stage="members")
+    discord_api = DiscordAPI(bot_token, guild_id)
+    guild_roles = {
+        str(m.get("discordID")): set(str(r) for r in (m.get("role_ids") or []))
+        for m in (discord_api.get_all_members(limit=200000, include_role_names=False, force_refresh=True) or [])
+    }
 
-        result = {"updated_memberships": 0, "roles_added": 0, "roles_removed": 0, "errors": 0, "total_users": len(user_ids)}
+    result = {
+        "updated_memberships": 0, "roles_added": 0, "roles_removed": 0, "roles_unchanged": 0,
+        "not_in_guild": 0, "errors": 0, "total_users": len(user_ids),
+    }
 
-        for uid in user_ids:
-            if not uid:
-                continue
-            covered = user_to_max_cover.get(uid, None)
-            status = 'club' if (isinstance(covered, int) and covered >= current_year) else 'community'
+    # Plan membership summaries and role changes
+    now_iso = datetime.utcnow().isoformat()
+    membership_ops = []
+    changes = []
+    for uid in user_ids:
+        covered = user_to_max_cover.get(uid, None)
+        status = 'club' if (isinstance(covered, int) and covered >= current_year) else 'community'
+
+        membership_ops.append(set_op(firebase.db.collection('memberships').document(uid), {
+            "userId": uid,
+            "currentStatus": status,
+            "coveredThroughYear": covered if isinstance(covered, int) else None,
+            "updatedAt": now_iso
+        }, merge=True))
+
+        member_roles = guild_roles.get(uid)
+        if member_roles is None:
+            result["not_in_guild"] += 1
+        elif status == 'club' and role_id not in member_roles:
+            changes.append(RoleChange(uid, role_id, "add"))
+        elif status != 'club' and role_id in member_roles:
+            changes.append(RoleChange(uid, role_id, "remove"))
+        else:
+            result["roles_unchanged"] += 1
 
-            # Update membership summary
-            try:
-                firebase.set_document('memberships', uid, {
-                    "userId": uid,
-                    "currentStatus": status,
-                    "coveredThroughYear": covered if isinstance(covered, int) else None,
-                    "updatedAt": datetime.utcnow().isoformat()
-                }, merge=True)
-                result["updated_memberships"] += 1
-            except Exception:
-                result["errors"] += 1
+    # Execute
+    job.check_cancelled()
+    job.progress(total=len(membership_ops), stage="memberships")
+    write_stats = BulkWriter(firebase.db, name="memberships", raise_on_error=False).write(membership_ops)
+    result["updated_memberships"] = write_stats["ops"]
+    result["errors"] += write_stats["failedOps"]
 
-            # Role reconciliation
-            try:
-                if status == 'club':
-                    # Add role
-                    r = requests.put(
-                        f'https://discord.com/api/v10/guilds/{guild_id}/members/{uid}/roles/{role_id}',
-                        headers=headers
-                    )
-                    if 200 <= r.status_code < 300:
-                        result["roles_added"] += 1
-                    else:
-                        # Still count as not-an-error if user not in guild
-                        if r.status_code not in (403, 404):
-                            result["errors"] += 1
-                else:
-                    # Remove role
-                    r = requests.delete(
-                        f'https://discord.com/api/v10/guilds/{guild_id}/members/{uid}/roles/{role_id}',
-                        headers=headers
-                    )
-                    # 204 expected; 404 if user not in guild or role missing - treat as ok
-                    if r.status_code in (200, 202, 204, 404):
-                        result["roles_removed"] += 1
-                    else:
-                        result["errors"] += 1
-            except Exception:
-                result["errors"] += 1
+    if changes:
+        job.progress(stage="roles")
+        run = RoleMutationPipeline(
+            bot_token, guild_id, reason="Club membership reconcile",
+            on_progress=_role_progress_reporter(job), should_stop=lambda: job.cancelled,
+        ).run(changes)
+        result["roles_added"] = run["added"]
+        result["roles_removed"] = run["removed"]
+        result["errors"] += run["failed"]
+        result["pipeline"] = run
+
+    if result["roles_added"] or result["roles_removed"]:
+        member_snapshots.invalidate(guild_id)
+
+    return result, 200
 
-        return jsonify(result)
+
+@app.route('/api/membership/reconcile-roles', methods=['POST'])
+@login_required
+def membership_reconcile_roles():
+    """
+    Recalculate membership coverage for all users based on successful payments and
+    add/remove the configured Club Member role on Discord accordingly.
+    Also updates memberships/{userId} with computed status and coverage.
+
+    With ?async=1 the reconcile runs as a background job (202 + job id, see /api/jobs/<id>).
+    """
+    try:
+        if _wants_async():
+            return _start_job("membership-reconcile-roles", _membership_reconcile_roles)
+        payload, status = _membership_reconcile_roles()
+        return jsonify(payload), status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 @app.route('/login')
@@ -2824,78 +3007,63 @@ def bot_knowledge():
 
 # Discord stats endpoints
 
+def _activity_window(days: int, fields=None):
+    """(start, end, daily rollups) for the last `days` days of server activity."""
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    return start_date, end_date, activity_rollups.window(start_date.date(), end_date.date(), fields=fields)
+
+
+def _exact_unique_counts(days: int) -> bool:
+    """?unique=exact|approx; by default windows up to ACTIVITY_EXACT_MAX_DAYS days are counted exactly."""
+    mode = (request.args.get('unique') or '').strip().lower()
+    if mode in ('exact', 'approx'):
+        return mode == 'exact'
+    return days <= ACTIVITY_EXACT_MAX_DAYS
+
+
 @app.route('/api/discord/stats/summary', methods=['GET'])
 @login_required
 def get_discord_stats_summary():
-    """Get summary statistics for Discord server activity"""
+    """Get summary statistics for Discord server activity (?days=30, ?unique=exact|approx)"""
     try:
-        from datetime import datetime, timedelta
-        
-        # Get recent activity data (last 30 days)
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=30)
-        
-        # Convert to ISO string format to match Firebase data
-        end_date_str = end_date.isoformat() + "Z"
-        start_date_str = start_date.isoformat() + "Z"
-        
-        # Query Firebase using string timestamps
-        activity_docs = firebase.db.collection('server_activity')\
-            .where('timestamp', '>=', start_date_str)\
-            .where('timestamp', '<=', end_date_str)\
-            .order_by('timestamp', direction=firebase.firestore.Query.DESCENDING)\
-            .stream()
-        
-        activities = [doc.to_dict() for doc in activity_docs]
-        
-        # Calculate summary statistics
-        total_activities = sum(activity.get('totalActivities', 0) for activity in activities)
-        total_messages = sum(activity.get('rawData', {}).get('messageCount', 0) for activity in activities)
-        total_reactions = sum(activity.get('rawData', {}).get('reactionCount', 0) for activity in activities)
-        total_voice_activity = sum(activity.get('rawData', {}).get('voiceActivityCount', 0) for activity in activities)
-        total_interactions = sum(activity.get('rawData', {}).get('interactionCount', 0) for activity in activities)
-        
-        # Get unique users and channels
-        all_users = set()
-        all_channels = set()
-        
-        for activity in activities:
-            summary = activity.get('summary', {})
-            user_activity = summary.get('userActivity', {})
-            channel_activity = summary.get('channelActivity', {})
-            
-            all_users.update(user_activity.keys())
-            all_channels.update(channel_activity.keys())
-        
+        days = request.args.get('days', default=30, type=int)
+        exact = _exact_unique_counts(days)
+        # One rollup per day; approximate unique counts only need the sketches, not the member maps
+        start_date, end_date, rollups = _activity_window(days, fields=None if exact else SKETCH_FIELDS)
+        window = merge_rollups(rollups)
+        totals = window["totals"]
+        unique = unique_counts(rollups, exact=exact)
+
         # Calculate daily averages
-        unique_dates = set(activity.get('dateKey') for activity in activities if activity.get('dateKey'))
-        days_with_data = len(unique_dates)
-        avg_daily_messages = total_messages / max(days_with_data, 1)
-        avg_daily_activities = total_activities / max(days_with_data, 1)
+        days_with_data = window["daysWithData"]
+        avg_daily_messages = totals["messages"] / max(days_with_data, 1)
+        avg_daily_activities = totals["activities"] / max(days_with_data, 1)
         
         summary = {
             "period": {
                 "start": start_date.isoformat(),
                 "end": end_date.isoformat(),
-                "days": 30
+                "days": days
             },
             "totals": {
-                "activities": total_activities,
-                "messages": total_messages,
-                "reactions": total_reactions,
-                "voice_activity": total_voice_activity,
-                "interactions": total_interactions
+                "activities": totals["activities"],
+                "messages": totals["messages"],
+                "reactions": totals["reactions"],
+                "voice_activity": totals["voice_activity"],
+                "interactions": totals["interactions"]
             },
             "averages": {
                 "daily_messages": round(avg_daily_messages, 1),
                 "daily_activities": round(avg_daily_activities, 1)
             },
             "unique_counts": {
-                "active_users": len(all_users),
-                "active_channels": len(all_channels),
-                "days_with_activity": days_with_data
+                "active_users": unique["users"],
+                "active_channels": unique["channels"],
+                "days_with_activity": days_with_data,
+                "mode": "exact" if exact else "approx"
             },
-            "recent_activity_count": len(activities)
+            "recent_activity_count": window["docCount"]
         }
         
         return jsonify(summary)
@@ -2906,70 +3074,28 @@ def get_discord_stats_summary():
 @app.route('/api/discord/stats/daily', methods=['GET'])
 @login_required
 def get_daily_discord_stats():
-    """Get daily activity statistics for charts"""
+    """Get daily activity statistics for charts (?days=30, ?unique=exact|approx)"""
     try:
         days = request.args.get('days', default=30, type=int)
-        
-        from datetime import datetime, timedelta
-        
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Convert to ISO string format to match Firebase data
-        end_date_str = end_date.isoformat() + "Z"
-        start_date_str = start_date.isoformat() + "Z"
-        
-        # Query Firebase
-        activity_docs = firebase.db.collection('server_activity')\
-            .where('timestamp', '>=', start_date_str)\
-            .where('timestamp', '<=', end_date_str)\
-            .order_by('timestamp')\
-            .stream()
-        
-        activities = [doc.to_dict() for doc in activity_docs]
-        
-        # Group by dateKey
-        daily_stats = {}
-        
-        for activity in activities:
-            date_key = activity.get('dateKey')
-            if not date_key:
-                continue
-                
-            if date_key not in daily_stats:
-                daily_stats[date_key] = {
-                    "date": date_key,
-                    "messages": 0,
-                    "reactions": 0,
-                    "voice_activity": 0,
-                    "interactions": 0,
-                    "total_activities": 0,
-                    "unique_users": set(),
-                    "unique_channels": set()
-                }
-            
-            raw_data = activity.get('rawData', {})
-            daily_stats[date_key]["messages"] += raw_data.get('messageCount', 0)
-            daily_stats[date_key]["reactions"] += raw_data.get('reactionCount', 0)
-            daily_stats[date_key]["voice_activity"] += raw_data.get('voiceActivityCount', 0)
-            daily_stats[date_key]["interactions"] += raw_data.get('interactionCount', 0)
-            daily_stats[date_key]["total_activities"] += activity.get('totalActivities', 0)
-            
-            # Track unique users and channels
-            summary = activity.get('summary', {})
-            user_activity = summary.get('userActivity', {})
-            channel_activity = summary.get('channelActivity', {})
-            
-            daily_stats[date_key]["unique_users"].update(user_activity.keys())
-            daily_stats[date_key]["unique_channels"].update(channel_activity.keys())
-        
-        # Convert sets to counts and sort by date
+        exact = _exact_unique_counts(days)
+        start_date, end_date, rollups = _activity_window(days, fields=None if exact else SKETCH_FIELDS)
+
         result = []
-        for date_key in sorted(daily_stats.keys()):
-            stats = daily_stats[date_key]
-            stats["unique_users"] = len(stats["unique_users"])
-            stats["unique_channels"] = len(stats["unique_channels"])
-            result.append(stats)
+        for rollup in rollups:
+            if not rollup.get("docCount"):
+                continue
+            totals = rollup.get("totals") or {}
+            unique = unique_counts([rollup], exact=exact)
+            result.append({
+                "date": rollup["dateKey"],
+                "messages": totals.get("messages", 0),
+                "reactions": totals.get("reactions", 0),
+                "voice_activity": totals.get("voice_activity", 0),
+                "interactions": totals.get("interactions", 0),
+                "total_activities": totals.get("activities", 0),
+                "unique_users": unique["users"],
+                "unique_channels": unique["channels"]
+            })
         
         return jsonify({
             "period": {
@@ -2983,6 +3109,46 @@ def get_daily_discord_stats():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+def _refresh_activity_rollups(body: dict, job=NULL_JOB):
+    """Bring the daily activity rollups up to date; returns (payload, status). See refresh_activity_rollups."""
+    rebuild_days = body.get("rebuildDays")
+    if rebuild_days is not None:
+        try:
+            rebuild_days = int(rebuild_days)
+        except (TypeError, ValueError):
+            return {"error": "rebuildDays must be an integer"}, 400
+        if rebuild_days < 1:
+            return {"error": "rebuildDays must be positive"}, 400
+        today = datetime.now().date()
+        job.progress(stage="rebuilding", total=rebuild_days)
+        result = activity_rollups.rebuild(date_keys(today - timedelta(days=rebuild_days - 1), today))
+    else:
+        job.progress(stage="refreshing")
+        result = activity_rollups.refresh()
+    return {"status": "success", **result}, 200
+
+
+@app.route('/api/discord/stats/rollups/refresh', methods=['POST'])
+def refresh_activity_rollups():
+    """
+    Update the daily server_activity rollups behind the stats endpoints (cron).
+
+    Without a body only days that received new activity documents are rebuilt.
+    {"rebuildDays": N} recomputes the last N days from the raw documents.
+    With ?async=1 it runs as a background job (202 + job id, see /api/jobs/<id>).
+    """
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        body = request.get_json(silent=True) or {}
+        if _wants_async():
+            return _start_job("activity-rollups", _refresh_activity_rollups, body)
+        payload, status = _refresh_activity_rollups(body)
+        return jsonify(payload), status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 def _record_daily_member_count_snapshot() -> None:
     """
     Record a daily snapshot of Discord member count in Firestore.
@@ -3072,98 +3238,86 @@ def _discord_snowflake_created_at_utc(snowflake_id: str) -> Optional[datetime]:
     except Exception:
         return None
 
-@app.route('/api/discord/stats/members/backfill', methods=['POST'])
-@login_required
-def backfill_member_counts():
-    """
-    Estimate historical member counts for missing days using current members' joined_at timestamps.
-
-    This is NOT a true historical reconstruction (leavers are unknown).
-    It counts the cohort of members currently in the guild who had joined by each day.
-    """
-    try:
-        body = request.get_json(silent=True) or {}
-        days = body.get('days', 90)
-        force = bool(body.get('force', False))
-        since_creation = bool(body.get('since_creation', False))
-
-        cet = pytz.timezone('Europe/Berlin')
-        end_date = datetime.now(cet).date()
-
-        if since_creation:
-            created_at_utc = _discord_snowflake_created_at_utc(DISCORD_GUILD_ID)
-            if not created_at_utc:
-                return jsonify({"error": "Unable to determine server creation time from DISCORD_GUILD_ID"}), 400
-            start_date = created_at_utc.astimezone(cet).date()
-            days = (end_date - start_date).days + 1
-        else:
-            try:
-                days = int(days)
-            except Exception:
-                days = 90
-            # allow larger ranges, but keep a hard cap for safety
-            days = max(1, min(days, 5000))
-            start_date = end_date - timedelta(days=days - 1)
+def _backfill_member_counts(body: dict, job=NULL_JOB):
+    """Write estimated server_member_counts snapshots; returns (payload, status). See backfill_member_counts."""
+    days = body.get('days', 90)
+    force = bool(body.get('force', False))
+    since_creation = bool(body.get('since_creation', False))
+
+    cet = pytz.timezone('Europe/Berlin')
+    end_date = datetime.now(cet).date()
+
+    if since_creation:
+        created_at_utc = _discord_snowflake_created_at_utc(DISCORD_GUILD_ID)
+        if not created_at_utc:
+            return {"error": "Unable to determine server creation time from DISCORD_GUILD_ID"}, 400
+        start_date = created_at_utc.astimezone(cet).date()
+        days = (end_date - start_date).days + 1
+    else:
+        try:
+            days = int(days)
+        except Exception:
+            days = 90
+        # allow larger ranges, but keep a hard cap for safety
+        days = max(1, min(days, 5000))
+        start_date = end_date - timedelta(days=days - 1)
 
-        # Hard cap safety: avoid accidentally writing extreme ranges
-        if days > 5000:
-            return jsonify({"error": "Requested range too large (max 5000 days)"}), 400
+    # Hard cap safety: avoid accidentally writing extreme ranges
+    if days > 5000:
+        return {"error": "Requested range too large (max 5000 days)"}, 400
 
-        # Pull current members once
-        discord_api = DiscordAPI(DISCORD_BOT_TOKEN, DISCORD_GUILD_ID)
-        members = discord_api.get_all_members(limit=200000, include_role_names=False)
+    # Pull current members once
+    job.progress(stage="members")
+    discord_api = DiscordAPI(DISCORD_BOT_TOKEN, DISCORD_GUILD_ID)
+    members = discord_api.get_all_members(limit=200000, include_role_names=False)
 
-        # Build array of join dates (CET date) for totals
-        total_join_dates = []
+    # Build array of join dates (CET date) for totals
+    total_join_dates = []
 
-        for m in members:
-            joined_at = _parse_discord_iso_datetime(m.get('joined_at'))
-            if not joined_at:
-                continue
-            joined_date_cet = joined_at.astimezone(cet).date()
-            total_join_dates.append(joined_date_cet)
+    for m in members:
+        joined_at = _parse_discord_iso_datetime(m.get('joined_at'))
+        if not joined_at:
+            continue
+        joined_date_cet = joined_at.astimezone(cet).date()
+        total_join_dates.append(joined_date_cet)
 
-        total_join_dates.sort()
+    total_join_dates.sort()
 
-        col = firebase.db.collection('server_member_counts')
-        written = 0
-        skipped = 0
+    col = firebase.db.collection('server_member_counts')
+    skipped = 0
 
-        # Preload existing docs once (avoids N reads for long ranges)
-        existing_keys = set()
-        if not force:
-            try:
-                start_key = start_date.strftime('%Y-%m-%d')
-                end_key = end_date.strftime('%Y-%m-%d')
-                existing_docs = (
-                    col.where('dateKey', '>=', start_key)
-                       .where('dateKey', '<=', end_key)
-                       .stream()
-                )
-                for doc in existing_docs:
-                    dct = doc.to_dict() or {}
-                    dk = dct.get('dateKey')
-                    if isinstance(dk, str) and dk:
-                        existing_keys.add(dk)
-            except Exception:
-                # If this fails (e.g., permissions/index), we'll fall back to writes without skipping.
-                existing_keys = set()
+    # Preload existing docs once (avoids N reads for long ranges)
+    existing_keys = set()
+    if not force:
+        try:
+            start_key = start_date.strftime('%Y-%m-%d')
+            end_key = end_date.strftime('%Y-%m-%d')
+            existing_docs = (
+                col.where('dateKey', '>=', start_key)
+                   .where('dateKey', '<=', end_key)
+                   .stream()
+            )
+            for doc in existing_docs:
+                dct = doc.to_dict() or {}
+                dk = dct.get('dateKey')
+                if isinstance(dk, str) and dk:
+                    existing_keys.add(dk)
+        except Exception:
+            # If this fails (e.g., permissions/index), we'll fall back to writes without skipping.
+            existing_keys = set()
 
-        # Batch writes for speed (Firestore batch limit: 500 operations)
-        batch = firebase.db.batch()
-        batch_ops = 0
+    now_utc_iso = datetime.utcnow().isoformat() + "Z"
 
+    def snapshot_ops():
+        nonlocal skipped
         d = start_date
-        now_utc_iso = datetime.utcnow().isoformat() + "Z"
         while d <= end_date:
+            job.check_cancelled()
             date_key = d.strftime('%Y-%m-%d')
-            doc_ref = col.document(date_key)
-
-            if not force:
-                if date_key in existing_keys:
-                    skipped += 1
-                    d += timedelta(days=1)
-                    continue
+            if not force and date_key in existing_keys:
+                skipped += 1
+                d += timedelta(days=1)
+                continue
 
             member_count = bisect_right(total_join_dates, d)
 
@@ -3175,29 +3329,40 @@ def backfill_member_counts():
                 "estimatedMode": "cohort_joined_at",
                 "estimatedAt": now_utc_iso,
             }
+            yield set_op(col.document(date_key), snapshot, merge=True)
+            d += timedelta(days=1)
+            job.progress(done=(d - start_date).days, total=days, stage="writing")
 
-            batch.set(doc_ref, snapshot, merge=True)
-            batch_ops += 1
-            written += 1
+    write_stats = BulkWriter(firebase.db, name="server_member_counts backfill").write(snapshot_ops())
+    written = write_stats["ops"]
 
-            if batch_ops >= 450:
-                batch.commit()
-                batch = firebase.db.batch()
-                batch_ops = 0
+    return {
+        "status": "ok",
+        "period": {"days": days, "start": start_date.strftime('%Y-%m-%d'), "end": end_date.strftime('%Y-%m-%d')},
+        "written": written,
+        "skipped": skipped,
+        "writeStats": write_stats,
+        "note": "Estimated backfill uses current members + joined_at; leavers are not represented."
+    }, 200
 
-            d += timedelta(days=1)
 
-        if batch_ops > 0:
-            batch.commit()
+@app.route('/api/discord/stats/members/backfill', methods=['POST'])
+@login_required
+def backfill_member_counts():
+    """
+    Estimate historical member counts for missing days using current members' joined_at timestamps.
 
-        return jsonify({
-            "status": "ok",
-            "period": {"days": days, "start": start_date.strftime('%Y-%m-%d'), "end": end_date.strftime('%Y-%m-%d')},
-            "written": written,
-            "skipped": skipped,
-            "note": "Estimated backfill uses current members + joined_at; leavers are not represented."
-        })
+    This is NOT a true historical reconstruction (leavers are unknown).
+    It counts the cohort of members currently in the guild who had joined by each day.
 
+    With ?async=1 the backfill runs as a background job (202 + job id, see /api/jobs/<id>).
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        if _wants_async():
+            return _start_job("member-counts-backfill", _backfill_member_counts, body)
+        payload, status = _backfill_member_counts(body)
+        return jsonify(payload), status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -3286,56 +3451,25 @@ def get_top_users():
     try:
         days = request.args.get('days', default=30, type=int)
         limit = request.args.get('limit', default=10, type=int)
-        
-        from datetime import datetime, timedelta
-        
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Convert to ISO string format
-        end_date_str = end_date.isoformat() + "Z"
-        start_date_str = start_date.isoformat() + "Z"
-        
-        # Query Firebase
-        activity_docs = firebase.db.collection('server_activity')\
-            .where('timestamp', '>=', start_date_str)\
-            .where('timestamp', '<=', end_date_str)\
-            .stream()
-        
-        activities = [doc.to_dict() for doc in activity_docs]
-        
-        # Aggregate user activity
-        user_totals = {}
-        
-        for activity in activities:
-            summary = activity.get('summary', {})
-            user_activity = summary.get('userActivity', {})
-            
-            for user_id, user_data in user_activity.items():
-                if user_id not in user_totals:
-                    user_totals[user_id] = {
-                        "user_id": user_id,
-                        "username": user_data.get('username', 'Unknown'),
-                        "messages": 0,
-                        "reactions": 0,
-                        "voice_activity": 0,
-                        "interactions": 0,
-                        "total_activities": 0
-                    }
-                
-                user_totals[user_id]["messages"] += user_data.get('messages', 0)
-                user_totals[user_id]["reactions"] += user_data.get('reactions', 0)
-                user_totals[user_id]["voice_activity"] += user_data.get('voiceActivity', 0)
-                user_totals[user_id]["interactions"] += user_data.get('interactions', 0)
-                user_totals[user_id]["total_activities"] += (
-                    user_data.get('messages', 0) + 
-                    user_data.get('reactions', 0) + 
-                    user_data.get('voiceActivity', 0) + 
-                    user_data.get('interactions', 0)
+        start_date, end_date, rollups = _activity_window(days)
+
+        top_users = [
+            {
+                "user_id": user_id,
+                "username": counters.get('username') or 'Unknown',
+                "messages": counters['messages'],
+                "reactions": counters['reactions'],
+                "voice_activity": counters['voiceActivity'],
+                "interactions": counters['interactions'],
+                "total_activities": (
+                    counters['messages'] +
+                    counters['reactions'] +
+                    counters['voiceActivity'] +
+                    counters['interactions']
                 )
-        
-        # Convert to list and sort by total activities
-        top_users = list(user_totals.values())
+            }
+            for user_id, counters in merge_rollups(rollups)["users"].items()
+        ]
         top_users.sort(key=lambda x: x["total_activities"], reverse=True)
         
         return jsonify({
@@ -3357,50 +3491,18 @@ def get_top_channels():
     try:
         days = request.args.get('days', default=30, type=int)
         limit = request.args.get('limit', default=10, type=int)
-        
-        from datetime import datetime, timedelta
-        
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Convert to ISO string format
-        end_date_str = end_date.isoformat() + "Z"
-        start_date_str = start_date.isoformat() + "Z"
-        
-        # Query Firebase
-        activity_docs = firebase.db.collection('server_activity')\
-            .where('timestamp', '>=', start_date_str)\
-            .where('timestamp', '<=', end_date_str)\
-            .stream()
-        
-        activities = [doc.to_dict() for doc in activity_docs]
-        
-        # Aggregate channel activity
-        channel_totals = {}
-        
-        for activity in activities:
-            summary = activity.get('summary', {})
-            channel_activity = summary.get('channelActivity', {})
-            
-            for channel_id, channel_data in channel_activity.items():
-                if channel_id not in channel_totals:
-                    channel_totals[channel_id] = {
-                        "channel_id": channel_id,
-                        "channel_name": channel_data.get('channelName', 'Unknown'),
-                        "messages": 0,
-                        "reactions": 0,
-                        "total_activities": 0
-                    }
-                
-                channel_totals[channel_id]["messages"] += channel_data.get('messages', 0)
-                channel_totals[channel_id]["reactions"] += channel_data.get('reactions', 0)
-                channel_totals[channel_id]["total_activities"] += (
-                    channel_data.get('messages', 0) + 
-                    channel_data.get('reactions', 0)
-                )
-        
-        # Convert to list and sort by total activities
-        top_channels = list(channel_totals.values())
+        start_date, end_date, rollups = _activity_window(days)
+
+        top_channels = [
+            {
+                "channel_id": channel_id,
+                "channel_name": counters.get('channelName') or 'Unknown',
+                "messages": counters['messages'],
+                "reactions": counters['reactions'],
+                "total_activities": counters['messages'] + counters['reactions']
+            }
+            for channel_id, counters in merge_rollups(rollups)["channels"].items()
+        ]
         top_channels.sort(key=lambda x: x["total_activities"], reverse=True)
         
         return jsonify({
@@ -4427,6 +4529,8 @@ def refresh_default_zwift_club_roster():
     Refresh Zwift club roster for the single configured club (ZWIFT_CLUB_ID) and store it in Firestore.
 
     Auth: Bearer CONTENT_API_KEY
+
+    With ?async=1 the refresh runs as a background job (202 + job id, see /api/jobs/<id>).
     """
     if not verify_api_key():
         return jsonify({"error": "Unauthorized"}), 401
@@ -4439,6 +4543,12 @@ def refresh_default_zwift_club_roster():
         paginate_raw = str(request.args.get("paginate", "true")).lower().strip()
         paginate = paginate_raw not in ("0", "false", "no", "off")
 
+        if _wants_async():
+            return _start_job(
+                "zwift-roster-refresh",
+                lambda club_id, job: (_refresh_companion_club_roster(club_id, limit=limit, paginate=paginate, job=job), 200),
+                str(ZWIFT_CLUB_ID),
+            )
         payload = _refresh_companion_club_roster(str(ZWIFT_CLUB_ID), limit=limit, paginate=paginate)
         return jsonify(payload)
 
@@ -4447,6 +4557,70 @@ def refresh_default_zwift_club_roster():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+def _refresh_zwiftpower_club_roster(club_id: int, job=NULL_JOB):
+    """Download team_riders for club_id and sync zwiftpower_club_members; returns (payload, status)."""
+    zp = _zwiftpower_client()
+
+    job.progress(stage="downloading")
+    raw = zp.get_team_riders(club_id) or {}
+    rows = raw.get("data") or []
+
+    simplified = []
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+
+        zwid = row.get("zwid")
+        if zwid is None:
+            continue
+
+        name = row.get("name")
+        if isinstance(name, str):
+            name = name.strip()
+        else:
+            name = None
+
+        rank_raw = row.get("rank")
+        rank_num = None
+
+        if isinstance(rank_raw, (int, float)):
+            rank_num = float(rank_raw)
+        elif isinstance(rank_raw, str):
+            s = rank_raw.strip().replace(",", ".")
+            if s:
+                try:
+                    rank_num = float(s)
+                except Exception:
+                    rank_num = None
+
+        simplified.append(
+            {
+                "zwid": zwid,
+                "name": name,
+                "rank": rank_num,
+                "rankRaw": rank_raw,
+            }
+        )
+
+    job.check_cancelled()
+    job.progress(done=len(simplified), stage="syncing")
+    result = overwrite_zwiftpower_club_members_in_firestore(simplified)
+    return {
+        "status": "success",
+        "clubId": club_id,
+        "fetched": len(rows),
+        "stored": result["memberCount"],
+        "deleted": result["deleted"],
+        "upserted": result["upserted"],
+        "added": result["added"],
+        "changed": result["changed"],
+        "unchanged": result["unchanged"],
+        "removed": result["removed"],
+        "syncedAt": result["syncedAt"],
+        "cache": zp.last_cache_info,
+    }, 200
+
+
 @app.route('/api/zwiftpower/club/roster/refresh', methods=['POST'])
 def refresh_zwiftpower_club_roster():
     """
@@ -4455,7 +4629,9 @@ def refresh_zwiftpower_club_roster():
 
     Auth: Bearer CONTENT_API_KEY
 
-    Overwrites Firestore collection: zwiftpower_club_members
+    Syncs Firestore collection zwiftpower_club_members (only differences are written)
+
+    With ?async=1 the refresh runs as a background job (202 + job id, see /api/jobs/<id>).
     """
     if not verify_api_key():
         return jsonify({"error": "Unauthorized"}), 401
@@ -4471,62 +4647,10 @@ def refresh_zwiftpower_club_roster():
         return jsonify({"error": "ZWIFTPOWER_CLUB_ID must be an integer"}), 400
 
     try:
-        session = get_authenticated_session()
-        zp = ZwiftPower(ZWIFT_USERNAME, ZWIFT_PASSWORD)
-        zp.session = session
-
-        raw = zp.get_team_riders(club_id) or {}
-        rows = raw.get("data") or []
-
-        simplified = []
-        for row in rows:
-            if not isinstance(row, dict):
-                continue
-
-            zwid = row.get("zwid")
-            if zwid is None:
-                continue
-
-            name = row.get("name")
-            if isinstance(name, str):
-                name = name.strip()
-            else:
-                name = None
-
-            rank_raw = row.get("rank")
-            rank_num = None
-
-            if isinstance(rank_raw, (int, float)):
-                rank_num = float(rank_raw)
-            elif isinstance(rank_raw, str):
-                s = rank_raw.strip().replace(",", ".")
-                if s:
-                    try:
-                        rank_num = float(s)
-                    except Exception:
-                        rank_num = None
-
-            simplified.append(
-                {
-                    "zwid": zwid,
-                    "name": name,
-                    "rank": rank_num,
-                    "rankRaw": rank_raw,
-                }
-            )
-
-        result = overwrite_zwiftpower_club_members_in_firestore(simplified)
-        return jsonify(
-            {
-                "status": "success",
-                "clubId": club_id,
-                "fetched": len(rows),
-                "stored": result["memberCount"],
-                "deleted": result["deleted"],
-                "upserted": result["upserted"],
-                "syncedAt": result["syncedAt"],
-            }
-        )
+        if _wants_async():
+            return _start_job("zwiftpower-roster-refresh", _refresh_zwiftpower_club_roster, club_id)
+        payload, status = _refresh_zwiftpower_club_roster(club_id)
+        return jsonify(payload), status
 
     except Exception as e:
         print(f"Error refreshing ZwiftPower club roster: {str(e)}")
@@ -4632,6 +4756,37 @@ def delete_signup_board(board_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+def _job_caller_authorized() -> bool:
+    """Jobs are started from both the admin UI (session) and cron/API clients (Bearer CONTENT_API_KEY)."""
+    return verify_api_key() or ('user' in session and 'discord_id' in session)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status of a background job: {id, kind, status, progress, result, error, createdAt, startedAt, finishedAt}"""
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        record = job_runner.get(job_id)
+        if record is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(record)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Request cancellation; the job stops at its next checkpoint and ends with status "cancelled"."""
+    if not _job_caller_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        record = job_runner.cancel(job_id)
+        if record is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(record), 200 if record.get("status") in FINISHED_STATUSES else 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8080))
     app.run(host='0.0.0.0', port=port)
@@ -18,6 +18,8 @@ from datetime import datetime
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from bulk_writer import BulkWriter, set_op
+
 # Initialize Firebase with service account
 script_dir = os.path.dirname(os.path.abspath(__file__))
 service_account_path = os.path.join(script_dir, 'service-account-key.json')
@@ -128,33 +130,37 @@ def merge_user_data(discord_users: dict, user_profiles: dict) -> dict:
 def write_users(merged: dict, dry_run: bool = True) -> dict:
     """Write merged users to the 'users' collection."""
     stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
-    
-    for discord_id, user_data in merged.items():
-        try:
+
+    if dry_run:
+        for discord_id, user_data in merged.items():
+            sources = user_data.get('_source', [])
+            print(f"    [DRY-RUN] Would write user {discord_id} (sources: {', '.join(sources)})")
+            stats['created'] += 1
+        return stats
+
+    users_ref = db.collection('users')
+    # One listing instead of a read per user to tell creates from updates
+    existing_ids = {doc_ref.id for doc_ref in users_ref.list_documents()}
+
+    def user_ops():
+        for discord_id, user_data in merged.items():
             # Remove internal tracking field before writing
             data_to_write = {k: v for k, v in user_data.items() if not k.startswith('_')}
-            
-            if dry_run:
-                sources = user_data.get('_source', [])
-                print(f"    [DRY-RUN] Would write user {discord_id} (sources: {', '.join(sources)})")
-                stats['created'] += 1
+            if discord_id in existing_ids:
+                # Merge with existing data (don't overwrite)
+                stats['updated'] += 1
+                yield set_op(users_ref.document(discord_id), data_to_write, merge=True)
             else:
-                # Check if document already exists
-                doc_ref = db.collection('users').document(discord_id)
-                existing = doc_ref.get()
-                
-                if existing.exists:
-                    # Merge with existing data (don't overwrite)
-                    doc_ref.set(data_to_write, merge=True)
-                    stats['updated'] += 1
-                else:
-                    doc_ref.set(data_to_write)
-                    stats['created'] += 1
-                    
-        except Exception as e:
-            print(f"    ✗ Error writing user {discord_id}: {e}")
-            stats['errors'] += 1
-    
+                stats['created'] += 1
+                yield set_op(users_ref.document(discord_id), data_to_write)
+
+    writer = BulkWriter(db, raise_on_error=False, name="users migration")
+    write_stats = writer.write(user_ops())
+    for error in write_stats['errors']:
+        print(f"    ✗ Error writing users batch: {error}")
+    # created/updated count attempted writes; users in failed batches are also counted here
+    stats['errors'] = write_stats['failedOps']
+
     return stats
 
 
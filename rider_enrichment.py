@@ -0,0 +1,308 @@
+import os
+import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from club_stats_store import rider_key
+from firestore_client import LazyFirestoreClient
+from ratelimit import TokenBucket, limiter_for
+
+# Queue summary document; its `items` subcollection holds one document per rider
+QUEUE_DOC = ("rider_queues", "current")
+ITEM_COLLECTION = "items"
+# Concurrent profile requests and the request budget they share (tune to what the Zwift API tolerates)
+ZWIFT_PROFILE_WORKERS = int(os.getenv("ZWIFT_PROFILE_WORKERS", "8"))
+ZWIFT_PROFILE_RPS = float(os.getenv("ZWIFT_PROFILE_RPS", "4"))
+# A rider whose profile request keeps failing is marked failed after this many tries (429s do not count)
+RIDER_QUEUE_MAX_ATTEMPTS = int(os.getenv("RIDER_QUEUE_MAX_ATTEMPTS", "3"))
+# A run holds a lease on the queue (renewed while it works) so runs never overlap
+RIDER_QUEUE_LEASE_SECONDS = int(os.getenv("RIDER_QUEUE_LEASE_SECONDS", "120"))
+# Pause applied to the shared limiter after a 429 without Retry-After
+_RATE_LIMIT_PAUSE_SECONDS = 10.0
+
+PENDING, COMPLETED, FAILED = "pending", "completed", "failed"
+
+
+class QueueBusy(Exception):
+    """Another run is working the queue."""
+
+
+class RiderQueue(LazyFirestoreClient):
+    """
+    Riders waiting for a racing score, one document per rider:
+
+        rider_queues/current                {created, clubStatsDate, total}
+        rider_queues/current/items/{id}     {riderId, name, status, attempts,
+                                             racingScore, error, addedAt, processedAt}
+
+    Each rider's state changes with a single small write, so the queue can be
+    worked on concurrently and resumed after an interruption. Queues still in
+    the old single-document layout (pending/completed/failed arrays) are
+    converted on first use.
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+        self._lock = threading.Lock()
+
+    def _doc(self):
+        collection, doc_id = QUEUE_DOC
+        return self.db.collection(collection).document(doc_id)
+
+    def _items(self):
+        return self._doc().collection(ITEM_COLLECTION)
+
+    def exists(self) -> bool:
+        snap = self._doc().get()
+        if not snap.exists:
+            return False
+        data = snap.to_dict() or {}
+        if any(k in data for k in ("pendingRiders", "completedRiders", "failedRiders")):
+            self._convert_legacy(data)
+        return True
+
+    def _convert_legacy(self, data: Dict[str, Any]) -> None:
+        from bulk_writer import BulkWriter, set_op
+
+        with self._lock:
+            items = self._items()
+            ops = []
+            for key, status in (("pendingRiders", PENDING), ("completedRiders", COMPLETED), ("failedRiders", FAILED)):
+                for rider in data.get(key) or []:
+                    rider_id = rider_key(rider.get("riderId"))
+                    if rider_id:
+                        ops.append(set_op(items.document(rider_id), {**rider, "status": status, "attempts": int(status != PENDING)}))
+            BulkWriter(self.db, name="rider queue conversion", verbose=False).write(ops)
+            self._doc().set({"created": data.get("created") or datetime.now(), "total": len(ops)})
+        print(f"[INFO] rider queue: converted {len(ops)} riders to per-rider documents")
+
+    def initialize(self, riders: Iterable[Dict[str, Any]], date_id: Optional[str] = None) -> int:
+        """Replace the queue with `riders` (all pending). Returns the number queued."""
+        from bulk_writer import BulkWriter, delete_op, set_op
+
+        with self._lock:
+            items = self._items()
+            BulkWriter(self.db, name="rider queue reset", verbose=False).write(
+                delete_op(ref) for ref in items.list_documents()
+            )
+            now = datetime.now()
+            queued = {}
+            for rider in riders:
+                rider_id = rider_key(rider.get("riderId"))
+                if rider_id:
+                    queued[rider_id] = {
+                        "riderId": rider.get("riderId"),
+                        "name": rider.get("name", "Unknown"),
+                        "status": PENDING,
+                        "attempts": 0,
+                        "addedAt": now,
+                    }
+            BulkWriter(self.db, name="rider queue", verbose=False).write(
+                set_op(items.document(rider_id), item) for rider_id, item in queued.items()
+            )
+            self._doc().set({"created": now, "clubStatsDate": date_id, "total": len(queued)})
+            return len(queued)
+
+    def summary(self) -> Dict[str, Any]:
+        snap = self._doc().get()
+        return (snap.to_dict() or {}) if snap.exists else {}
+
+    def take_run_lease(self, owner: str, seconds: int = RIDER_QUEUE_LEASE_SECONDS) -> bool:
+        """Take or renew the run lease for `owner`; False while another run holds it."""
+        from firebase_admin import firestore
+
+        ref = self._doc()
+
+        @firestore.transactional
+        def _take(transaction):
+            snap = ref.get(transaction=transaction)
+            data = snap.to_dict() if snap.exists else {}
+            if float(data.get("runUntil") or 0) > time.time() and data.get("runOwner") != owner:
+                return False
+            transaction.set(ref, {"runOwner": owner, "runUntil": time.time() + seconds}, merge=True)
+            return True
+
+        return _take(self.db.transaction())
+
+    def release_run_lease(self, owner: str) -> None:
+        from firebase_admin import firestore
+
+        ref = self._doc()
+
+        @firestore.transactional
+        def _release(transaction):
+            snap = ref.get(transaction=transaction)
+            # The queue may have been cleared, or the lease taken over after it expired
+            if snap.exists and (snap.to_dict() or {}).get("runOwner") == owner:
+                transaction.set(ref, {"runOwner": None, "runUntil": 0}, merge=True)
+
+        _release(self.db.transaction())
+
+    def items(self, status: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        query = self._items().where("status", "==", status)
+        if limit:
+            query = query.limit(limit)
+        return [doc.to_dict() or {} for doc in query.stream()]
+
+    def mark(self, rider_id: Any, fields: Dict[str, Any]) -> None:
+        """Checkpoint one rider."""
+        self._items().document(rider_key(rider_id)).set(fields, merge=True)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {PENDING: 0, COMPLETED: 0, FAILED: 0}
+        for doc in self._items().select(["status"]).stream():
+            status = (doc.to_dict() or {}).get("status")
+            if status in counts:
+                counts[status] += 1
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def clear(self) -> None:
+        from bulk_writer import BulkWriter, delete_op
+
+        with self._lock:
+            BulkWriter(self.db, name="rider queue clear", verbose=False).write(
+                delete_op(ref) for ref in self._items().list_documents()
+            )
+            self._doc().delete()
+
+
+class RiderEnrichmentWorker:
+    """
+    Fetches racing scores for the pending riders of a RiderQueue.
+
+    Profiles are requested by `max_workers` threads sharing one token bucket
+    (`rps` requests per second, the process-wide ZWIFT_PROFILE_RPS bucket by
+    default); a 429 drains the bucket for the Retry-After period so every
+    thread backs off together. Each rider is checkpointed as soon as its
+    request finishes. Failed requests leave the rider pending until it has
+    been tried RIDER_QUEUE_MAX_ATTEMPTS times, and run() keeps going until no
+    rider is pending, so one invocation works the whole queue; an interrupted
+    run resumes from the pending riders. A run holds a lease on the queue
+    (renewed while it works); run() raises QueueBusy while another run
+    holds it, so overlapping cron calls and jobs never fetch the same riders.
+
+    on_result(outcome) is called for every rider; should_stop() is checked
+    before each request.
+    """
+
+    def __init__(self, zwift_api, queue: Optional[RiderQueue] = None,
+                 max_workers: int = ZWIFT_PROFILE_WORKERS, rps: Optional[float] = None,
+                 max_attempts: int = RIDER_QUEUE_MAX_ATTEMPTS,
+                 on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 should_stop: Optional[Callable[[], bool]] = None):
+        self.zwift_api = zwift_api
+        self.queue = queue or rider_queue
+        self.max_workers = max(1, int(max_workers))
+        if rps:
+            self.limiter = TokenBucket(rps, max(1, int(rps)))
+        else:
+            self.limiter = limiter_for(f"{zwift_api.api_host}/api/profiles", ZWIFT_PROFILE_RPS, max(1, int(ZWIFT_PROFILE_RPS)))
+        self.max_attempts = max(1, int(max_attempts))
+        self.on_result = on_result
+        self.should_stop = should_stop or (lambda: False)
+        self._stats_lock = threading.Lock()
+        self._lease_lost = threading.Event()
+
+    def _enrich(self, item: Dict[str, Any], stats: Dict[str, Any]) -> Dict[str, Any]:
+        rider_id = item.get("riderId")
+        outcome = {"riderId": rider_id, "name": item.get("name", "Unknown")}
+        if self.should_stop() or self._lease_lost.is_set():
+            return {**outcome, "status": "cancelled"}
+
+        self.limiter.acquire()
+        error = None
+        racing_score = None
+        try:
+            # 429s come straight back so the shared bucket, not per-thread backoff, paces the retry
+            profile = self.zwift_api.get_profile(rider_id, retry_rate_limited=False)
+            metrics = (profile or {}).get("competitionMetrics") or {}
+            if profile is None:
+                error = "Profile not found"
+            elif "racingScore" in metrics:
+                racing_score = metrics["racingScore"]
+            else:
+                error = "Racing score not found in profile"
+        except Exception as e:
+            response = getattr(e, "response", None)
+            if getattr(response, "status_code", None) == 429:
+                retry_after = response.headers.get("Retry-After")
+                try:
+                    pause = float(retry_after)
+                except (TypeError, ValueError):
+                    pause = _RATE_LIMIT_PAUSE_SECONDS
+                self.limiter.pause(pause)
+                with self._stats_lock:
+                    stats["rateLimited"] += 1
+                # Throttling says nothing about the rider: it stays pending and keeps its attempts
+                return {**outcome, "status": "retry", "error": str(e)}
+            attempts = int(item.get("attempts") or 0) + 1
+            status = FAILED if attempts >= self.max_attempts else PENDING
+            self.queue.mark(rider_id, {"status": status, "attempts": attempts, "error": str(e),
+                                       "processedAt": datetime.now()})
+            return {**outcome, "status": "retry" if status == PENDING else FAILED, "error": str(e)}
+
+        fields = {"attempts": int(item.get("attempts") or 0) + 1, "processedAt": datetime.now()}
+        if error:
+            # The profile answered; retrying will not produce a score
+            self.queue.mark(rider_id, {**fields, "status": FAILED, "error": error})
+            return {**outcome, "status": FAILED, "error": error}
+        self.queue.mark(rider_id, {**fields, "status": COMPLETED, "racingScore": racing_score, "error": None})
+        return {**outcome, "status": COMPLETED, "racingScore": racing_score}
+
+    def run(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Work the pending riders (at most `limit` requests). Returns run statistics."""
+        owner = uuid.uuid4().hex
+        self._lease_lost.clear()
+        if not self.queue.take_run_lease(owner):
+            raise QueueBusy("Another run is processing the rider queue")
+        try:
+            return self._run(owner, limit)
+        finally:
+            self.queue.release_run_lease(owner)
+
+    def _run(self, owner: str, limit: Optional[int]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        stats = {"processed": 0, "completed": 0, "failed": 0, "retried": 0, "rateLimited": 0,
+                 "cancelled": False, "leaseLost": False}
+        remaining = limit
+        renewed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while remaining is None or remaining > 0:
+                batch = self.queue.items(PENDING, limit=remaining)
+                if remaining is not None:
+                    batch = batch[:remaining]
+                if not batch:
+                    break
+                futures = [pool.submit(self._enrich, item, stats) for item in batch]
+                for future in as_completed(futures):
+                    outcome = future.result()
+                    status = outcome["status"]
+                    if status == "cancelled":
+                        stats["cancelled"] = not self._lease_lost.is_set()
+                        continue
+                    stats["processed"] += 1
+                    stats["retried" if status == "retry" else status] += 1
+                    if self.on_result:
+                        self.on_result(outcome)
+                    if time.monotonic() - renewed > RIDER_QUEUE_LEASE_SECONDS / 3:
+                        renewed = time.monotonic()
+                        if not self.queue.take_run_lease(owner):
+                            # Stalled past the lease and another run took over: stop fetching
+                            stats["leaseLost"] = True
+                            self._lease_lost.set()
+                if stats["cancelled"] or stats["leaseLost"]:
+                    break
+                if remaining is not None:
+                    remaining -= len(batch)
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        print(f"[INFO] rider enrichment: {stats['completed']} scored, {stats['failed']} failed, "
+              f"{stats['retried']} to retry in {stats['seconds']}s")
+        return stats
+
+
+# Process-wide queue used by the rider queue endpoints
+rider_queue = RiderQueue()
@@ -0,0 +1,374 @@
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from club_stats_store import club_stats_store, rider_key
+from firestore_client import LazyFirestoreClient
+
+# Compact per-day snapshots (one columnar document per club_stats day)
+SNAPSHOT_COLLECTION = "rider_category_days"
+# One document per rider per category change
+CHANGE_COLLECTION = "rider_category_changes"
+# Ingested dates
+STATE_DOC = ("rider_category_state", "current")
+# How far back the first sync reaches; older days can be ingested with sync(since=...)
+RIDER_HISTORY_BACKFILL_DAYS = int(os.getenv("RIDER_HISTORY_BACKFILL_DAYS", "30"))
+
+_DATE_ID = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# club_stats rider fields compact_rider() reads
+RIDER_FIELDS = ("riderId", "name", "zpCategory", "racingScore", "race")
+# club_stats header fields that change when a day is rewritten or patched
+VERSION_FIELDS = ["timestamp", "updatedAt"]
+
+# ZP category rankings
+zp_category_rank = {
+    'D': 1,
+    'C': 2,
+    'B': 3,
+    'A': 4,
+    'A+': 5,
+}
+
+# Racing score category rankings
+zrs_category_rank = {
+    'E': 1,  # 1-180
+    'D': 2,  # 180-350
+    'C': 3,  # 350-520
+    'B': 4,  # 520-690
+    'A': 5,  # 690-1000
+}
+
+def get_zrs_category(score: float) -> str:
+    """
+    Determine ZRS category based on racing score.
+
+    Args:
+        score: Racing score value
+
+    Returns:
+        Category letter (A, B, C, D, E)
+    """
+    if score >= 690:
+        return 'A'
+    elif score >= 520:
+        return 'B'
+    elif score >= 350:
+        return 'C'
+    elif score >= 180:
+        return 'D'
+    else:
+        return 'E'
+
+def is_zp_category(cat: Any) -> bool:
+    """
+    Check if a value is a valid ZP category.
+
+    Args:
+        cat: The value to check
+
+    Returns:
+        True if the value is a valid ZP category, False otherwise
+    """
+    return isinstance(cat, str) and cat in zp_category_rank
+
+
+# Columns of a compact snapshot, in document field order
+_COLUMNS = ("name", "zpCategory", "racingScore", "veloNumber", "veloCategory", "veloRating")
+
+
+def _is_number(v: Any) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def compact_rider(rider: Dict[str, Any]) -> Dict[str, Any]:
+    """The category-relevant fields of a club_stats rider entry."""
+    race = rider.get('race') or {}
+    current = (race.get('current') or {}) if isinstance(race, dict) else {}
+    mixed = current.get('mixed') if isinstance(current, dict) else None
+    mixed = mixed if isinstance(mixed, dict) else {}
+    return {
+        "name": rider.get('name', 'Unknown'),
+        "zpCategory": rider.get('zpCategory'),
+        "racingScore": rider.get('racingScore'),
+        "veloNumber": mixed.get('number'),
+        "veloCategory": mixed.get('category'),
+        "veloRating": mixed.get('rating'),
+    }
+
+
+def compact_riders(riders: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for r in riders or ():
+        if not isinstance(r, dict):
+            continue
+        rid = rider_key(r.get('riderId'))
+        if rid:
+            out[rid] = compact_rider(r)
+    return out
+
+
+def to_columns(date_id: str, records: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    ids = list(records)
+    doc = {"date": date_id, "riderIds": ids}
+    for col in _COLUMNS:
+        doc[col] = [records[rid].get(col) for rid in ids]
+    return doc
+
+
+def from_columns(doc: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    if not doc:
+        return {}
+    ids = doc.get("riderIds") or []
+    columns = [doc.get(col) or [None] * len(ids) for col in _COLUMNS]
+    return {rid: dict(zip(_COLUMNS, values)) for rid, *values in zip(ids, *columns)}
+
+
+def _velo(rec: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in (("number", rec.get("veloNumber")),
+                              ("category", rec.get("veloCategory")),
+                              ("rating", rec.get("veloRating"))) if v is not None}
+
+
+def diff_records(prev: Dict[str, Dict[str, Any]], cur: Dict[str, Dict[str, Any]], date_id: str) -> List[Dict[str, Any]]:
+    """
+    Category changes between two consecutive snapshots, for riders present
+    in both: ZP category, vELO category number and racing score category
+    (score changes within a category are not logged).
+    """
+    changes = []
+    for rid, now in cur.items():
+        before = prev.get(rid)
+        if not before:
+            continue
+
+        def _change(kind, frm, to, upgrade):
+            changes.append({"date": date_id, "riderId": rid, "name": now.get("name"),
+                            "kind": kind, "from": frm, "to": to, "upgrade": upgrade})
+
+        a, b = before.get("zpCategory"), now.get("zpCategory")
+        if is_zp_category(a) and is_zp_category(b) and a != b:
+            _change("zp", a, b, zp_category_rank[b] > zp_category_rank[a])
+
+        a, b = before.get("veloNumber"), now.get("veloNumber")
+        if _is_number(a) and _is_number(b) and a != b:
+            _change("velo", _velo(before), _velo(now), b < a)
+
+        a, b = before.get("racingScore"), now.get("racingScore")
+        if _is_number(a) and _is_number(b):
+            ca, cb = get_zrs_category(a), get_zrs_category(b)
+            if ca != cb:
+                _change("zrs", {"category": ca, "score": a}, {"category": cb, "score": b},
+                        zrs_category_rank[cb] > zrs_category_rank[ca])
+    return changes
+
+
+def day_version(header: Optional[Dict[str, Any]]) -> str:
+    """Version of a club_stats day as ingested; differs after the day is rewritten or patched."""
+    header = header or {}
+    return "|".join(str(header.get(f)) for f in VERSION_FIELDS)
+
+
+def _public_rider_id(rid: str) -> Any:
+    return int(rid) if rid.isdigit() else rid
+
+
+def _endpoint_value(kind: str, rec: Optional[Dict[str, Any]]) -> Any:
+    """A rider's value for one change kind in a snapshot, shaped like change from/to; None if unknown."""
+    if not rec:
+        return None
+    if kind == "zp":
+        return rec.get("zpCategory") if is_zp_category(rec.get("zpCategory")) else None
+    if kind == "velo":
+        return _velo(rec) if _is_number(rec.get("veloNumber")) else None
+    score = rec.get("racingScore")
+    return {"category": get_zrs_category(score), "score": score} if _is_number(score) else None
+
+
+def net_upgrades(changes: Iterable[Dict[str, Any]], allowed: Optional[set] = None,
+                 start: Optional[Dict[str, Dict[str, Any]]] = None,
+                 end: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Collapse a window of changes into per-rider net changes and keep the
+    upgrades, in the shape returned by firebase.compare_rider_categories.
+
+    With the window's `start`/`end` snapshots, from/to (including racing
+    score and vELO rating) are the riders' values on those two days;
+    without them they come from the first and last change in the window.
+    """
+    first_last: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for change in sorted(changes, key=lambda c: c["date"]):
+        if allowed is not None and change["riderId"] not in allowed:
+            continue
+        key = (change["riderId"], change["kind"])
+        if key in first_last:
+            first_last[key][1] = change
+        else:
+            first_last[key] = [change, change]
+
+    out = {"upgradedZPCategory": [], "upgradedZwiftRacingCategory": [], "upgradedZRSCategory": []}
+    for (rid, kind), (first, last) in first_last.items():
+        frm, to = first["from"], last["to"]
+        if start is not None and end is not None:
+            frm = _endpoint_value(kind, start.get(rid)) or frm
+            to = _endpoint_value(kind, end.get(rid)) or to
+        if kind == "zp":
+            section, upgraded = "upgradedZPCategory", zp_category_rank[to] > zp_category_rank[frm]
+        elif kind == "velo":
+            section, upgraded = "upgradedZwiftRacingCategory", to.get("number") < frm.get("number")
+        else:
+            section, upgraded = "upgradedZRSCategory", zrs_category_rank[to["category"]] > zrs_category_rank[frm["category"]]
+        if upgraded:
+            out[section].append({"riderId": _public_rider_id(rid), "name": last.get("name"), "from": frm, "to": to})
+    return out
+
+
+class RiderCategoryHistory(LazyFirestoreClient):
+    """
+    Rider category history derived from the daily `club_stats` snapshots.
+
+    Each club_stats day is ingested into a compact columnar snapshot
+    (`rider_category_days/{date}`: riderIds plus one array per field) and the
+    category changes against the previous ingested day are stored as
+    individual `rider_category_changes` documents. Upgrades between two dates
+    and per-rider timelines are then answered from the change log (with
+    from/to values taken from the two dates' snapshots).
+
+    `sync()` ingests club_stats days not seen yet and re-ingests days whose
+    header (timestamp/updatedAt) changed since they were ingested;
+    `ingest(date, riders)` (re)ingests one day, e.g. after its racing scores
+    were patched.
+    """
+
+    def __init__(self, db=None, backfill_days: int = RIDER_HISTORY_BACKFILL_DAYS):
+        self._db = db
+        self.backfill_days = backfill_days
+        self._lock = threading.RLock()
+
+    def _state_ref(self):
+        collection, doc_id = STATE_DOC
+        return self.db.collection(collection).document(doc_id)
+
+    def _state(self) -> Dict[str, Any]:
+        snap = self._state_ref().get()
+        return (snap.to_dict() or {}) if snap.exists else {}
+
+    def ingested_dates(self) -> List[str]:
+        return sorted(self._state().get("dates") or [])
+
+    def _snapshot(self, date_id: str) -> Dict[str, Dict[str, Any]]:
+        snap = self.db.collection(SNAPSHOT_COLLECTION).document(date_id).get()
+        return from_columns(snap.to_dict() if snap.exists else None)
+
+    def _change_ops(self, date_id: str, changes: List[Dict[str, Any]]):
+        """Ops replacing the stored changes of `date_id` with `changes`."""
+        from bulk_writer import delete_op, set_op
+
+        col = self.db.collection(CHANGE_COLLECTION)
+        keep = {f"{date_id}_{c['riderId']}_{c['kind']}" for c in changes}
+        ops = [delete_op(doc.reference) for doc in col.where("date", "==", date_id).stream() if doc.id not in keep]
+        ops.extend(set_op(col.document(f"{date_id}_{c['riderId']}_{c['kind']}"), c) for c in changes)
+        return ops
+
+    def ingest(self, date_id: str, riders: Iterable[Any], version: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Store the compact snapshot of one club_stats day and its changes
+        against the previous day. `version` (day_version of the day's header)
+        lets sync() notice later rewrites; without it the next sync re-reads the day.
+        """
+        from bulk_writer import BulkWriter, set_op
+
+        with self._lock:
+            state = self._state()
+            dates = sorted(state.get("dates") or [])
+            versions = dict(state.get("versions") or {})
+            records = compact_riders(riders)
+            earlier = [d for d in dates if d < date_id]
+            later = [d for d in dates if d > date_id]
+
+            changes = diff_records(self._snapshot(earlier[-1]), records, date_id) if earlier else []
+            ops = [set_op(self.db.collection(SNAPSHOT_COLLECTION).document(date_id), to_columns(date_id, records))]
+            ops.extend(self._change_ops(date_id, changes))
+            if later:
+                # The following day was diffed against another snapshot; redo it against this one
+                ops.extend(self._change_ops(later[0], diff_records(records, self._snapshot(later[0]), later[0])))
+            BulkWriter(self.db, name="rider history", verbose=False).write(ops)
+
+            if version is None:
+                versions.pop(date_id, None)
+            else:
+                versions[date_id] = version
+            self._state_ref().set({
+                "dates": sorted(set(dates) | {date_id}),
+                "versions": versions,
+                "updatedAt": datetime.now(timezone.utc).isoformat(),
+            })
+            return {"date": date_id, "riders": len(records), "changes": len(changes)}
+
+    def sync(self, since: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Ingest club_stats days not ingested yet, and re-ingest days whose
+        header changed since, oldest first. Only days on or after `since`
+        (default: the first ingested day, or backfill_days ago on the first
+        run) are considered.
+        """
+        with self._lock:
+            state = self._state()
+            dates = sorted(state.get("dates") or [])
+            versions = state.get("versions") or {}
+            if since is None:
+                since = dates[0] if dates else (date.today() - timedelta(days=self.backfill_days)).isoformat()
+            done = set(dates)
+            # Header projections only; riders are downloaded just for new or changed days
+            pending = sorted(
+                (doc.id, day_version(doc.to_dict()))
+                for doc in self.db.collection("club_stats").select(VERSION_FIELDS).stream()
+                if _DATE_ID.match(doc.id) and doc.id >= since
+            )
+            ingested = []
+            for date_id, version in pending:
+                if date_id in done and versions.get(date_id) == version:
+                    continue
+                riders = club_stats_store.riders(date_id, fields=RIDER_FIELDS)
+                if riders is None:
+                    continue
+                ingested.append(self.ingest(date_id, riders, version=version))
+            if ingested:
+                print(f"[INFO] rider history: ingested {len(ingested)} club_stats day(s)")
+            return {"ingested": ingested}
+
+    def changes_between(self, start_id: str, end_id: str) -> List[Dict[str, Any]]:
+        """Changes with start_id < date <= end_id."""
+        query = self.db.collection(CHANGE_COLLECTION)\
+            .where("date", ">", start_id)\
+            .where("date", "<=", end_id)
+        return [doc.to_dict() for doc in query.stream()]
+
+    def upgrades_between(self, start_id: str, end_id: str,
+                         allowed_rider_ids: Optional[Iterable[Any]] = None) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+        """
+        Net upgrades from the snapshot of start_id to that of end_id, or None
+        when either day has not been ingested.
+        """
+        dates = set(self.ingested_dates())
+        if start_id not in dates or end_id not in dates:
+            return None
+        allowed = None
+        if allowed_rider_ids:
+            allowed = {str(r).strip() for r in allowed_rider_ids if str(r).strip()}
+        return net_upgrades(self.changes_between(start_id, end_id), allowed,
+                            start=self._snapshot(start_id), end=self._snapshot(end_id))
+
+    def timeline(self, rider_id: Any) -> Dict[str, Any]:
+        """All logged category changes of one rider, oldest first, plus the latest snapshot values."""
+        rid = rider_key(rider_id)
+        changes = [doc.to_dict() for doc in self.db.collection(CHANGE_COLLECTION).where("riderId", "==", rid).stream()]
+        changes.sort(key=lambda c: (c["date"], c["kind"]))
+        dates = self.ingested_dates()
+        current = self._snapshot(dates[-1]).get(rid) if dates else None
+        return {"riderId": _public_rider_id(rid), "current": current, "asOf": dates[-1] if dates else None, "changes": changes}
+
+
+# Process-wide history used by the upgrade endpoints
+rider_history = RiderCategoryHistory()
@@ -1,24 +1,47 @@
+import os
 import requests
 import backoff
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
+
+from ratelimit import limiter_for
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('ZwiftAPI')
 
+# Keep-alive connections kept per host; size it to the number of threads sharing one ZwiftAPI
+ZWIFT_POOL_SIZE = int(os.getenv("ZWIFT_POOL_SIZE", "16"))
+
+# Club roster paging: concurrent page requests and the request budget they share
+ZWIFT_ROSTER_WORKERS = int(os.getenv("ZWIFT_ROSTER_WORKERS", "4"))
+ZWIFT_ROSTER_RPS = float(os.getenv("ZWIFT_ROSTER_RPS", "4"))
+
 class ZwiftAPI:
-    def __init__(self, username, password, client_id='Zwift Game Client'):
+    def __init__(self, username, password, client_id='Zwift Game Client', pool_size=None):
         self.username = username
         self.password = password
         self.client_id = client_id
         self.host = 'https://secure.zwift.com'
+        self.api_host = 'https://us-or-rly101.zwift.com'
         self.token_url = f'{self.host}/auth/realms/zwift/protocol/openid-connect/token'
         self.auth_token = None
         self.refresh_token = None
         self.token_expiry_time = 0
+        # One pooled session for all calls: TCP/TLS connections are reused across
+        # requests and across the Flask threads sharing the cached instance.
+        pool_size = pool_size or ZWIFT_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Serializes authenticate/refresh so concurrent callers trigger a single refresh
+        self._token_lock = threading.RLock()
     
     def authenticate(self):
         data = {
@@ -27,7 +50,7 @@ class ZwiftAPI:
             'username': self.username,
             'password': self.password
         }
-        response = requests.post(self.token_url, data=data)
+        response = self.session.post(self.token_url, data=data, timeout=20)
         if response.status_code == 200:
             self.auth_token = response.json()
             logger.info("Authenticated successfully.")
@@ -48,7 +71,7 @@ class ZwiftAPI:
             'grant_type': 'refresh_token',
             'refresh_token': self.refresh_token
         }
-        response = requests.post(self.token_url, data=data)
+        response = self.session.post(self.token_url, data=data, timeout=20)
         if response.status_code == 200:
             self.auth_token = response.json()
             logger.info("Token refreshed successfully.")
@@ -62,30 +85,52 @@ class ZwiftAPI:
             self.authenticate()
     
     def ensure_valid_token(self):
-        """Ensure the token is valid, refresh if needed."""
+        """
+        Ensure the token is valid, refresh if needed.
+
+        Thread-safe and single-flight: when several threads find the token
+        expired at once, one refreshes while the others wait and reuse it.
+        """
+        if self.is_authenticated() and time.time() < self.token_expiry_time:
+            return
+        with self._token_lock:
+            # Re-check: another thread may have refreshed while we waited.
+            if not self.is_authenticated():
+                logger.info("Not authenticated. Authenticating now.")
+                self.authenticate()
+            elif time.time() >= self.token_expiry_time:
+                logger.info("Token expired or about to expire. Refreshing...")
+                self.refresh_auth_token()
+
+    def _auth_headers(self):
         if not self.is_authenticated():
-            logger.info("Not authenticated. Authenticating now.")
-            self.authenticate()
-        elif time.time() >= self.token_expiry_time:
-            logger.info("Token expired or about to expire. Refreshing...")
-            self.refresh_auth_token()
+            raise Exception("Not authenticated. Please authenticate first.")
+        if time.time() >= self.token_expiry_time:
+            self.ensure_valid_token()
+        return {'Authorization': f"Bearer {self.auth_token['access_token']}"}
     
     def is_authenticated(self):
         return self.auth_token is not None and 'access_token' in self.auth_token
     
-    def fetch_json_with_retry(self, url, headers, params):
+    def fetch_json_with_retry(self, url, headers, params, retry_rate_limited=True):
         """Fetch JSON data with retries and tolerant parsing.
         - Ensures Accept/User-Agent headers are present
         - Handles 204/empty body
         - Validates content-type before parsing JSON
+        - With retry_rate_limited=False a 429 is raised at once, for callers
+          that pace themselves with a shared rate limiter
         """
         req_headers = dict(headers or {})
         req_headers.setdefault('Accept', 'application/json, text/plain, */*')
         req_headers.setdefault('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)')
 
-        @backoff.on_exception(backoff.expo, (RequestException, ValueError), max_tries=5)
+        def _rate_limited(e):
+            response = getattr(e, 'response', None)
+            return not retry_rate_limited and response is not None and response.status_code == 429
+
+        @backoff.on_exception(backoff.expo, (RequestException, ValueError), max_tries=5, giveup=_rate_limited)
         def _fetch():
-            response = requests.get(url, headers=req_headers, params=params, timeout=20)
+            response = self.session.get(url, headers=req_headers, params=params, timeout=20)
             response.raise_for_status()
 
             # Handle no content / empty body
@@ -105,97 +150,157 @@ class ZwiftAPI:
 
         return _fetch()
             
-    def get_profile(self, id):
-        if not self.is_authenticated():
-            raise Exception("Not authenticated. Please authenticate first.")
-        
-        headers = {
-            'Authorization': f"Bearer {self.auth_token['access_token']}"
-        }
-  
+    def get_profile(self, id, retry_rate_limited=True):
+        headers = self._auth_headers()
+
         # Avoid double slash and use tolerant fetcher
-        url = f'https://us-or-rly101.zwift.com/api/profiles/{id}'
+        url = f'{self.api_host}/api/profiles/{id}'
         try:
-            data = self.fetch_json_with_retry(url, headers=headers, params=None)
+            data = self.fetch_json_with_retry(url, headers=headers, params=None,
+                                              retry_rate_limited=retry_rate_limited)
             return data or {}
         except requests.HTTPError as e:
             if getattr(e, 'response', None) is not None and e.response.status_code == 404:
                 return None
             raise
 
-    def get_club_roster(
+    @staticmethod
+    def _roster_rows(data: Any) -> List[Dict[str, Any]]:
+        # Response shape can be a list or a wrapper dict depending on backend version.
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            return (
+                data.get("roster")
+                or data.get("members")
+                or data.get("items")
+                or data.get("results")
+                or []
+            )
+        return []
+
+    @staticmethod
+    def _roster_member_id(member: Dict[str, Any]) -> Any:
+        membership = (member or {}).get("membership") or {}
+        return membership.get("profileId") or (member or {}).get("id")
+
+    def _fetch_roster_page(self, url: str, headers: Dict[str, str], limit: int, start: int) -> List[Dict[str, Any]]:
+        limiter_for(self.api_host, ZWIFT_ROSTER_RPS).acquire()
+        params: Dict[str, Any] = {"limit": int(limit)}
+        if start:
+            params["start"] = int(start)
+        return self._roster_rows(self.fetch_json_with_retry(url, headers=headers, params=params))
+
+    def iter_club_roster_pages(
         self,
         club_id: str,
         limit: int = 100,
         start: int = 0,
         paginate: bool = True,
         max_pages: int = 50,
-    ) -> List[Dict[str, Any]]:
+        max_workers: Optional[int] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
         """
-        Fetch club roster (members) for a given club.
+        Yield the club roster page by page, in roster order, as pages arrive.
 
-        Endpoint pattern:
-          /api/clubs/club/{club_id}/roster?limit=100
+        The first two pages are fetched one after another. If the second page
+        holds new members the backend honours `start`, and the remaining pages
+        are requested concurrently (up to `max_workers` in flight), all sharing
+        one token bucket per API host (ZWIFT_ROSTER_RPS). If the backend
+        ignores `start` and returns the first page again, paging stops there.
 
-        Some Zwift deployments paginate with `start`; some ignore it. We handle both.
+        Members are de-duplicated by profileId across pages; the roster ends
+        at the first short or empty page (or after `max_pages`).
         """
-        if not self.is_authenticated():
-            raise Exception("Not authenticated. Please authenticate first.")
-
-        headers = {
-            "Authorization": f"Bearer {self.auth_token['access_token']}",
-            "Accept": "application/json",
-        }
-
-        url = f"https://us-or-rly101.zwift.com/api/clubs/club/{club_id}/roster"
-
-        all_rows: List[Dict[str, Any]] = []
-        cur_start = int(start)
-        pages = 0
+        headers = self._auth_headers()
+        headers["Accept"] = "application/json"
 
-        while True:
-            params: Dict[str, Any] = {"limit": int(limit)}
-            if cur_start:
-                params["start"] = cur_start
+        url = f"{self.api_host}/api/clubs/club/{club_id}/roster"
+        limit = int(limit)
+        max_pages = int(max_pages)
+        seen = set()
 
-            data = self.fetch_json_with_retry(url, headers=headers, params=params)
+        def _new_rows(rows):
+            out = []
+            for row in rows:
+                member_id = self._roster_member_id(row)
+                if member_id is not None:
+                    if member_id in seen:
+                        continue
+                    seen.add(member_id)
+                out.append(row)
+            return out
 
-            # Response shape can be a list or a wrapper dict depending on backend version.
-            if isinstance(data, list):
-                rows = data
-            elif isinstance(data, dict):
-                rows = (
-                    data.get("roster")
-                    or data.get("members")
-                    or data.get("items")
-                    or data.get("results")
-                    or []
-                )
-            else:
-                rows = []
+        first = self._fetch_roster_page(url, headers, limit, start)
+        page = _new_rows(first)
+        if page:
+            yield page
+        if not paginate or len(first) < limit or max_pages <= 1:
+            return
 
-            if rows:
-                all_rows.extend(rows)
+        second = self._fetch_roster_page(url, headers, limit, start + len(first))
+        page = _new_rows(second)
+        if not page:
+            # `start` is ignored (same members again) or the roster ended exactly at one page.
+            return
+        yield page
+        if len(second) < limit or max_pages <= 2:
+            return
 
-            pages += 1
+        # `start` is honoured: fetch the remaining pages concurrently, yielding in order.
+        workers = max(1, max_workers or ZWIFT_ROSTER_WORKERS)
+        next_start = start + len(first) + len(second)
+        next_page = 2
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zwift-roster") as pool:
+            in_flight = []
+            done = False
+            while not done:
+                while len(in_flight) < workers and next_page < max_pages:
+                    in_flight.append(pool.submit(self._fetch_roster_page, url, headers, limit, next_start))
+                    next_start += limit
+                    next_page += 1
+                if not in_flight:
+                    break
+                rows = in_flight.pop(0).result()
+                page = _new_rows(rows)
+                if page:
+                    yield page
+                if len(rows) < limit:
+                    # End of roster; pages already requested past it come back empty.
+                    done = True
+            for future in in_flight:
+                future.cancel()
 
-            if not paginate:
-                break
-
-            # Stop when we get fewer than `limit` back (or no rows).
-            if not rows or len(rows) < int(limit):
-                break
-
-            if pages >= int(max_pages):
-                break
-
-            cur_start += len(rows)
+    def get_club_roster(
+        self,
+        club_id: str,
+        limit: int = 100,
+        start: int = 0,
+        paginate: bool = True,
+        max_pages: int = 50,
+        max_workers: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Fetch club roster (members) for a given club.
 
-            # Be nice to the API.
-            time.sleep(0.5)
+        Endpoint pattern:
+          /api/clubs/club/{club_id}/roster?limit=100
 
+        Some Zwift deployments paginate with `start`; some ignore it. We handle both
+        (see iter_club_roster_pages).
+        """
+        all_rows: List[Dict[str, Any]] = []
+        for page in self.iter_club_roster_pages(
+            club_id, limit=limit, start=start, paginate=paginate, max_pages=max_pages, max_workers=max_workers
+        ):
+            all_rows.extend(page)
         return all_rows
 
+    def iter_simplified_club_roster(self, club_id: str, **kwargs) -> Iterator[List[Dict[str, Any]]]:
+        """Streaming variant of simplify_club_roster(get_club_roster(...)): one list per page."""
+        for page in self.iter_club_roster_pages(club_id, **kwargs):
+            yield self.simplify_club_roster(page)
+
     @staticmethod
     def simplify_club_roster(roster: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
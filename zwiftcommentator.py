@@ -1,16 +1,358 @@
-import openai
+import os
 import json
+import time
+import hashlib
+import tempfile
+import threading
 import requests
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
 from openai import OpenAI
-import firebase as fb
+from identity_index import identity_index
 import re
 
+# "(ZwiftID: 12345)" markers the prompt asks the model to put after rider names
+_ZWIFT_ID_MARKER = re.compile(r"\(ZwiftID:\s*([^)]+)\)", re.IGNORECASE)
+
+# Overall time allowed for one generation before the template summary is used
+COMMENTARY_BUDGET_SECONDS = float(os.getenv("COMMENTARY_BUDGET_SECONDS", "45"))
+
+# Longest list of riders/events sent to the model per section
+COMMENTARY_MAX_ITEMS = int(os.getenv("COMMENTARY_MAX_ITEMS", "10"))
+
+# Fields of analyze_team_results() the commentary prompt talks about, per section
+_COMMENTARY_FIELDS = {
+    "top_10_by_zid": ("title", "rider_count"),
+    "top_10_by_title": ("event_name", "participant_count"),
+    "most_events_riders": ("name", "zwid", "events_count"),
+    "most_top_3_riders": ("name", "zwid", "top_3_count"),
+    "winners": ("name", "zwid", "event_title"),
+    "top_watts_per_kg_20min": ("name", "zwid", "wkg1200", "event_title", "position_in_cat"),
+    "top_watts_per_kg_5min": ("name", "zwid", "wkg300", "event_title", "position_in_cat"),
+    "top_watts_per_kg_1min": ("name", "zwid", "wkg60", "event_title", "position_in_cat"),
+}
+
+
+def compact_json(data: Any) -> str:
+    """JSON without indentation or padding; keeps non-ASCII rider names as-is."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _project(items: Any, fields, max_items: int) -> List[Dict[str, Any]]:
+    if not isinstance(items, list):
+        return []
+    out = []
+    for item in items[:max_items]:
+        if isinstance(item, dict):
+            out.append({k: item[k] for k in fields if item.get(k) is not None})
+    return out
+
+
+def compact_commentary_data(data: dict, max_items: int = COMMENTARY_MAX_ITEMS) -> dict:
+    """
+    Reduce an analyze_team_results() summary to what the commentary prompt
+    uses: participant lists of top_10_by_zid are dropped and every section is
+    capped at `max_items` entries.
+    """
+    return {
+        section: _project((data or {}).get(section), fields, max_items)
+        for section, fields in _COMMENTARY_FIELDS.items()
+    }
+
+
+def _category(value: Any) -> Any:
+    # vELO "mixed" blocks carry ratings and history; the prompt only needs the category
+    if isinstance(value, dict):
+        return {k: value[k] for k in ("category", "number", "score") if value.get(k) is not None}
+    return value
+
+
+def compact_upgrade_data(data: dict, max_items: int = 25) -> dict:
+    """Reduce compare_rider_categories() output to rider, name and from/to category per upgrade list."""
+    out = {}
+    for section in ("upgradedZPCategory", "upgradedZwiftRacingCategory", "upgradedZRSCategory"):
+        items = (data or {}).get(section)
+        out[section] = [
+            {"riderId": u.get("riderId"), "name": u.get("name"), "from": _category(u.get("from")), "to": _category(u.get("to"))}
+            for u in (items if isinstance(items, list) else [])[:max_items]
+            if isinstance(u, dict)
+        ]
+    return out
+
+
+def _rider(item: Dict[str, Any], id_field: str = "zwid") -> str:
+    rider_id = item.get(id_field)
+    return f"**{item.get('name') or 'Ukendt'}** (ZwiftID: {rider_id})" if rider_id is not None else f"**{item.get('name') or 'Ukendt'}**"
+
+
+def render_commentary_summary(data: dict, max_items: int = 5) -> str:
+    """Deterministic weekly summary from analyze_team_results() output, used when the model is too slow."""
+    data = compact_commentary_data(data, max_items)
+    lines = ["🚴 **DZR – ugens resultater**"]
+
+    if data["winners"]:
+        lines.append("")
+        lines.append("🏆 **Sejre**")
+        lines.extend(f"- {_rider(w)} vandt {w.get('event_title') or 'et løb'}" for w in data["winners"])
+
+    if data["most_top_3_riders"]:
+        lines.append("")
+        lines.append("🥉 **Flest top 3-placeringer**")
+        lines.extend(f"- {_rider(r)}: {r.get('top_3_count')}" for r in data["most_top_3_riders"])
+
+    if data["top_10_by_title"]:
+        lines.append("")
+        lines.append("👥 **Flest DZR-ryttere**")
+        lines.extend(f"- {e.get('event_name')}: {e.get('participant_count')} ryttere" for e in data["top_10_by_title"])
+
+    for section, field, label in (
+        ("top_watts_per_kg_20min", "wkg1200", "20 min"),
+        ("top_watts_per_kg_5min", "wkg300", "5 min"),
+        ("top_watts_per_kg_1min", "wkg60", "1 min"),
+    ):
+        if data[section]:
+            lines.append("")
+            lines.append(f"⚡ **Højeste W/kg – {label}**")
+            lines.extend(f"- {_rider(r)}: {r.get(field)} W/kg" for r in data[section])
+
+    if data["most_events_riders"]:
+        lines.append("")
+        lines.append("🔁 **Mest aktive**")
+        lines.extend(f"- {_rider(r)}: {r.get('events_count')} løb" for r in data["most_events_riders"])
+
+    lines.append("")
+    lines.append("DZR leverer – uge efter uge. Vi ses på rullerne!")
+    return "\n".join(lines)
+
+
+def _category_label(value: Any) -> str:
+    if isinstance(value, dict):
+        return str(value.get("category") or value.get("number") or "?")
+    return str(value)
+
+
+def render_upgrade_summary(data: dict, max_items: int = 25) -> str:
+    """Deterministic list of today's upgrades, used when the model is too slow."""
+    data = compact_upgrade_data(data, max_items)
+    lines = ["🚴 **Dagens opgraderinger i DZR**"]
+    for section, label in (
+        ("upgradedZPCategory", "ZwiftPower-kategori"),
+        ("upgradedZwiftRacingCategory", "Zwift Racing"),
+        ("upgradedZRSCategory", "Racing Score"),
+    ):
+        if data[section]:
+            lines.append("")
+            lines.append(f"**{label}**")
+            lines.extend(
+                f"- {_rider(u, 'riderId')}: {_category_label(u.get('from'))} → {_category_label(u.get('to'))}"
+                for u in data[section]
+            )
+    lines.append("")
+    lines.append("DZR — fordi vi altid leder efter den næste lille bevægelse fremad.")
+    return "\n".join(lines)
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of generated texts, keyed by a hash of the
+    model, messages and sampling parameters. A retry after a failed Discord
+    post (same data, same prompt) gets the text generated the first time.
+
+    Environment:
+      - COMMENTARY_CACHE_DIR: cache directory (default: <tmp>/commentary_cache)
+      - COMMENTARY_CACHE_TTL_SECONDS: entry lifetime (default: 86400, 0 disables the cache)
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl_seconds: Optional[int] = None):
+        self.cache_dir = (
+            cache_dir
+            or os.getenv("COMMENTARY_CACHE_DIR")
+            or os.path.join(tempfile.gettempdir(), "commentary_cache")
+        )
+        if ttl_seconds is None:
+            ttl_seconds = int(os.getenv("COMMENTARY_CACHE_TTL_SECONDS", "86400"))
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], **params: Any) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        if self.ttl_seconds <= 0:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - float(entry.get("createdAt", 0)) >= self.ttl_seconds:
+            return None
+        return entry.get("text")
+
+    def put(self, key: str, text: str, model: str) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"text": text, "model": model, "createdAt": time.time()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"[WARN] Could not cache commentary: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+class StubChatClient:
+    """
+    Offline stand-in for the OpenAI client (chat.completions.create only) for
+    tests and benchmarks. Answers after `latency` seconds with a fixed text
+    that mentions the first rider ids found in the prompt; with stream=True
+    the text arrives word by word, `chunk_latency` seconds apart.
+    """
+
+    def __init__(self, latency: float = 0.0, text: str = "Stub-kommentar", chunk_latency: float = 0.0):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.text = text
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, str]], stream: bool = False, **kwargs: Any):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        rider_ids = re.findall(r'"(?:zwid|riderId)":(\d+)', prompt)[:3]
+        content = self.text + "".join(f"\nRytter (ZwiftID: {rider_id})" for rider_id in rider_ids)
+        if stream:
+            return self._chunks(content)
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def _chunks(self, content: str):
+        for i, word in enumerate(content.split(" ")):
+            if i and self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            delta = SimpleNamespace(content=word if i == 0 else " " + word)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def client_from_env(api_key: Optional[str]):
+    """COMMENTARY_CLIENT: "openai" (default) or "stub" for offline runs."""
+    if os.getenv("COMMENTARY_CLIENT", "openai").strip().lower() == "stub":
+        return StubChatClient(latency=float(os.getenv("COMMENTARY_STUB_LATENCY", "0")))
+    return OpenAI(api_key=api_key)
+
+
 class ZwiftCommentator:
-    def __init__(self, api_key: str, model: str = "gpt-4o"):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o", client=None,
+                 cache: Optional[ResponseCache] = None):
+        # Any object with the OpenAI chat.completions.create interface works as `client`
+        self.client = client if client is not None else client_from_env(api_key)
         self.model = model
+        self.cache = cache if cache is not None else ResponseCache()
+        self.last_generation: Dict[str, Any] = {}
 
-    def generate_commentary(self, data: dict) -> str:
+    def _stream(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                budget: float, timing: Dict[str, Any], started: float) -> Optional[str]:
+        """
+        Stream a completion on a worker thread and wait at most `budget`
+        seconds for it. Returns the text, or None when the budget ran out
+        (the worker stops reading at its next chunk).
+        """
+        parts: List[str] = []
+        outcome: Dict[str, Any] = {}
+        done = threading.Event()
+        abandoned = threading.Event()
+
+        def _consume():
+            try:
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    timeout=budget,
+                )
+                try:
+                    for chunk in stream:
+                        if abandoned.is_set():
+                            break
+                        choices = getattr(chunk, "choices", None) or []
+                        delta = getattr(choices[0], "delta", None) if choices else None
+                        content = getattr(delta, "content", None)
+                        if content:
+                            if "ttftSeconds" not in timing:
+                                timing["ttftSeconds"] = round(time.perf_counter() - started, 3)
+                            parts.append(content)
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        close()
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        threading.Thread(target=_consume, name="commentary-stream", daemon=True).start()
+        if not done.wait(budget):
+            abandoned.set()
+            return None
+        if "error" in outcome:
+            if time.perf_counter() - started >= budget:
+                # Read timeout of the last chunk: same as running out of budget
+                return None
+            raise outcome["error"]
+        return "".join(parts)
+
+    def _complete(self, system: str, prompt: str, temperature: float, max_tokens: int,
+                  fallback: Callable[[], str], budget_seconds: Optional[float] = None) -> str:
+        """
+        Generate a completion within `budget_seconds` (COMMENTARY_BUDGET_SECONDS
+        by default). Cached texts are returned immediately; when the model is
+        too slow the `fallback()` text is returned instead (and not cached).
+        Timings end up in `last_generation`.
+        """
+        budget = COMMENTARY_BUDGET_SECONDS if budget_seconds is None else float(budget_seconds)
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ]
+        key = ResponseCache.key(self.model, messages, temperature=temperature, max_tokens=max_tokens)
+        started = time.perf_counter()
+        timing: Dict[str, Any] = {}
+        text = self.cache.get(key)
+        cached = text is not None
+        used_fallback = False
+        if not cached:
+            text = self._stream(messages, temperature, max_tokens, budget, timing, started)
+            if text:
+                self.cache.put(key, text, self.model)
+            else:
+                print(f"[WARN] Commentary not generated within {budget:g}s; using template summary")
+                text = fallback()
+                used_fallback = True
+        self.last_generation = {
+            "cached": cached,
+            "fallback": used_fallback,
+            "key": key,
+            "promptChars": len(prompt),
+            "ttftSeconds": timing.get("ttftSeconds"),
+            "seconds": round(time.perf_counter() - started, 3),
+            "budgetSeconds": budget,
+        }
+        return text
+
+    def generate_commentary(self, data: dict, budget_seconds: Optional[float] = None) -> str:
         prompt = f"""
     Du er en dansk sports-kommentator, der dækker Zwift-løb for klubben DZR.
 
@@ -56,24 +398,21 @@ top_watts_per_kg_1min: top riders by 1-minute power
 
 Data:
 
-{json.dumps(data, ensure_ascii=False, indent=2)}
+{compact_json(compact_commentary_data(data))}
 
 Kommentar:
 """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "Du er en passioneret dansk cykelsportskommentator."},
-                {"role": "user", "content": prompt}
-            ],
+        return self._complete(
+            "Du er en passioneret dansk cykelsportskommentator.",
+            prompt,
             temperature=0.9,
-            max_tokens=1000
+            max_tokens=1000,
+            fallback=lambda: render_commentary_summary(data),
+            budget_seconds=budget_seconds,
         )
-
-        return response.choices[0].message.content
     
-    def generate_upgrade_comment(self, data: dict) -> str:
+    def generate_upgrade_comment(self, data: dict, budget_seconds: Optional[float] = None) -> str:
         prompt = f"""
     Du er Jørgen Leth – cykelkommentator, poet og filmskaber.
 
@@ -97,27 +436,25 @@ Stil
 
     Data:
 
-    {json.dumps(data, ensure_ascii=False, indent=2)}
+    {compact_json(compact_upgrade_data(data))}
 
     Kommentar:
     """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "Du er Jørgen Leth. Du kommenterer DZR‑opgraderinger med hans rolige, poetiske "
-                    "fortællestemme og underspillede humor."},
-                {"role": "user", "content": prompt}
-            ],
+        return self._complete(
+            "Du er Jørgen Leth. Du kommenterer DZR‑opgraderinger med hans rolige, poetiske "
+            "fortællestemme og underspillede humor.",
+            prompt,
             temperature=0.9,
-            max_tokens=750
+            max_tokens=750,
+            fallback=lambda: render_upgrade_summary(data),
+            budget_seconds=budget_seconds,
         )
-
-        return response.choices[0].message.content
     
     def tag_discord_users(self, message: str) -> str:
         """
-        Replace rider names in a message with Discord mentions based on their ZwiftIDs.
+        Replace "(ZwiftID: <id>)" markers in a message with Discord mentions.
+        Markers for riders without a linked Discord account are removed.
         
         Args:
             message (str): The original message text with rider names
@@ -126,32 +463,15 @@ Stil
             str: Modified message with Discord mentions
         """
 
-        # Get users from Firebase
-        # Use a high limit to ensure we get all users (default is only 100)
-        users = fb.get_collection("users", limit=10000)
-         
-        # Create a lookup dictionary of ZwiftIDs to Discord IDs
-        zwiftid_to_discord = {}
-        for user in users:
-            if "zwiftId" in user and "discordId" in user:
-                # Store the mapping from ZwiftID to Discord ID
-                zwiftid_to_discord[user["zwiftId"]] = user["discordId"]
-        
-        # Replace names with Discord mentions in the message
-        modified_message = message
-        
-        # Replace (ZwiftID: <ZwiftID>) with Discord mentions in the message
-        for zwiftid,discord_id in zwiftid_to_discord.items():
-            
-            pattern = '(ZwiftID: ' + zwiftid + ')'
-            
-            # Replace with Discord mention format: <@DISCORD_ID>
-            modified_message = re.sub(pattern, f"<@{discord_id}>", modified_message, flags=re.IGNORECASE)
-        
-        # Remove any remaining (ZwiftID: X) patterns that weren't replaced
-        modified_message = re.sub(r'\(ZwiftID: [^)]+\)', '', modified_message)
-        
-        return modified_message
+        # Lookup of ZwiftIDs to Discord IDs from the shared users index
+        zwiftid_to_discord = identity_index.zwift_to_discord()
+
+        def _mention(match: "re.Match") -> str:
+            discord_id = zwiftid_to_discord.get(match.group(1).strip())
+            return f"<@{discord_id}>" if discord_id else ""
+
+        # One pass over the message, independent of the number of users
+        return _ZWIFT_ID_MARKER.sub(_mention, message)
 
     def send_to_discord_api(self, channel_id: str, message: str, api_url: str):
         """
@@ -1,7 +1,75 @@
 import requests
+import backoff
 from bs4 import BeautifulSoup
-from collections import defaultdict
+from requests.adapters import HTTPAdapter
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import gzip
+import heapq
 import html
+import json
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+import pytz
+
+from zwiftpower_cache import ZwiftPowerCache, ZwiftPowerLoginRequired, looks_like_json
+from zwiftpower_stream import CHUNK_SIZE, TeamResultsStream, iter_file_chunks
+from zwiftpower_index import EventTitleIndex, event_indexes
+from ratelimit import limiter_for
+
+# Row fields read by analyze_team_results (usable as a projection for stream_team_results)
+ANALYSIS_FIELDS = (
+    "name", "zwid", "zid", "position_in_cat", "f_t", "wkg60", "wkg300", "wkg1200",
+)
+
+# Row fields shown by filter_events_by_title
+EVENT_FILTER_FIELDS = (
+    "name", "zid", "category", "time", "position_in_cat", "wkg60", "wkg300", "wkg1200",
+)
+
+# Event dates are shown in Danish local time (CEST/CET)
+LOCAL_TZ = pytz.timezone('Europe/Copenhagen')
+
+# Bulk profile fetching (see ZwiftPower.fetch_rider_profiles)
+PROFILE_WORKERS = int(os.getenv("ZWIFTPOWER_PROFILE_WORKERS", "8"))
+# Upper bound for a caller-supplied worker count; the session's connection pool is sized to it
+PROFILE_MAX_WORKERS = int(os.getenv("ZWIFTPOWER_PROFILE_MAX_WORKERS", "16"))
+ZWIFTPOWER_MAX_RPS = float(os.getenv("ZWIFTPOWER_MAX_RPS", "5"))
+ZWIFTPOWER_HOST = "zwiftpower.com"
+
+# <th>Zwift Racing Score</th> ... <td>...<b>score</b>...</td> on profile.php
+_ZRS_CELL_RE = re.compile(
+    r'<th[^>]*>[^<]*Zwift Racing Score[^<]*</th>.*?<td[^>]*>(.*?)</td>', re.S | re.I
+)
+_BOLD_RE = re.compile(r'<b(?:\s[^>]*)?>(.*?)</b>', re.S | re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+_DONE = object()
+
+
+class _RetryableStatus(Exception):
+    """ZwiftPower answered 429 or 5xx; the request is worth retrying."""
+
+
+def parse_zrs(page: str) -> Optional[str]:
+    """
+    Extract the Zwift Racing Score from a profile.php page without building a
+    full soup: only the table cell following the "Zwift Racing Score" header
+    is looked at. Returns None when the score is not on the page.
+    """
+    cell = _ZRS_CELL_RE.search(page)
+    if not cell:
+        return None
+    bold = _BOLD_RE.search(cell.group(1))
+    if not bold:
+        return None
+    return html.unescape(_TAG_RE.sub("", bold.group(1))).strip()
 
 class ZwiftPower:
     """
@@ -9,14 +77,30 @@ class ZwiftPower:
     and fetch data from various ZwiftPower endpoints.
     """
 
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str, cache: Optional[ZwiftPowerCache] = None,
+                 sessions=None):
         """
         Initialize the ZwiftPower client. Credentials are saved and
         used during the login() flow.
+
+        If a ZwiftPowerCache is given, team_results/team_riders payloads are
+        served through it; the outcome of the last cached call (hit/miss/age)
+        is available as `last_cache_info`.
+
+        If a session store (zwiftpower_session.ZwiftPowerSessionStore) is
+        given, an api3.php call answered with the login page invalidates the
+        stored session, logs in again and is retried once.
         """
         self.username = username
         self.password = password
+        self.cache = cache
+        self.sessions = sessions
+        self.last_cache_info: Optional[dict] = None
         self.session = requests.Session()
+        # Keep-alive connections for up to PROFILE_MAX_WORKERS threads sharing this session
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(PROFILE_MAX_WORKERS, PROFILE_WORKERS))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         # Spoof a common browser user agent
         self.session.headers.update({
             "User-Agent": (
@@ -77,17 +161,56 @@ class ZwiftPower:
                 f"ZwiftPower final login redirect failed (status={resp4.status_code})"
             )
 
-    def get_team_riders(self, club_id: int) -> dict:
+    def _with_login_retry(self, fetch):
+        """
+        Run fetch(); when ZwiftPower answered with its login page, replace the
+        ended session through the session store and run it once more.
+        """
+        try:
+            return fetch()
+        except ZwiftPowerLoginRequired as e:
+            if self.sessions is None:
+                raise
+            print(f"[WARN] ZwiftPower session ended ({e}); logging in again")
+            self.sessions.invalidate(self.session)
+            self.session = self.sessions.get_session()
+            return fetch()
+
+    def _get_api3(self, endpoint: str, club_id: int, force_refresh: bool = False) -> dict:
+        """
+        Fetch and parse an api3.php endpoint, going through the cache when configured.
+        """
+        url = f"https://zwiftpower.com/api3.php?do={endpoint}&id={club_id}"
+
+        def fetch():
+            if self.cache is None:
+                self.last_cache_info = None
+                resp = self.session.get(url)
+                resp.raise_for_status()  # Raise an exception for non-200
+                if not looks_like_json(resp.content):
+                    raise ZwiftPowerLoginRequired(f"ZwiftPower returned non-JSON content for {endpoint} (club {club_id})")
+                return resp.json()
+
+            body, self.last_cache_info = self.cache.fetch(
+                self.session, endpoint, club_id, url, force_refresh=force_refresh
+            )
+            return json.loads(body)
+
+        return self._with_login_retry(fetch)
+
+    def get_team_riders(self, club_id: int, force_refresh: bool = False) -> dict:
         """
         Fetch JSON data about the riders in a given team/club ID.
         Returns the parsed JSON as a dictionary.
         """
-        url = f"https://zwiftpower.com/api3.php?do=team_riders&id={club_id}"
-        resp = self.session.get(url)
-        resp.raise_for_status()  # Raise an exception for non-200
-        return resp.json()
-
-    def get_team_results(self, club_id: int, allowed_zwids: set[str] | None = None) -> dict:
+        return self._get_api3("team_riders", club_id, force_refresh=force_refresh)
+
+    def get_team_results(
+        self,
+        club_id: int,
+        allowed_zwids: set[str] | None = None,
+        force_refresh: bool = False,
+    ) -> dict:
         """
         Fetch JSON data about the team's results for a given team/club ID.
         Returns the parsed JSON as a dictionary.
@@ -95,10 +218,7 @@ class ZwiftPower:
         If allowed_zwids is provided, filter the returned `data` rows at the source
         so downstream analysis only considers those Zwift IDs.
         """
-        url = f"https://zwiftpower.com/api3.php?do=team_results&id={club_id}"
-        resp = self.session.get(url)
-        resp.raise_for_status()
-        payload = resp.json()
+        payload = self._get_api3("team_results", club_id, force_refresh=force_refresh)
 
         if allowed_zwids:
             allowed = {str(z).strip() for z in allowed_zwids if str(z).strip()}
@@ -115,6 +235,69 @@ class ZwiftPower:
 
         return payload
 
+    def stream_team_results(
+        self,
+        club_id: int,
+        allowed_zwids: Optional[Iterable[str]] = None,
+        fields: Optional[Sequence[str]] = None,
+        force_refresh: bool = False,
+    ) -> TeamResultsStream:
+        """
+        Streaming variant of get_team_results for large clubs.
+
+        Returns a TeamResultsStream: iterate it for the `data` rows and read
+        `.events` for the events map; use it as a context manager so its file
+        is closed. The body is never parsed as a whole; the
+        allowed_zwids filter and the `fields` projection are applied while the
+        bytes are decoded, so filtered-out rows are never built as dicts.
+
+        With a cache the rows are read from the compressed cache file; without
+        one the body is spooled to a temporary file first. Either way the file
+        is opened once and rows and events are read from that one handle, so a
+        concurrent refresh replacing the cache file cannot mix two snapshots.
+        """
+        url = f"https://zwiftpower.com/api3.php?do=team_results&id={club_id}"
+
+        if self.cache is not None:
+            self.last_cache_info = self._with_login_retry(lambda: self.cache.ensure(
+                self.session, "team_results", club_id, url, force_refresh=force_refresh
+            ))
+            handle = open(self.cache.body_path("team_results", club_id), "rb")
+
+            def open_chunks():
+                handle.seek(0)
+                with gzip.GzipFile(fileobj=handle, mode="rb") as f:
+                    yield from iter_file_chunks(f)
+        else:
+            self.last_cache_info = None
+            handle = self._with_login_retry(lambda: self._spool_api3(url, "team_results", club_id))
+
+            def open_chunks():
+                handle.seek(0)
+                yield from iter_file_chunks(handle)
+
+        return TeamResultsStream(open_chunks, allowed_zwids=allowed_zwids, fields=fields, handle=handle)
+
+    def _spool_api3(self, url: str, endpoint: str, club_id: int):
+        """Download an api3.php body into a temporary file (rewound by the reader)."""
+        spool = tempfile.TemporaryFile()
+        try:
+            with self.session.get(url, stream=True) as resp:
+                resp.raise_for_status()
+                checked = False
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    if not checked and chunk.strip():
+                        if not looks_like_json(chunk):
+                            raise ZwiftPowerLoginRequired(
+                                f"ZwiftPower returned non-JSON content for {endpoint} (club {club_id})"
+                            )
+                        checked = True
+                    spool.write(chunk)
+        except Exception:
+            spool.close()
+            raise
+        return spool
+
     def _format_timestamp(self, timestamp):
         """
         Convert Unix timestamp to YYYY-MM-DD HH:MM format in CEST/CET timezone
@@ -125,17 +308,8 @@ class ZwiftPower:
         Returns:
             String with formatted date and time
         """
-        from datetime import datetime
-        import pytz
-        
-        # Convert timestamp to datetime in UTC
-        utc_dt = datetime.fromtimestamp(timestamp, tz=pytz.UTC)
-        
-        # Convert to Europe/Copenhagen timezone (CEST/CET)
-        copenhagen_tz = pytz.timezone('Europe/Copenhagen')
-        local_dt = utc_dt.astimezone(copenhagen_tz)
+        local_dt = datetime.fromtimestamp(timestamp, tz=pytz.UTC).astimezone(LOCAL_TZ)
         
-        # Format the date and time
         return local_dt.strftime('%Y-%m-%d %H:%M')
 
     def _format_time(self, seconds_float):
@@ -163,7 +337,51 @@ class ZwiftPower:
         # Format with leading zeros and milliseconds
         return f"{hours:02d}:{minutes:02d}:{remaining_seconds:02d}.{milliseconds:03d}"
 
-    def filter_events_by_title(self, club_id: int, search_string: str) -> dict:
+    def _format_event_info(self, event_info: dict) -> dict:
+        return {
+            "title": event_info.get("title", ""),
+            "date": self._format_timestamp(event_info.get("date", 0))
+        }
+
+    def _format_rider_row(self, row: dict) -> dict:
+        return {
+            "name": html.unescape(row.get("name", "")),
+            "category": row.get("category"),
+            "time": self._format_time(row.get("time", [None])[0]),
+            "position_in_cat": row.get("position_in_cat"),
+            "20m wkg": row.get("wkg1200", [None])[0],  # 20-min power
+            "5m wkg": row.get("wkg300", [None])[0],    # 5-min power
+            "1m wkg": row.get("wkg60", [None])[0]      # 1-min power
+        }
+
+    def get_event_index(self, club_id: int, force_refresh: bool = False) -> EventTitleIndex:
+        """
+        Return the event title index for a club's current team_results snapshot.
+
+        With a cache the index is built once per snapshot and shared across
+        requests; it is rebuilt when the cache stores a new body. Without a
+        cache it is built for this call only.
+        """
+        with self.stream_team_results(club_id, fields=EVENT_FILTER_FIELDS, force_refresh=force_refresh) as results:
+            snapshot_id = (self.last_cache_info or {}).get("snapshotId")
+
+            def build():
+                return EventTitleIndex(
+                    {"events": results.events, "data": results},
+                    self._format_event_info,
+                    self._format_rider_row,
+                    snapshot_id=snapshot_id,
+                )
+
+            return event_indexes.get(club_id, snapshot_id, build)
+
+    def filter_events_by_title(
+        self,
+        club_id: int,
+        search_string: str,
+        match: str = "substring",
+        force_refresh: bool = False,
+    ) -> dict:
         """
         Filter team results to only include events whose titles match the given pattern.
         Includes detailed rider data and formatted timestamps.
@@ -171,6 +389,13 @@ class ZwiftPower:
         Args:
             club_id (int): The team/club ID to fetch results for
             search_string (str): The pattern to match in event titles (case-insensitive)
+            match (str): How search_string is matched against titles:
+                - "substring": the whole string appears in the title (default)
+                - "all": every word appears in the title
+                - "any": at least one word appears in the title
+                - "prefix": the title starts with these words (e.g. a series name
+                  such as "Tour de Zwift")
+            force_refresh (bool): Bypass the results cache freshness window
             
         Returns:
             dict: A dictionary containing filtered events with their details and rider data:
@@ -196,46 +421,8 @@ class ZwiftPower:
                     ...
                 }
         """
-        # Get all team results
-        team_results = self.get_team_results(club_id)
-        events = team_results["events"]
-        rows = team_results["data"]
-        filtered_results = {}
-        
-        # First find matching events by title
-        for zid, event_info in events.items():
-            title = event_info.get("title", "")
-            if search_string.lower() in title.lower():
-                # Initialize event data with simplified event info
-                filtered_results[zid] = {
-                    "event_info": {
-                        "title": event_info.get("title", ""),
-                        "date": self._format_timestamp(event_info.get("date", 0))
-                    },
-                    "riders": []
-                }
-        
-        # Now collect rider data for each matching event
-        for row in rows:
-            zid = row.get("zid")
-            if zid in filtered_results:
-                # Clean up rider name
-                rider_name = html.unescape(row.get("name", ""))
-                
-                # Create rider data dictionary
-                rider_data = {
-                    "name": rider_name,
-                    "category": row.get("category"),
-                    "time": self._format_time(row.get("time", [None])[0]),
-                    "position_in_cat": row.get("position_in_cat"),
-                    "20m wkg": row.get("wkg1200", [None])[0],  # 20-min power
-                    "5m wkg": row.get("wkg300", [None])[0],    # 5-min power
-                    "1m wkg": row.get("wkg60", [None])[0]      # 1-min power
-                }
-                
-                filtered_results[zid]["riders"].append(rider_data)
-        
-        return filtered_results
+        index = self.get_event_index(club_id, force_refresh=force_refresh)
+        return index.search(search_string, match)
 
     def get_rider_data_json(self, rider_id: int) -> dict:
         """
@@ -261,20 +448,101 @@ class ZwiftPower:
         if resp.status_code != 200:
             return None
 
-        soup = BeautifulSoup(resp.text, "html.parser")
+        return parse_zrs(resp.text)
+
+    def _get_with_retry(self, url: str, max_tries: int = 4) -> requests.Response:
+        """
+        GET a zwiftpower.com URL through the shared per-host rate limiter,
+        retrying connection errors, 429 and 5xx with exponential backoff.
+        Other statuses (e.g. 404 for an unknown rider) are returned as is.
+        """
+        limiter = limiter_for(ZWIFTPOWER_HOST, ZWIFTPOWER_MAX_RPS)
+
+        @backoff.on_exception(
+            backoff.expo, (requests.RequestException, _RetryableStatus), max_tries=max_tries
+        )
+        def _get():
+            limiter.acquire()
+            resp = self.session.get(url, timeout=30)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                retry_after = resp.headers.get("Retry-After", "")
+                if resp.status_code == 429 and retry_after.isdigit():
+                    limiter.pause(float(retry_after))
+                raise _RetryableStatus(f"ZwiftPower returned {resp.status_code} for {url}")
+            return resp
+
+        return _get()
+
+    def _fetch_rider_profile(self, rider_id: Any, include_zrs: bool, max_tries: int) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"data": {}}
+        resp = self._get_with_retry(
+            f"https://zwiftpower.com/cache3/profile/{rider_id}_all.json", max_tries=max_tries
+        )
+        if resp.status_code == 200:
+            result["data"] = resp.json()
+        if include_zrs:
+            resp = self._get_with_retry(f"https://zwiftpower.com/profile.php?z={rider_id}", max_tries=max_tries)
+            result["zrs"] = parse_zrs(resp.text) if resp.status_code == 200 else None
+        return result
+
+    def fetch_rider_profiles(
+        self,
+        rider_ids: Iterable[Any],
+        include_zrs: bool = False,
+        max_workers: Optional[int] = None,
+        max_tries: int = 4,
+    ) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        """
+        Fetch cache3 profiles for many riders concurrently.
+
+        Yields (rider_id, result) as each rider completes (not in input order),
+        where result is:
+            {"data": <profile json, {} when not found>,
+             "zrs": <score or None, only with include_zrs>,
+             "error": <message, only when the rider failed after retries>}
+
+        Workers share this client's session and its connection pool; all
+        requests go through one token bucket for zwiftpower.com
+        (ZWIFTPOWER_MAX_RPS), so raising the worker count never raises the
+        request rate. max_workers is capped at PROFILE_MAX_WORKERS. Duplicate
+        ids are fetched once.
+        """
+        max_workers = min(max(1, max_workers or PROFILE_WORKERS), PROFILE_MAX_WORKERS)
+
+        pending_ids = iter(dict.fromkeys(rider_ids))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="zp-profile") as pool:
+            in_flight = {}
+
+            def _submit_next() -> bool:
+                rider_id = next(pending_ids, _DONE)
+                if rider_id is _DONE:
+                    return False
+                future = pool.submit(self._fetch_rider_profile, rider_id, include_zrs, max_tries)
+                in_flight[future] = rider_id
+                return True
+
+            # Keep a bounded number of requests queued so results stream back early
+            for _ in range(max_workers * 2):
+                if not _submit_next():
+                    break
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rider_id = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"data": {}, "error": str(e)}
+                        if include_zrs:
+                            result["zrs"] = None
+                    yield rider_id, result
+                    _submit_next()
 
-        # Locate the <th> with "Zwift Racing Score", then get next <td> <b>
-        racing_score_th = soup.find("th", string=lambda x: x and "Zwift Racing Score" in x)
-        if racing_score_th:
-            score_td = racing_score_th.find_next("td")
-            if score_td and score_td.find("b"):
-                return score_td.find("b").get_text(strip=True)
-        return None
-    
     def analyze_team_results(self, team_results: dict) -> dict:
         """
         Given a dict from get_team_results (containing 'events' and 'data'),
-        produce three analyses:
+        produce the weekly analyses:
           1) top 10 events (by zid) with participants,
           2) top 10 events (by event title) aggregated,
           3) a list of riders with the most top-3 positions_in_cat.
@@ -282,270 +550,121 @@ class ZwiftPower:
           5) a list of top riders by wkg1200 (20-minute power)
           6) a list of top riders by wkg300 (5-minute power)
           7) a list of top riders by wkg60 (1-minute power)
+          8) a list of riders with the most completed events
 
-        Returns a dict with three keys:
+        The rows are decoded once into a _TeamResultsColumns table and every
+        ranking is taken from it with heap-based top-k selection.
+
+        Returns a dict with the keys:
           {
             "top_10_by_zid": [...],
             "top_10_by_title": [...],
-            "top_3_riders": [...]
+            "most_events_riders": [...],
+            "most_top_3_riders": [...],
+            "winners": [...],
+            "top_watts_per_kg_20min": [...],
+            "top_watts_per_kg_5min": [...],
+            "top_watts_per_kg_1min": [...]
           }
-        }
         """
+        cols = _TeamResultsColumns(team_results)
+        riders = cols.riders
+        row_count = len(cols.row_rider)
+
+        # Single sweep over the columns for every counter we need
+        zid_counts = [0] * len(cols.zids)
+        rider_event_counts = [0] * len(riders)
+        top_3_counter = {}
+        winner_rows = []
+        for i in range(row_count):
+            rider_idx = cols.row_rider[i]
+            zid_counts[cols.row_zid[i]] += 1
+            rider_event_counts[rider_idx] += 1
+            pos = cols.row_pos[i]
+            if cols.row_is_race[i] and pos != _NO_POS and pos <= 3:
+                top_3_counter[rider_idx] = top_3_counter.get(rider_idx, 0) + 1
+                if pos <= 1:
+                    winner_rows.append(i)
+
         # ===========================
         # 1) Top 10 events BY ZID
         # ===========================
-        events = team_results["events"]
-        rows = team_results["data"]
-
-        # Group riders by zid
-        by_event = defaultdict(list)
-        for row in rows:
-            # Use html.unescape() for rider names
-            rider_name = html.unescape(row["name"])
-
-            new_row = dict(row)  # copy to avoid mutating original
-            new_row["name"] = rider_name
-            new_row["position_in_cat"] = row.get("position_in_cat")
-
-            zid = new_row["zid"]
-            by_event[zid].append(new_row)
-
-        # Count how many riders each zid has
-        event_counts = [(zid, len(riders)) for zid, riders in by_event.items()]
-        # Sort descending by participant count
-        event_counts.sort(key=lambda x: x[1], reverse=True)
-        # Take top 10
-        top_zids = event_counts[:10]
-
-        top_10_by_zid = []
-        for zid, rider_count in top_zids:
-            event_info = events.get(zid, {})
-            event_title = event_info.get("title", f"(No title for {zid})")
-            riders_for_this_zid = by_event[zid]
-
-            # Build participant list
-            participants = []
-            for r in riders_for_this_zid:
-                participants.append({
-                    "name": r["name"],
-                    "zwid": r["zwid"],
-                    #"position_in_event": r["position_in_cat"]
-                })
-
-            top_10_by_zid.append({
-                "zid": zid,
-                "title": event_title,
-                "rider_count": rider_count,
-                "participants": participants
-            })
+        top_zid_idxs = heapq.nlargest(10, range(len(zid_counts)), key=zid_counts.__getitem__)
+        participants_by_zid = {zid_idx: [] for zid_idx in top_zid_idxs}
+        for i in range(row_count):
+            participants = participants_by_zid.get(cols.row_zid[i])
+            if participants is not None:
+                name, zwid = riders[cols.row_rider[i]]
+                participants.append({"name": name, "zwid": zwid})
+
+        top_10_by_zid = [
+            {
+                "zid": cols.zids[zid_idx],
+                "title": cols.raw_title(zid_idx),
+                "rider_count": zid_counts[zid_idx],
+                "participants": participants_by_zid[zid_idx],
+            }
+            for zid_idx in top_zid_idxs
+        ]
 
         # ===========================
         # 2) Top 10 events BY TITLE
         # ===========================
-        title_counts = defaultdict(int)
-
-        for row in rows:
-            zid = row["zid"]
-            evt_obj = events.get(zid, {})
-            raw_title = evt_obj.get("title", "(No title)")
-            event_title = html.unescape(raw_title)
-            title_counts[event_title] += 1
-
-        # Sort descending
-        sorted_by_count = sorted(title_counts.items(), key=lambda x: x[1], reverse=True)
-        # Take top 10
-        sorted_by_count = sorted_by_count[:10]
-
-        top_10_by_title = []
-        for title, count in sorted_by_count:
-            top_10_by_title.append({
-                "event_name": title,
-                "participant_count": count
-            })
+        # Several zids can share a title; zids are in first-seen order, so the
+        # title dict keeps the same insertion order as a row-by-row count.
+        title_counts = {}
+        for zid_idx, count in enumerate(zid_counts):
+            title = cols.event_title(zid_idx)
+            title_counts[title] = title_counts.get(title, 0) + count
+
+        top_10_by_title = [
+            {"event_name": title, "participant_count": count}
+            for title, count in heapq.nlargest(10, title_counts.items(), key=lambda x: x[1])
+        ]
 
         # ===========================
         # 3) Riders with the MOST top 3 FINISHES in their category
         # ===========================
-        top_3_counter = defaultdict(int)
-        for row in rows:
-            pos_in_cat = row.get("position_in_cat")
-            type = row.get("f_t")
-            if pos_in_cat is not None and pos_in_cat <= 3 and type == 'TYPE_RACE ':
-                # Convert name
-                rider_name = html.unescape(row["name"])
-                zwid = row["zwid"]
-                # Could key by just zwid or by (rider_name, zwid)
-                key = (rider_name, zwid)
-                top_3_counter[key] += 1
-
-        # Sort by number of top-3 finishes, descending
-        sorted_top_3 = sorted(top_3_counter.items(), key=lambda x: x[1], reverse=True)[:3]
-
         top_3_riders = []
-        for (name, zwid), count in sorted_top_3:
-            top_3_riders.append({
-                "name": name,
-                "zwid": zwid,
-                "top_3_count": count
-            })
-        
+        for rider_idx, count in heapq.nlargest(3, top_3_counter.items(), key=lambda x: x[1]):
+            name, zwid = riders[rider_idx]
+            top_3_riders.append({"name": name, "zwid": zwid, "top_3_count": count})
+
         # ===========================
         # 4) Winners (position_in_cat == 1)
         # ===========================
         winners = []
-        for row in rows:
-            pos_in_cat = row.get("position_in_cat")
-            type = row.get("f_t")
-            if pos_in_cat is not None and pos_in_cat <= 1 and type == 'TYPE_RACE ':
-                # Convert name
-                rider_name = html.unescape(row["name"])
-                zwid = row["zwid"]
-                zid = row["zid"]
-                evt_obj = events.get(zid, {})
-                raw_title = evt_obj.get("title", "(No title)")
-                event_title = html.unescape(raw_title)
-                winners.append({
-                    "name": rider_name,
-                    "zwid": zwid,
-                    "event_title": event_title
-                })
-                
+        for i in winner_rows:
+            name, zwid = riders[cols.row_rider[i]]
+            winners.append({
+                "name": name,
+                "zwid": zwid,
+                "event_title": cols.event_title(cols.row_zid[i]),
+            })
+
         # ==============================================================
         # 5) Top riders by wkg1200 (20-minute power)
         # 6) Top riders by wkg300  (5-minute  power)
+        # 7) Top riders by wkg60   (1-minute  power)
         # ==============================================================
-        # We’ll track each rider’s best 20-min and 5-min stats:
-        # best_20min[(rider_name, zwid)] = {"value": float, "event_title": str}
-        # best_5min [(rider_name, zwid)] = {"value": float, "event_title": str}
-        best_20min = defaultdict(lambda: {"value": 0.0, "event_title": None})
-        best_5min  = defaultdict(lambda: {"value": 0.0, "event_title": None})
-        best_1min  = defaultdict(lambda: {"value": 0.0, "event_title": None})
+        top_wkg1200 = self._top_riders_by_wkg(cols, cols.row_wkg1200, "wkg1200")
+        top_wkg300 = self._top_riders_by_wkg(cols, cols.row_wkg300, "wkg300")
+        top_wkg60 = self._top_riders_by_wkg(cols, cols.row_wkg60, "wkg60")
 
-        for row in rows:
-            rider_name = html.unescape(row["name"])
-            zwid = row["zwid"]
-            rider_id = (rider_name, zwid)
-
-            zid = row["zid"]
-            event_info = events.get(zid, {})
-            # If you want to unescape the event's title just in case
-            raw_title = event_info.get("title", f"(No title for {zid})")
-            event_title = html.unescape(raw_title)
-            
-            wgk60_raw = row.get("wkg60")
-            pos_in_cat = row.get("position_in_cat")
-            if isinstance(wgk60_raw, list) and len(wgk60_raw) > 0:
-                wkg60_str = wgk60_raw[0]
-                # If it's numeric, parse to float
-                if isinstance(wkg60_str, str) and wkg60_str.replace('.', '', 1).isdigit():
-                    val_60 = float(wkg60_str)
-                    # If higher than our current best, update
-                    if val_60 > best_1min[rider_id]["value"]:
-                        best_1min[rider_id]["value"] = val_60
-                        best_1min[rider_id]["event_title"] = event_title
-                        best_1min[rider_id]["position_in_cat"] = pos_in_cat
-
-            # row["wkg1200"] looks like ['3.2', 0] if using your data structure
-            wkg1200_raw = row.get("wkg1200")
-            pos_in_cat = row.get("position_in_cat")
-            if isinstance(wkg1200_raw, list) and len(wkg1200_raw) > 0:
-                wkg1200_str = wkg1200_raw[0]  # e.g. "3.2"
-                # If it's numeric, parse to float
-                if isinstance(wkg1200_str, str) and wkg1200_str.replace('.', '', 1).isdigit():
-                    val_1200 = float(wkg1200_str)
-                    # If higher than our current best, update
-                    if val_1200 > best_20min[rider_id]["value"]:
-                        best_20min[rider_id]["value"] = val_1200
-                        best_20min[rider_id]["event_title"] = event_title
-                        best_20min[rider_id]["position_in_cat"] = pos_in_cat
-
-            # Same logic for wkg300 (5-min)
-            wkg300_raw = row.get("wkg300")
-            pos_in_cat = row.get("position_in_cat")
-            if isinstance(wkg300_raw, list) and len(wkg300_raw) > 0:
-                wkg300_str = wkg300_raw[0]
-                if isinstance(wkg300_str, str) and wkg300_str.replace('.', '', 1).isdigit():
-                    val_300 = float(wkg300_str)
-                    if val_300 > best_5min[rider_id]["value"]:
-                        best_5min[rider_id]["value"] = val_300
-                        best_5min[rider_id]["event_title"] = event_title
-                        best_5min[rider_id]["position_in_cat"] = pos_in_cat
-
-        # Now we can sort them descending by the "value"
-        sorted_20min = sorted(
-            best_20min.items(),
-            key=lambda x: x[1]["value"],
-            reverse=True
-        )[:3]
-
-        sorted_5min = sorted(
-            best_5min.items(),
-            key=lambda x: x[1]["value"],
-            reverse=True
-        )[:3]
-        
-        sorted_1min = sorted(
-            best_1min.items(),
-            key=lambda x: x[1]["value"],
-            reverse=True
-        )[:3]
-
-        # Build final lists
-        top_wkg1200 = []
-        for (name, zwid), info in sorted_20min:
-            top_wkg1200.append({
-                "name": name,
-                "zwid": zwid,
-                "wkg1200": info["value"],
-                "event_title": info["event_title"],
-                "position_in_cat": info["position_in_cat"]
-            })
-
-        top_wkg300 = []
-        for (name, zwid), info in sorted_5min:
-            top_wkg300.append({
-                "name": name,
-                "zwid": zwid,
-                "wkg300": info["value"],
-                "event_title": info["event_title"],
-                "position_in_cat": info["position_in_cat"]
-            })
-        
-        top_wkg60 = []
-        for (name, zwid), info in sorted_1min:
-            top_wkg60.append({
-                "name": name,
-                "zwid": zwid,
-                "wkg60": info["value"],
-                "event_title": info["event_title"],
-                "position_in_cat": info["position_in_cat"]
-            })
-        
         # ===========================
-        # 7) The three riders with the most completed events
+        # 8) The three riders with the most completed events
         # ===========================
-        event_counter = defaultdict(int)
-        for row in rows:
-            # Convert name
-            rider_name = html.unescape(row["name"])
-            zwid = row["zwid"]
-            # Could key by just zwid or by (rider_name, zwid)
-            key = (rider_name, zwid)
-            event_counter[key] += 1
-
-        # Sort by number of top-3 finishes, descending
-        sorted_most_events = sorted(event_counter.items(), key=lambda x: x[1], reverse=True)[:3]
-
         most_event_riders = []
-        for (name, zwid), count in sorted_most_events:
+        for rider_idx in heapq.nlargest(3, range(len(riders)), key=rider_event_counts.__getitem__):
+            name, zwid = riders[rider_idx]
             most_event_riders.append({
                 "name": name,
                 "zwid": zwid,
-                "events_count": count
+                "events_count": rider_event_counts[rider_idx]
             })
 
         # ===========================
-        # Return all three analyses in a dict
+        # Return all analyses in a dict
         # ===========================
         return {
             "top_10_by_zid": top_10_by_zid, # top 10 events with most participants by race id
@@ -556,4 +675,145 @@ class ZwiftPower:
             "top_watts_per_kg_20min": top_wkg1200, # top riders by 20-minute power
             "top_watts_per_kg_5min": top_wkg300, # top riders by 5-minute power
             "top_watts_per_kg_1min": top_wkg60 # top riders by 1-minute power
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def _top_riders_by_wkg(cols: "_TeamResultsColumns", values: array, field: str, k: int = 3) -> list:
+        """
+        Return the k riders with the best w/kg in `values` (one of the wkg columns),
+        together with the event title and category position of that best effort.
+        """
+        # rider index -> [best value, row index of best value]. A rider enters the
+        # dict on their first numeric value (even 0.0), matching first-seen ordering.
+        best = {}
+        for i, val in enumerate(values):
+            if val == _NO_WKG:
+                continue
+            rider_idx = cols.row_rider[i]
+            entry = best.get(rider_idx)
+            if entry is None:
+                entry = best[rider_idx] = [0.0, -1]
+            if val > entry[0]:
+                entry[0] = val
+                entry[1] = i
+
+        out = []
+        for rider_idx, (value, row_idx) in heapq.nlargest(k, best.items(), key=lambda x: x[1][0]):
+            name, zwid = cols.riders[rider_idx]
+            if row_idx >= 0:
+                event_title = cols.wkg_event_title(cols.row_zid[row_idx])
+                pos = cols.row_pos[row_idx]
+                position_in_cat = None if pos == _NO_POS else pos
+            else:
+                event_title = None
+                position_in_cat = None
+            out.append({
+                "name": name,
+                "zwid": zwid,
+                field: value,
+                "event_title": event_title,
+                "position_in_cat": position_in_cat
+            })
+        return out
+
+
+# Sentinels used in the numeric columns of _TeamResultsColumns
+_NO_WKG = -1.0
+_NO_POS = -(2 ** 31)
+
+
+def _parse_wkg(raw) -> float:
+    """Parse a ZwiftPower w/kg cell such as ['3.2', 0]; returns _NO_WKG when not numeric."""
+    if isinstance(raw, list) and raw:
+        value = raw[0]
+        if isinstance(value, str) and value.replace('.', '', 1).isdigit():
+            return float(value)
+    return _NO_WKG
+
+
+class _TeamResultsColumns:
+    """
+    Columnar view of a team_results payload, decoded in a single pass.
+
+    Rider names and event titles are unescaped once per distinct value and
+    interned; every row is reduced to indexes into those tables plus
+    packed numeric columns (positions and the three w/kg durations).
+    """
+
+    __slots__ = (
+        "events", "riders", "zids",
+        "row_rider", "row_zid", "row_pos", "row_is_race",
+        "row_wkg60", "row_wkg300", "row_wkg1200",
+        "_raw_titles", "_titles",
+    )
+
+    def __init__(self, team_results: dict):
+        self.events = team_results["events"]
+        rows = team_results["data"]
+
+        self.riders = []        # rider index -> (unescaped name, zwid)
+        self.zids = []          # zid index -> zid, in first-seen order
+        self._raw_titles = []   # zid index -> raw event title, or None when missing
+        self._titles = {}       # raw title -> unescaped title
+
+        self.row_rider = array("l")
+        self.row_zid = array("l")
+        self.row_pos = array("l")
+        self.row_is_race = bytearray()
+        self.row_wkg60 = array("d")
+        self.row_wkg300 = array("d")
+        self.row_wkg1200 = array("d")
+
+        names = {}              # raw name -> unescaped name
+        rider_index = {}        # (unescaped name, zwid) -> rider index
+        zid_index = {}          # zid -> zid index
+
+        for row in rows:
+            raw_name = row["name"]
+            name = names.get(raw_name)
+            if name is None:
+                name = names[raw_name] = sys.intern(html.unescape(raw_name))
+
+            rider_key = (name, row["zwid"])
+            rider_idx = rider_index.get(rider_key)
+            if rider_idx is None:
+                rider_idx = rider_index[rider_key] = len(self.riders)
+                self.riders.append(rider_key)
+
+            zid = row["zid"]
+            zid_idx = zid_index.get(zid)
+            if zid_idx is None:
+                zid_idx = zid_index[zid] = len(self.zids)
+                self.zids.append(zid)
+                self._raw_titles.append(self.events.get(zid, {}).get("title"))
+
+            pos = row.get("position_in_cat")
+
+            self.row_rider.append(rider_idx)
+            self.row_zid.append(zid_idx)
+            self.row_pos.append(pos if isinstance(pos, int) else _NO_POS)
+            self.row_is_race.append(row.get("f_t") == 'TYPE_RACE ')
+            self.row_wkg60.append(_parse_wkg(row.get("wkg60")))
+            self.row_wkg300.append(_parse_wkg(row.get("wkg300")))
+            self.row_wkg1200.append(_parse_wkg(row.get("wkg1200")))
+
+    def _unescaped(self, raw_title: str) -> str:
+        title = self._titles.get(raw_title)
+        if title is None:
+            title = self._titles[raw_title] = sys.intern(html.unescape(raw_title))
+        return title
+
+    def raw_title(self, zid_idx: int) -> str:
+        """Event title as delivered by ZwiftPower (used for the per-zid listing)."""
+        raw = self._raw_titles[zid_idx]
+        return raw if raw is not None else f"(No title for {self.zids[zid_idx]})"
+
+    def event_title(self, zid_idx: int) -> str:
+        """Unescaped event title, '(No title)' when the event is unknown."""
+        raw = self._raw_titles[zid_idx]
+        return self._unescaped(raw if raw is not None else "(No title)")
+
+    def wkg_event_title(self, zid_idx: int) -> str:
+        """Unescaped event title, '(No title for <zid>)' when the event is unknown."""
+        raw = self._raw_titles[zid_idx]
+        return self._unescaped(raw if raw is not None else f"(No title for {self.zids[zid_idx]})")
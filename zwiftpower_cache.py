@@ -0,0 +1,251 @@
+import os
+import json
+import gzip
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+try:
+    import fcntl  # POSIX only; used to serialize refreshes across worker processes
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+
+class ZwiftPowerLoginRequired(ValueError):
+    """api3.php answered with a page instead of JSON: ZwiftPower ended the session."""
+
+
+def looks_like_json(head: bytes) -> bool:
+    """Whether the start of an api3.php body is JSON (ZwiftPower serves its login page with status 200)."""
+    return head.lstrip()[:1] in (b"{", b"[")
+
+
+class ZwiftPowerCache:
+    """
+    Persistent on-disk cache for ZwiftPower api3.php payloads.
+
+    Entries are keyed by endpoint and club id and stored gzip-compressed next to
+    a small JSON metadata file (fetch time, ETag, Last-Modified). A per-entry
+    file lock makes sure that concurrent requests - threads or gunicorn workers -
+    for the same club trigger a single upstream download; the others wait and
+    read the fresh entry.
+
+    Environment:
+      - ZWIFTPOWER_CACHE_DIR: cache directory (default: <tmp>/zwiftpower_cache)
+      - ZWIFTPOWER_CACHE_TTL_SECONDS: freshness window (default: 300)
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl_seconds: Optional[int] = None):
+        self.cache_dir = (
+            cache_dir
+            or os.getenv("ZWIFTPOWER_CACHE_DIR")
+            or os.path.join(tempfile.gettempdir(), "zwiftpower_cache")
+        )
+        if ttl_seconds is None:
+            ttl_seconds = int(os.getenv("ZWIFTPOWER_CACHE_TTL_SECONDS", "300"))
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Fallback for platforms without fcntl
+        self._thread_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Paths / metadata
+    # ------------------------------------------------------------------
+
+    def _base_path(self, endpoint: str, club_id: int) -> str:
+        return os.path.join(self.cache_dir, f"{endpoint}_{club_id}")
+
+    def body_path(self, endpoint: str, club_id: int) -> str:
+        return self._base_path(endpoint, club_id) + ".json.gz"
+
+    def _meta_path(self, endpoint: str, club_id: int) -> str:
+        return self._base_path(endpoint, club_id) + ".meta.json"
+
+    def read_meta(self, endpoint: str, club_id: int) -> Optional[Dict[str, Any]]:
+        """Return the metadata of a cached entry, or None when nothing is cached."""
+        try:
+            with open(self._meta_path(endpoint, club_id), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self.body_path(endpoint, club_id)):
+            return None
+        return meta if isinstance(meta, dict) else None
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _write_meta(self, endpoint: str, club_id: int, meta: Dict[str, Any]) -> None:
+        self._write_atomic(self._meta_path(endpoint, club_id), json.dumps(meta).encode("utf-8"))
+
+    def _write_body_stream(self, endpoint: str, club_id: int, resp: requests.Response) -> int:
+        """
+        Stream a response body into the compressed cache file without holding it in memory.
+        Returns the uncompressed size.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp-")
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as gz:
+                checked = False
+                for chunk in resp.iter_content(chunk_size=64 * 1024):
+                    if not chunk:
+                        continue
+                    if not checked:
+                        # ZwiftPower answers an expired login with an HTML page and status 200;
+                        # never let that replace a good entry.
+                        head = chunk.lstrip()
+                        if not head:
+                            continue
+                        if not looks_like_json(head):
+                            raise ZwiftPowerLoginRequired(
+                                f"ZwiftPower returned non-JSON content for {endpoint} (club {club_id})"
+                            )
+                        checked = True
+                    gz.write(chunk)
+                    size += len(chunk)
+                if not checked:
+                    raise ValueError(f"ZwiftPower returned an empty body for {endpoint} (club {club_id})")
+            os.replace(tmp_path, self.body_path(endpoint, club_id))
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return size
+
+    def read_body(self, endpoint: str, club_id: int) -> bytes:
+        with gzip.open(self.body_path(endpoint, club_id), "rb") as f:
+            return f.read()
+
+    def _is_fresh(self, meta: Optional[Dict[str, Any]], now: float) -> bool:
+        return bool(meta) and (now - float(meta.get("fetchedAt", 0))) < self.ttl_seconds
+
+    @contextmanager
+    def _entry_lock(self, endpoint: str, club_id: int):
+        if fcntl is None:
+            with self._thread_lock:
+                yield
+            return
+        with open(self._base_path(endpoint, club_id) + ".lock", "a+") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _info(status: str, meta: Dict[str, Any], now: float, error: Optional[str] = None) -> Dict[str, Any]:
+        fetched_at = float(meta.get("fetchedAt", now))
+        info = {
+            "status": status,
+            "ageSeconds": round(max(0.0, now - fetched_at), 1),
+            "fetchedAt": datetime.fromtimestamp(fetched_at, tz=timezone.utc).isoformat(),
+            "snapshotId": meta.get("snapshotId"),
+        }
+        if error:
+            info["error"] = error
+        return info
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def fetch(
+        self,
+        session: requests.Session,
+        endpoint: str,
+        club_id: int,
+        url: str,
+        force_refresh: bool = False,
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """
+        Return (raw JSON body, cache info) for an api3.php endpoint.
+
+        Cache info `status` is one of:
+          - "hit": served from disk within the TTL
+          - "revalidated": upstream answered 304 Not Modified to a conditional request
+          - "miss": downloaded a new body
+          - "stale": upstream failed and an expired entry was served instead
+        """
+        info = self.ensure(session, endpoint, club_id, url, force_refresh=force_refresh)
+        return self.read_body(endpoint, club_id), info
+
+    def ensure(
+        self,
+        session: requests.Session,
+        endpoint: str,
+        club_id: int,
+        url: str,
+        force_refresh: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Make sure a usable entry is on disk (see body_path) and return its cache info.
+        """
+        now = time.time()
+        meta = self.read_meta(endpoint, club_id)
+        if not force_refresh and self._is_fresh(meta, now):
+            return self._info("hit", meta, now)
+
+        with self._entry_lock(endpoint, club_id):
+            # Another worker may have refreshed the entry while we waited for the lock.
+            now = time.time()
+            meta = self.read_meta(endpoint, club_id)
+            if not force_refresh and self._is_fresh(meta, now):
+                return self._info("hit", meta, now)
+
+            headers = {}
+            if meta:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("lastModified"):
+                    headers["If-Modified-Since"] = meta["lastModified"]
+
+            try:
+                with session.get(url, headers=headers, stream=True) as resp:
+                    if resp.status_code == 304 and meta:
+                        meta["fetchedAt"] = now
+                        self._write_meta(endpoint, club_id, meta)
+                        return self._info("revalidated", meta, now)
+
+                    resp.raise_for_status()
+                    size = self._write_body_stream(endpoint, club_id, resp)
+                    etag = resp.headers.get("ETag")
+                    last_modified = resp.headers.get("Last-Modified")
+            except ZwiftPowerLoginRequired:
+                # Not an upstream hiccup: the caller has to log in again (stale data would hide it)
+                raise
+            except (requests.RequestException, ValueError) as e:
+                if meta:
+                    print(f"[WARN] ZwiftPower {endpoint} refresh failed for club {club_id}; serving stale cache: {e}")
+                    return self._info("stale", meta, time.time(), error=str(e))
+                raise
+
+            meta = {
+                "endpoint": endpoint,
+                "clubId": club_id,
+                "fetchedAt": now,
+                "etag": etag,
+                "lastModified": last_modified,
+                "size": size,
+                # Changes whenever a new body is stored; revalidation keeps it.
+                "snapshotId": f"{endpoint}:{club_id}:{int(now * 1000)}",
+            }
+            self._write_meta(endpoint, club_id, meta)
+            return self._info("miss", meta, now)
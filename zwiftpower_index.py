@@ -0,0 +1,204 @@
+import re
+import html
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Title search modes accepted by EventTitleIndex.search
+MATCH_MODES = ("substring", "all", "any", "prefix")
+
+_WORD_RE = re.compile(r"\w+")
+
+# Bound on memoized query results per index; an index only lives for one snapshot.
+_MAX_CACHED_QUERIES = 256
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _words(title: str) -> List[str]:
+    return _WORD_RE.findall(html.unescape(title).lower())
+
+
+class EventTitleIndex:
+    """
+    Search index over the events of one team_results snapshot.
+
+    Built once per snapshot from the `events` map and the `data` rows:
+      - a trigram index over lowercased titles for substring queries
+      - a word index over normalized (unescaped, lowercased) titles for
+        all/any/prefix queries
+      - the rows grouped by zid, already shaped for the filter_events response
+
+    Queries only touch the posting lists of their trigrams/words and are
+    memoized, so repeated queries against the same snapshot are lookups.
+    """
+
+    def __init__(
+        self,
+        team_results: Dict[str, Any],
+        format_event: Callable[[Dict[str, Any]], Dict[str, Any]],
+        format_rider: Callable[[Dict[str, Any]], Dict[str, Any]],
+        snapshot_id: Optional[str] = None,
+    ):
+        self.snapshot_id = snapshot_id
+        events = team_results.get("events") or {}
+
+        self.zids: List[Any] = []
+        self._lower_titles: List[str] = []
+        self._words: List[Tuple[str, ...]] = []
+        self._event_info: Dict[Any, Dict[str, Any]] = {}
+        self._trigram_postings: Dict[str, set] = {}
+        self._word_postings: Dict[str, set] = {}
+
+        for zid, event_info in events.items():
+            idx = len(self.zids)
+            title = event_info.get("title", "") or ""
+            lower = title.lower()
+            words = tuple(_words(title))
+
+            self.zids.append(zid)
+            self._lower_titles.append(lower)
+            self._words.append(words)
+            self._event_info[zid] = format_event(event_info)
+            for gram in _trigrams(lower):
+                self._trigram_postings.setdefault(gram, set()).add(idx)
+            for word in set(words):
+                self._word_postings.setdefault(word, set()).add(idx)
+
+        self._riders: Dict[Any, List[Dict[str, Any]]] = {}
+        for row in team_results.get("data") or ():
+            zid = row.get("zid")
+            if zid in self._event_info:
+                self._riders.setdefault(zid, []).append(format_rider(row))
+
+        self._queries: Dict[Tuple[str, str], Tuple[Any, ...]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.zids)
+
+    # ------------------------------------------------------------------
+    # Matching
+    # ------------------------------------------------------------------
+
+    def _match_substring(self, query: str) -> Iterable[int]:
+        needle = query.lower()
+        if len(needle) < 3:
+            candidates = range(len(self.zids))
+        else:
+            postings = []
+            for gram in _trigrams(needle):
+                posting = self._trigram_postings.get(gram)
+                if not posting:
+                    return ()
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = set.intersection(*postings)
+        # Trigrams only narrow the candidates; confirm with a real substring check.
+        return (i for i in candidates if needle in self._lower_titles[i])
+
+    def _match_words(self, query: str, mode: str) -> Iterable[int]:
+        terms = _words(query)
+        if not terms:
+            return ()
+        postings = [self._word_postings.get(term, set()) for term in terms]
+        if mode == "any":
+            return set().union(*postings)
+
+        postings.sort(key=len)
+        candidates = set.intersection(*postings)
+        if mode == "prefix":
+            n = len(terms)
+            prefix = tuple(terms)
+            return (i for i in candidates if self._words[i][:n] == prefix)
+        return candidates
+
+    def match(self, query: str, mode: str = "substring") -> Tuple[Any, ...]:
+        """Return the zids whose titles match `query`, in events order."""
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode '{mode}' (expected one of: {', '.join(MATCH_MODES)})")
+
+        key = (mode, query)
+        with self._lock:
+            cached = self._queries.get(key)
+        if cached is not None:
+            return cached
+
+        if mode == "substring":
+            hits = self._match_substring(query)
+        else:
+            hits = self._match_words(query, mode)
+        zids = tuple(self.zids[i] for i in sorted(hits))
+
+        with self._lock:
+            if len(self._queries) >= _MAX_CACHED_QUERIES:
+                self._queries.clear()
+            self._queries[key] = zids
+        return zids
+
+    def search(self, query: str, mode: str = "substring") -> Dict[Any, Dict[str, Any]]:
+        """
+        Matching events in the filter_events_by_title response shape:
+        {zid: {"event_info": {...}, "riders": [...]}}
+        """
+        return {
+            zid: {
+                "event_info": dict(self._event_info[zid]),
+                "riders": [dict(r) for r in self._riders.get(zid, ())],
+            }
+            for zid in self.match(query, mode)
+        }
+
+
+class EventIndexRegistry:
+    """
+    Process-wide EventTitleIndex per club, replaced whenever the cached
+    team_results snapshot of that club changes.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[int, EventTitleIndex] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[int, threading.Lock] = {}
+
+    def get(
+        self,
+        club_id: int,
+        snapshot_id: Optional[str],
+        build: Callable[[], EventTitleIndex],
+    ) -> EventTitleIndex:
+        """
+        Return the index for `club_id` at `snapshot_id`, building it with
+        `build()` when missing or stale. Without a snapshot id (no cache)
+        the index is built for this call only.
+        """
+        if snapshot_id is None:
+            return build()
+
+        with self._lock:
+            index = self._indexes.get(club_id)
+            if index is not None and index.snapshot_id == snapshot_id:
+                return index
+            build_lock = self._build_locks.setdefault(club_id, threading.Lock())
+
+        # One build per club at a time; concurrent callers reuse its result.
+        with build_lock:
+            with self._lock:
+                index = self._indexes.get(club_id)
+            if index is not None and index.snapshot_id == snapshot_id:
+                return index
+            index = build()
+            with self._lock:
+                self._indexes[club_id] = index
+            return index
+
+    def invalidate(self, club_id: Optional[int] = None) -> None:
+        with self._lock:
+            if club_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(club_id, None)
+
+
+event_indexes = EventIndexRegistry()
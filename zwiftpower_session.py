@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from zwiftpower import ZwiftPower
+
+try:
+    import fcntl  # POSIX only; used to let a single worker process log in
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+ZWIFTPOWER_DOMAIN = "zwiftpower.com"
+
+
+class SessionLockTimeout(TimeoutError):
+    """Another instance held the login lock for longer than the wait allows."""
+
+
+def serialize_cookies(session: requests.Session) -> List[Dict[str, Any]]:
+    """Dump a session's cookie jar into JSON-serializable dicts."""
+    return [
+        {
+            "name": c.name,
+            "value": c.value,
+            "domain": c.domain,
+            "path": c.path,
+            "expires": c.expires,
+            "secure": bool(c.secure),
+            "rest": dict(getattr(c, "_rest", {}) or {}),
+        }
+        for c in session.cookies
+    ]
+
+
+def restore_cookies(session: requests.Session, cookies: List[Dict[str, Any]]) -> None:
+    """Load cookies produced by serialize_cookies() into a session."""
+    for c in cookies:
+        session.cookies.set(
+            c["name"],
+            c["value"],
+            domain=c.get("domain", ""),
+            path=c.get("path", "/"),
+            expires=c.get("expires"),
+            secure=c.get("secure", False),
+            rest=c.get("rest") or {},
+        )
+
+
+def cookies_look_valid(cookies: List[Dict[str, Any]], now: Optional[float] = None) -> bool:
+    """
+    Cheap, offline check that a stored cookie jar still holds a logged-in
+    ZwiftPower (phpBB) session: there must be unexpired zwiftpower.com
+    cookies, and the phpBB user cookie (`*_u`) must not be the anonymous
+    user (1).
+    """
+    now = time.time() if now is None else now
+    zp_cookies = [
+        c for c in cookies
+        if ZWIFTPOWER_DOMAIN in (c.get("domain") or "")
+        and (c.get("expires") is None or c["expires"] > now)
+    ]
+    if not zp_cookies:
+        return False
+    for c in zp_cookies:
+        if c["name"].startswith("phpbb") and c["name"].endswith("_u"):
+            return c.get("value") not in ("", "1", None)
+    return True
+
+
+class FileSessionBackend:
+    """Stores the session record in a local JSON file; flock serializes logins."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = (
+            path
+            or os.getenv("ZWIFTPOWER_SESSION_FILE")
+            or os.path.join(tempfile.gettempdir(), "zwiftpower_session.json")
+        )
+        self._thread_lock = threading.Lock()
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) else None
+
+    def save(self, record: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-session-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.chmod(tmp_path, 0o600)  # holds live login cookies
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def clear(self) -> None:
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + ".lock", "a+") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class FirestoreSessionBackend:
+    """
+    Stores the session record in a Firestore document so every instance can
+    reuse one login. Logins are serialized with a short lease kept on the same
+    document. Set FIRESTORE_EMULATOR_HOST to run against the local emulator.
+    """
+
+    LEASE_SECONDS = 60
+
+    def __init__(self, collection: str = "system", doc_id: str = "zwiftpower_session"):
+        # Imported lazily so the file backend works without Firestore credentials
+        from firebase import db
+        self._ref = db.collection(collection).document(doc_id)
+        self._thread_lock = threading.Lock()
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        snap = self._ref.get()
+        return snap.to_dict() if snap.exists else None
+
+    def save(self, record: Dict[str, Any]) -> None:
+        self._ref.set(record, merge=True)
+
+    def clear(self) -> None:
+        self._ref.set({"cookies": [], "savedAt": 0}, merge=True)
+
+    def _try_take_lease(self, owner: str) -> bool:
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def _take(transaction):
+            snap = self._ref.get(transaction=transaction)
+            data = snap.to_dict() if snap.exists else {}
+            if float(data.get("leaseUntil") or 0) > time.time() and data.get("leaseOwner") != owner:
+                return False
+            transaction.set(
+                self._ref,
+                {"leaseOwner": owner, "leaseUntil": time.time() + self.LEASE_SECONDS},
+                merge=True,
+            )
+            return True
+
+        return _take(self._ref._client.transaction())
+
+    def _release_lease(self, owner: str) -> None:
+        from firebase_admin import firestore
+
+        @firestore.transactional
+        def _release(transaction):
+            snap = self._ref.get(transaction=transaction)
+            data = snap.to_dict() if snap.exists else {}
+            # Our lease may have expired and been taken over; never release someone else's
+            if data.get("leaseOwner") == owner:
+                transaction.set(self._ref, {"leaseOwner": None, "leaseUntil": 0}, merge=True)
+
+        _release(self._ref._client.transaction())
+
+    @contextmanager
+    def lock(self):
+        owner = uuid.uuid4().hex
+        with self._thread_lock:
+            # Wait for another instance's login at most one lease; an abandoned
+            # lease simply expires. Never proceed without holding the lease.
+            deadline = time.time() + self.LEASE_SECONDS
+            while not self._try_take_lease(owner):
+                if time.time() >= deadline:
+                    raise SessionLockTimeout(f"ZwiftPower login lease still held after {self.LEASE_SECONDS}s")
+                time.sleep(0.5)
+            try:
+                yield
+            finally:
+                self._release_lease(owner)
+
+
+def backend_from_env():
+    """ZWIFTPOWER_SESSION_BACKEND: "file" (default) or "firestore"."""
+    kind = os.getenv("ZWIFTPOWER_SESSION_BACKEND", "file").strip().lower()
+    if kind == "firestore":
+        return FirestoreSessionBackend()
+    return FileSessionBackend()
+
+
+class ZwiftPowerSessionStore:
+    """
+    Authenticated ZwiftPower sessions shared across workers and instances.
+
+    The cookie jar of a successful login is persisted to `backend`. A cold
+    worker restores it (one backend read) instead of repeating the SSO flow.
+    Only one worker logs in at a time; the others wait on the backend lock
+    and pick up the stored cookies.
+    """
+
+    def __init__(self, username: str, password: str, backend=None, max_age: int = 3600):
+        self.username = username
+        self.password = password
+        self.backend = backend if backend is not None else backend_from_env()
+        self.max_age = max_age
+        self._session: Optional[requests.Session] = None
+        self._session_saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def _usable(self, record: Optional[Dict[str, Any]], now: float) -> bool:
+        return (
+            bool(record)
+            and now - float(record.get("savedAt") or 0) < self.max_age
+            and cookies_look_valid(record.get("cookies") or [], now)
+        )
+
+    def _session_from(self, record: Dict[str, Any]) -> requests.Session:
+        session = ZwiftPower(self.username, self.password).session
+        restore_cookies(session, record["cookies"])
+        self._session = session
+        self._session_saved_at = float(record["savedAt"])
+        return session
+
+    def get_session(self) -> requests.Session:
+        """Return a logged-in session: in-process, then from the backend, then via login()."""
+        now = time.time()
+        with self._lock:
+            if self._session is not None and now - self._session_saved_at < self.max_age:
+                return self._session
+
+            record = self.backend.load()
+            if self._usable(record, now):
+                print("Restored ZwiftPower session from session store.")
+                return self._session_from(record)
+
+            try:
+                with self.backend.lock():
+                    # Another worker may have logged in while we waited.
+                    now = time.time()
+                    record = self.backend.load()
+                    if self._usable(record, now):
+                        print("Restored ZwiftPower session logged in by another worker.")
+                        return self._session_from(record)
+
+                    print("No valid ZwiftPower session found. Logging in again.")
+                    zp = ZwiftPower(self.username, self.password)
+                    zp.login()
+                    record = {"cookies": serialize_cookies(zp.session), "savedAt": now}
+                    self.backend.save(record)
+                    self._session = zp.session
+                    self._session_saved_at = now
+                    return zp.session
+            except SessionLockTimeout:
+                # The lock holder is probably still logging in; use its session if it saved one
+                record = self.backend.load()
+                if self._usable(record, time.time()):
+                    print("Restored ZwiftPower session after waiting for another worker's login.")
+                    return self._session_from(record)
+                raise
+
+    def invalidate(self, session: Optional[requests.Session] = None) -> None:
+        """
+        Forget the current session everywhere, e.g. after ZwiftPower served the
+        login page. With `session` (the one that was rejected) nothing is
+        dropped when another thread or worker has logged in since.
+        """
+        with self._lock:
+            if session is not None and self._session is not None and session is not self._session:
+                return
+            saved_at = self._session_saved_at
+            self._session = None
+            self._session_saved_at = 0.0
+            record = self.backend.load()
+            if session is not None and record and float(record.get("savedAt") or 0) > saved_at:
+                return
+            self.backend.clear()
@@ -0,0 +1,259 @@
+import re
+import json
+import codecs
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+# Structural tokens. Strings are matched whole so brackets inside names/titles
+# are never mistaken for structure; a lone quote means the string continues in
+# the next chunk. Scalars (numbers, true/false/null) are skipped by the search.
+_TOKEN_OUTER = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\],:]|"')
+# Inside a row object only nesting matters, so commas and colons are skipped.
+_TOKEN_INNER = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]|"')
+
+# Fast path: a whole row object whose values are scalars, strings or flat
+# arrays (the usual ZwiftPower row shape) is matched in one regex call.
+# `(?=(X))\1` emulates an atomic group, so a row that does not fit this shape
+# fails in linear time and falls back to the token scanner.
+_STR = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_FLAT_ARRAY = r'\[(?=((?:[^{}\[\]"]+|' + _STR + r')*))\2\]'
+_FLAT_ROW = re.compile(
+    r'\s*\{(?=((?:[^{}\[\]"]+|' + _STR + r'|' + _FLAT_ARRAY + r')*))\1\}\s*(?=[,\]])'
+)
+
+# "zwid": 123 or "zwid": "123" inside the raw text of a row
+_ZWID_RE = re.compile(r'"zwid"\s*:\s*"?\s*(-?\d+)')
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_top_level(
+    chunks: Iterable[bytes],
+    stream_key: Optional[str] = "data",
+    capture_keys: Sequence[str] = (),
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    Incrementally scan a JSON document whose top level is an object.
+
+    Yields:
+      - ("row", stream_key, raw_json) for every element of the top-level array
+        stored under `stream_key`, as soon as its closing bracket is seen
+      - ("value", key, raw_json) for every top-level key listed in `capture_keys`
+
+    Only the raw text of the element currently being scanned is buffered;
+    values of other keys are skipped without being kept in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    capture = set(capture_keys)
+
+    buf = ""
+    pos = 0
+    depth = 0
+    key: Optional[str] = None
+    expect_key = False
+    value_start: Optional[int] = None   # start of a captured top-level value
+    stream_pending = False              # saw `"data":`, waiting for its '['
+    in_stream = False
+    elem_start: Optional[int] = None
+
+    def _chunks():
+        for chunk in chunks:
+            if chunk:
+                yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    for text in _chunks():
+        buf += text
+        while True:
+            if in_stream and depth == 2 and pos == elem_start:
+                m = _FLAT_ROW.match(buf, pos)
+                if m is not None:
+                    pos = m.end()
+            token_re = _TOKEN_INNER if depth > 2 else _TOKEN_OUTER
+            m = token_re.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            tok = m.group()
+            if tok == '"':
+                # Unterminated string: wait for the next chunk.
+                pos = m.start()
+                break
+            pos = m.end()
+            c = tok[0]
+
+            if c == '"':
+                if depth == 1 and expect_key:
+                    key = json.loads(tok)
+                    expect_key = False
+                continue
+
+            if c == "{" or c == "[":
+                depth += 1
+                if depth == 1:
+                    expect_key = True
+                elif depth == 2 and stream_pending and c == "[":
+                    in_stream = True
+                    stream_pending = False
+                    elem_start = pos
+                continue
+
+            if c == "}" or c == "]":
+                if depth == 2 and in_stream:
+                    raw = buf[elem_start:m.start()]
+                    if raw.strip():
+                        yield ("row", stream_key, raw)
+                    in_stream = False
+                    elem_start = None
+                elif depth == 1:
+                    if value_start is not None:
+                        yield ("value", key, buf[value_start:m.start()])
+                    value_start = None
+                    stream_pending = False
+                depth -= 1
+                continue
+
+            if c == ":":
+                if depth == 1:
+                    if key in capture:
+                        value_start = pos
+                    elif key == stream_key:
+                        stream_pending = True
+                continue
+
+            # c == ","
+            if depth == 2 and in_stream:
+                yield ("row", stream_key, buf[elem_start:m.start()])
+                elem_start = pos
+            elif depth == 1:
+                if value_start is not None:
+                    yield ("value", key, buf[value_start:m.start()])
+                value_start = None
+                stream_pending = False
+                expect_key = True
+                key = None
+
+        # Drop everything that is no longer needed.
+        keep_from = pos
+        if in_stream and elem_start is not None:
+            keep_from = min(keep_from, elem_start)
+        if value_start is not None:
+            keep_from = min(keep_from, value_start)
+        if keep_from:
+            buf = buf[keep_from:]
+            pos -= keep_from
+            if elem_start is not None:
+                elem_start -= keep_from
+            if value_start is not None:
+                value_start -= keep_from
+
+
+def iter_file_chunks(fileobj, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a binary file object in fixed-size chunks."""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class TeamResultsStream:
+    """
+    Streaming view of a ZwiftPower team_results payload.
+
+    Iterating yields the `data` rows one at a time. When `allowed_zwids` is
+    given, each row's zwid is read from its raw JSON text and rows outside the
+    allowlist are skipped before being decoded, so they are never built as
+    Python dicts. `fields` projects the kept rows to the listed keys.
+
+    `events` is parsed separately (on first access) from its own scan of the
+    source, skipping over the rows. `open_chunks` must return a fresh iterator
+    of bytes over the same payload on every call (e.g. by rewinding one open
+    file); scans run one after the other, not interleaved.
+
+    `handle` is the file the payload is read from; the stream owns it and
+    closes it once the rows and the events have both been read, or on
+    close() / leaving a `with` block, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        open_chunks: Callable[[], Iterable[bytes]],
+        allowed_zwids: Optional[Iterable[Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        handle=None,
+    ):
+        self._open_chunks = open_chunks
+        self._handle = handle
+        self._rows_read = False
+        self.allowed: Optional[set[str]] = None
+        if allowed_zwids:
+            self.allowed = {str(z).strip() for z in allowed_zwids if str(z).strip()}
+        self.fields = tuple(fields) if fields else None
+        self._events: Optional[Dict[str, Any]] = None
+        self.rows_seen = 0
+        self.rows_kept = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        allowed = self.allowed
+        fields = self.fields
+        self.rows_seen = 0
+        self.rows_kept = 0
+        for kind, _, raw in iter_top_level(self._open_chunks(), stream_key="data"):
+            if kind != "row":
+                continue
+            self.rows_seen += 1
+            if allowed is not None:
+                m = _ZWID_RE.search(raw)
+                if not m or m.group(1) not in allowed:
+                    continue
+            try:
+                row = json.loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(row, dict):
+                continue
+            if fields is not None:
+                row = {k: row[k] for k in fields if k in row}
+            self.rows_kept += 1
+            yield row
+        self._rows_read = True
+        self._close_when_read()
+
+    @property
+    def events(self) -> Dict[str, Any]:
+        if self._events is None:
+            events: Dict[str, Any] = {}
+            for kind, _, raw in iter_top_level(
+                self._open_chunks(), stream_key=None, capture_keys=("events",)
+            ):
+                if kind == "value":
+                    try:
+                        parsed = json.loads(raw)
+                    except ValueError:
+                        parsed = None
+                    if isinstance(parsed, dict):
+                        events = parsed
+                    break
+            self._events = events
+            self._close_when_read()
+        return self._events
+
+    def _close_when_read(self) -> None:
+        if self._rows_read and self._events is not None:
+            self.close()
+
+    def close(self) -> None:
+        """Close the underlying file; safe to call more than once."""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self) -> "TeamResultsStream":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Materialize the kept rows in the same shape as get_team_results()."""
+        return {"events": self.events, "data": list(self)}